@@ -0,0 +1,208 @@
+"""
+This module contains the admin endpoints for diagnosing the API server: CPU profiling and memory diagnostics.
+
+Admin endpoints are enabled only if ADMIN_TOKEN environment variable is set.
+Requests must send the token in Authorization header as "Bearer <token>".
+"""
+
+import asyncio
+import os
+import secrets
+from typing import Literal
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query
+from fastapi.responses import FileResponse, JSONResponse
+
+import deps
+import memory
+from framework import mcp_pool
+from run_profiler import PROFILES_DIR, Mode, profiler
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Requests with this header set to the admin token are profiled.
+PROFILE_HEADER = "x-akson-profile"
+PROFILE_MODE_HEADER = "x-akson-profile-mode"
+
+# Longest profile of the whole process. The profiler is busy until it ends.
+MAX_PROFILE_SECONDS = 300
+
+
+def verify_token(authorization: str = Header(default="")):
+    if not ADMIN_TOKEN or not secrets.compare_digest(authorization, f"Bearer {ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+async def profile_process(seconds: float = Query(default=10, gt=0, le=MAX_PROFILE_SECONDS), mode: Mode = "sample"):
+    """Profile the whole process for the given number of seconds."""
+    with profiler.capture("process", mode) as capture:
+        if not capture:
+            return JSONResponse(status_code=409, content={"detail": "Another profile is in progress"})
+        await asyncio.sleep(seconds)
+    return {"profile": os.path.basename(capture.path)}
+
+
+async def profile_assistant(assistant: str, runs: int = 1, mode: Mode = "sample"):
+    """Profile the next runs of the assistant."""
+    profiler.arm(assistant, runs, mode)
+    return {"assistant": assistant, "runs": runs, "mode": mode}
+
+
+async def list_profiles():
+    """List the profiles written so far."""
+    return profiler.list_profiles()
+
+
+async def get_profile(filename: str):
+    """Download a profile."""
+    if filename not in profiler.list_profiles():
+        return JSONResponse(status_code=404, content={"detail": "Profile not found"})
+    return FileResponse(os.path.join(PROFILES_DIR, filename))
+
+
+async def memory_report():
+    """Report approximate memory used by live chats, PubSub topics and runs in progress, and MCP sessions."""
+    return memory.report(deps.pubsub, deps.runs, mcp_pool.pools)
+
+
+async def start_tracemalloc(frames: int = 1):
+    """Start tracing memory allocations. Required for snapshots."""
+    memory.snapshots.start(frames)
+    return {"tracing": True}
+
+
+async def stop_tracemalloc():
+    """Stop tracing memory allocations and drop snapshots."""
+    memory.snapshots.stop()
+    return {"tracing": False}
+
+
+async def take_memory_snapshot(limit: int = 20):
+    """Take a tracemalloc snapshot. Returns its ID and the top allocating locations."""
+    try:
+        snapshot_id = memory.snapshots.take()
+    except RuntimeError:
+        return JSONResponse(status_code=409, content={"detail": "tracemalloc is not started"})
+    return {"id": snapshot_id, "top": memory.snapshots.top(snapshot_id, limit=limit)}
+
+
+async def list_memory_snapshots():
+    return memory.snapshots.list_snapshots()
+
+
+async def diff_memory_snapshots(
+    old_id: int,
+    new_id: int,
+    key_type: Literal["lineno", "filename", "traceback"] = "lineno",
+    limit: int = 20,
+):
+    """Compare two snapshots. Locations that grew the most come first."""
+    try:
+        return memory.snapshots.diff(old_id, new_id, key_type, limit)
+    except KeyError:
+        return JSONResponse(status_code=404, content={"detail": "Snapshot not found"})
+
+
+class ProfileRequestMiddleware:
+    """ASGI middleware that profiles requests sending the profile header with the admin token."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        token = headers.get(PROFILE_HEADER.encode())
+        if not token or not ADMIN_TOKEN or not secrets.compare_digest(token, ADMIN_TOKEN.encode()):
+            return await self.app(scope, receive, send)
+
+        mode = headers.get(PROFILE_MODE_HEADER.encode(), b"sample").decode()
+        with profiler.capture(f"request-{scope['path']}", "cprofile" if mode == "cprofile" else "sample") as capture:
+
+            async def send_wrapper(message):
+                if capture and message["type"] == "http.response.start":
+                    profile = os.path.basename(capture.path).encode()
+                    message["headers"] = [*message.get("headers", []), (PROFILE_HEADER.encode(), profile)]
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+
+def setup_routes(app: FastAPI):
+    if not ADMIN_TOKEN:
+        return
+
+    dependencies = [Depends(verify_token)]
+    app.add_api_route(
+        "/admin/profile",
+        profile_process,
+        methods=["POST"],
+        dependencies=dependencies,
+        summary="Profile the whole process",
+    )
+    app.add_api_route(
+        "/admin/profile/assistants/{assistant}",
+        profile_assistant,
+        methods=["POST"],
+        dependencies=dependencies,
+        summary="Profile the next runs of an assistant",
+    )
+    app.add_api_route(
+        "/admin/profiles",
+        list_profiles,
+        methods=["GET"],
+        dependencies=dependencies,
+        summary="List profiles",
+    )
+    app.add_api_route(
+        "/admin/profiles/{filename}",
+        get_profile,
+        methods=["GET"],
+        dependencies=dependencies,
+        summary="Download a profile",
+    )
+    app.add_api_route(
+        "/admin/memory",
+        memory_report,
+        methods=["GET"],
+        dependencies=dependencies,
+        summary="Report memory used by chats, topics, runs and MCP sessions",
+    )
+    app.add_api_route(
+        "/admin/memory/tracemalloc/start",
+        start_tracemalloc,
+        methods=["POST"],
+        dependencies=dependencies,
+        summary="Start tracing memory allocations",
+    )
+    app.add_api_route(
+        "/admin/memory/tracemalloc/stop",
+        stop_tracemalloc,
+        methods=["POST"],
+        dependencies=dependencies,
+        summary="Stop tracing memory allocations",
+    )
+    app.add_api_route(
+        "/admin/memory/snapshots",
+        take_memory_snapshot,
+        methods=["POST"],
+        dependencies=dependencies,
+        summary="Take a memory snapshot",
+    )
+    app.add_api_route(
+        "/admin/memory/snapshots",
+        list_memory_snapshots,
+        methods=["GET"],
+        dependencies=dependencies,
+        summary="List memory snapshots",
+    )
+    app.add_api_route(
+        "/admin/memory/snapshots/{old_id}/diff/{new_id}",
+        diff_memory_snapshots,
+        methods=["GET"],
+        dependencies=dependencies,
+        summary="Compare two memory snapshots",
+    )
+    app.add_middleware(ProfileRequestMiddleware)
@@ -2,14 +2,20 @@
 akson package contains the Assistant interface that needs to be implemented by assistants.
 """
 
+import contextlib
 import os
 from abc import ABC, abstractmethod
-from typing import Callable, Coroutine, Literal, Optional
+from typing import AsyncIterator, Callable, Coroutine, Literal, Optional
 
 from pydantic import BaseModel, Field
 
+import metrics
 from id_generator import generate_chat_id, generate_message_id
 
+chat_store_duration = metrics.Histogram(
+    "chat_store_seconds", "Time spent loading and saving chat state files.", ("operation",)
+)
+
 
 class ToolCall(BaseModel):
     id: str
@@ -26,6 +32,38 @@ class Message(BaseModel):
     tool_call_id: Optional[str] = None  # Only set if role is "tool"
 
 
+class Usage(BaseModel):
+    """Tokens used by LLM completions."""
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0  # Part of prompt tokens
+    estimated: bool = False
+    """True if some of the tokens were counted locally because the provider did not report usage."""
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, other: "Usage"):
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cached_tokens += other.cached_tokens
+        self.estimated = self.estimated or other.estimated
+
+
+class Candidates(BaseModel):
+    """
+    Alternative replies generated by a retry.
+    The first candidate is in the history until another one is selected. The others are pruned on the next message.
+    """
+
+    start: int
+    """Index of the first message of the candidates in the history"""
+    replies: list[list[Message]]
+    """Messages of each candidate"""
+
+
 class ChatState(BaseModel):
     """Chat that can be saved and loaded from a file."""
 
@@ -33,6 +71,10 @@ class ChatState(BaseModel):
     messages: list[Message] = []
     assistant: Optional[str] = None
     title: Optional[str] = None
+    usage: Usage = Field(default_factory=Usage)
+    """Total tokens used by the assistants in this chat."""
+    candidates: Optional[Candidates] = None
+    """Candidates of the last retry, until one is selected or a new message is sent."""
 
     @classmethod
     def create_new(cls, id: str, assistant: str):
@@ -41,14 +83,16 @@ class ChatState(BaseModel):
     # TODO make this instance method
     @classmethod
     def load_from_disk(cls, chat_id: str):
-        with open(cls.file_path(chat_id), "r") as f:
-            content = f.read()
-            return cls.model_validate_json(content)
+        with metrics.timed(chat_store_duration.labels("load"), "chat_load"):
+            with open(cls.file_path(chat_id), "r") as f:
+                content = f.read()
+                return cls.model_validate_json(content)
 
     def save_to_disk(self):
-        os.makedirs("chats", exist_ok=True)
-        with open(self.file_path(self.id), "w") as f:
-            f.write(self.model_dump_json(indent=2))
+        with metrics.timed(chat_store_duration.labels("save"), "chat_save"):
+            os.makedirs("chats", exist_ok=True)
+            with open(self.file_path(self.id), "w") as f:
+                f.write(self.model_dump_json(indent=2))
 
     @staticmethod
     def file_path(id: str):
@@ -56,6 +100,12 @@ class ChatState(BaseModel):
 
 
 class Reply:
+    """
+    Message that is streamed to clients chunk by chunk.
+
+    Chunks are buffered, so `message` is stale while streaming: its content and tool call do not include the chunks
+    added after the last snapshot. It is complete after end(). Use snapshot() to read the partial message.
+    """
 
     def __init__(self, *, chat: "Chat", role: Literal["assistant", "tool"], name: str):
         self.chat = chat
@@ -64,6 +114,10 @@ class Reply:
             name=name,
             content="",
         )
+        """The message. Stale while streaming, see snapshot()."""
+        # Chunks are buffered and joined into the message when the reply ends or a snapshot is taken.
+        # Appending to the message fields directly would copy the whole string for every chunk.
+        self._buffers: dict[str, list[str]] = {}
 
     # Need to have this method because constructors cannot be async
     @classmethod
@@ -84,20 +138,15 @@ class Reply:
     FieldType = Literal["content", "tool_call.id", "tool_call.name", "tool_call.arguments", "tool_call_id"]
 
     async def add_chunk(self, chunk: str, *, field: FieldType = "content"):
-        if field == "content":
-            self.message.content += chunk
-        elif field == "tool_call_id":
+        if field == "tool_call_id":
             self.message.tool_call_id = chunk
-        elif field.startswith("tool_call."):
-            if not self.message.tool_call:
-                self.message.tool_call = ToolCall(id="", name="", arguments="")
-            match field:
-                case "tool_call.id":
-                    self.message.tool_call.id = chunk
-                case "tool_call.name":
-                    self.message.tool_call.name += chunk
-                case "tool_call.arguments":
-                    self.message.tool_call.arguments += chunk
+        elif field == "tool_call.id":
+            self._buffers[field] = [chunk]
+        else:
+            buffer = self._buffers.get(field)
+            if buffer is None:
+                buffer = self._buffers[field] = []
+            buffer.append(chunk)
         await self.chat._queue_message(
             {
                 "type": "add_chunk",
@@ -107,7 +156,47 @@ class Reply:
             }
         )
 
+    def snapshot(self) -> Message:
+        """Return a copy of the message with the chunks received so far. Can be called while streaming."""
+        self._flush()
+        return self.message.model_copy(deep=True)
+
+    def discard_tool_call(self):
+        """Drop the tool call received so far, e.g. if the stream is interrupted before the tool call is complete."""
+        for field in ("tool_call.id", "tool_call.name", "tool_call.arguments"):
+            self._buffers.pop(field, None)
+        self.message.tool_call = None
+
+    def _flush(self):
+        """Move buffered chunks into the message."""
+        if not self._buffers:
+            return
+        buffers, self._buffers = self._buffers, {}
+        if content := buffers.pop("content", None):
+            self.message.content += "".join(content)
+        if buffers:
+            if not self.message.tool_call:
+                self.message.tool_call = ToolCall(id="", name="", arguments="")
+            tool_call = self.message.tool_call
+            if tool_call_id := buffers.get("tool_call.id"):
+                tool_call.id = tool_call_id[-1]
+            if name := buffers.get("tool_call.name"):
+                tool_call.name += "".join(name)
+            if arguments := buffers.get("tool_call.arguments"):
+                tool_call.arguments += "".join(arguments)
+
+    async def discard(self):
+        """End the reply without adding the message to the chat, e.g. if it is empty after an interrupted stream."""
+        self._buffers.clear()
+        await self.chat._queue_message(
+            {
+                "type": "end_message",
+                "id": self.message.id,
+            }
+        )
+
     async def end(self):
+        self._flush()
         await self.chat._queue_message(
             {
                 "type": "end_message",
@@ -130,6 +219,7 @@ class Chat:
         *,
         state: Optional[ChatState] = None,
         publisher: Optional[Callable[[dict], Coroutine]] = None,
+        batch_publisher: Optional[Callable[[list[dict]], Coroutine]] = None,
     ):
         if not state:
             state = ChatState()
@@ -142,15 +232,58 @@ class Chat:
         # Contains new messages generated during the assistant run.
         self.new_messages: list[Message] = []
 
+        # Tokens used during the assistant run. Also added to the total of the chat state.
+        self.usage = Usage()
+
         # Publishes messages to clients.
         self.publisher = publisher
 
+        # Publishes a group of messages to clients at once. Falls back to publisher if not set.
+        self.batch_publisher = batch_publisher
+
+        # Messages queued inside a batch block
+        self._batch: Optional[list[dict]] = None
+
+    def add_usage(self, usage: Usage):
+        """Record tokens used by a completion."""
+        self.usage.add(usage)
+        self.state.usage.add(usage)
+
     async def reply(self, role: Literal["assistant", "tool"], name: str) -> Reply:
         # category: Optional[Literal["info", "success", "warning", "error"]] = None,
         return await Reply.create(chat=self, role=role, name=name)
 
+    @contextlib.asynccontextmanager
+    async def batch(self) -> AsyncIterator[None]:
+        """
+        Publish the messages queued in the block together when the block exits.
+        Clients receive them as one unit, e.g. a complete tool reply in a single write.
+        Messages are held until the block exits, so do not wait for slow operations in the block.
+        """
+        if self._batch is not None:
+            # Nested blocks are part of the outer batch.
+            yield
+            return
+        self._batch = []
+        try:
+            yield
+        finally:
+            messages, self._batch = self._batch, None
+            await self.publish_many(messages)
+
+    async def publish_many(self, messages: list[dict]):
+        if not messages:
+            return
+        if self.batch_publisher:
+            await self.batch_publisher(messages)
+        elif self.publisher:
+            for message in messages:
+                await self.publisher(message)
+
     async def _queue_message(self, message: dict):
-        if self.publisher:
+        if self._batch is not None:
+            self._batch.append(message)
+        elif self.publisher:
             await self.publisher(message)
 
 
@@ -0,0 +1,9 @@
+from framework import Router
+
+auto = Router(
+    name="Auto",
+    description="Answers simple messages with a fast model and the rest with a strong model.",
+    fast_model="gpt-4.1-nano",
+    strong_model="gpt-4.1",
+    classifier_model="gpt-4.1-nano",
+)
@@ -0,0 +1,286 @@
+"""
+This module contains the batch completion endpoints for bulk offline workloads.
+
+A batch is a JSONL body of OpenAI style requests, one per line:
+    {"custom_id": "request-1", "body": {"model": "ChatGPT", "messages": [{"role": "user", "content": "Hi"}]}}
+
+Requests are executed by a pool of workers shared by all batches. They are sent with background priority,
+so the limits of the LLM scheduler apply and interactive chats go ahead of batches.
+Results are appended to a JSONL file in completion order and can be streamed while the batch is running.
+"""
+
+import asyncio
+import json
+import os
+from datetime import datetime
+from enum import StrEnum
+from typing import AsyncIterator, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+
+from deps import registry
+from framework.scheduler import Priority, scheduler
+from id_generator import generate_batch_id
+from logger import logger
+from openai_compat import ChatCompletionRequest, create_completion
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "16"))
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "50000"))
+
+
+class BatchRequest(BaseModel):
+    """A line of the batch input. Same format as the input files of OpenAI Batch API."""
+
+    custom_id: str
+    method: str = "POST"
+    url: str = "/v1/chat/completions"
+    body: ChatCompletionRequest
+
+
+class BatchStatus(StrEnum):
+    IN_PROGRESS = "in_progress"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class Batch(BaseModel):
+    """Status of a batch. Saved to a file when the batch finishes, results are saved in a separate JSONL file."""
+
+    id: str = Field(default_factory=generate_batch_id)
+    status: BatchStatus = BatchStatus.IN_PROGRESS
+    created_at: datetime = Field(default_factory=datetime.now)
+    finished_at: Optional[datetime] = None
+    total: int
+    completed: int = 0
+    """Number of requests completed successfully"""
+    failed: int = 0
+    """Number of requests completed with an error"""
+    error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status != BatchStatus.IN_PROGRESS
+
+    @classmethod
+    def load_from_disk(cls, batch_id: str):
+        with open(cls.file_path(batch_id), "r") as f:
+            return cls.model_validate_json(f.read())
+
+    def save_to_disk(self):
+        os.makedirs("batches", exist_ok=True)
+        with open(self.file_path(self.id), "w") as f:
+            f.write(self.model_dump_json(indent=2))
+
+    @staticmethod
+    def file_path(id: str):
+        return os.path.join("batches", f"{id}.json")
+
+    @staticmethod
+    def results_path(id: str):
+        return os.path.join("batches", f"{id}.jsonl")
+
+
+class Batches:
+    """Executes batches. At most `workers` requests are in progress across all batches."""
+
+    def __init__(self, workers: int = 16):
+        self.workers = workers
+        self._slots = asyncio.Semaphore(workers)
+        # Batches in progress
+        self._batches: dict[str, Batch] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        # Set when results are written. Replaced after each write, so readers can wait for the next one.
+        self._changed: dict[str, asyncio.Event] = {}
+
+    def submit(self, requests: list[BatchRequest]) -> Batch:
+        """Start executing the requests in the background. Returns immediately."""
+        batch = Batch(total=len(requests))
+        batch.save_to_disk()
+        open(Batch.results_path(batch.id), "w").close()
+        self._batches[batch.id] = batch
+        self._changed[batch.id] = asyncio.Event()
+        self._tasks[batch.id] = asyncio.create_task(self._execute(batch, requests))
+        logger.info("Started batch %s with %d requests", batch.id, batch.total)
+        return batch
+
+    def get(self, batch_id: str) -> Optional[Batch]:
+        batch = self._batches.get(batch_id)
+        if batch:
+            return batch
+        try:
+            batch = Batch.load_from_disk(batch_id)
+        except FileNotFoundError:
+            return None
+        if not batch.finished:
+            # Batches are not resumed. Results written before the restart are kept.
+            batch.status = BatchStatus.FAILED
+            batch.error = "Interrupted by server restart"
+            batch.save_to_disk()
+        return batch
+
+    def cancel(self, batch_id: str) -> bool:
+        """Cancel the batch. Requests in progress are cancelled, results written so far are kept."""
+        task = self._tasks.get(batch_id)
+        if not task:
+            return False
+        task.cancel()
+        return True
+
+    async def results(self, batch_id: str) -> AsyncIterator[bytes]:
+        """Yield the results written so far, then the new results as they are written until the batch finishes."""
+        offset = 0
+        while True:
+            # Must be taken before reading, so a write after the read is not missed.
+            changed = self._changed.get(batch_id)
+            with open(Batch.results_path(batch_id), "rb") as f:
+                f.seek(offset)
+                data = f.read()
+            # Only complete lines
+            end = data.rfind(b"\n") + 1
+            if end:
+                offset += end
+                yield data[:end]
+            if changed is None:
+                return
+            await changed.wait()
+
+    async def _execute(self, batch: Batch, requests: list[BatchRequest]):
+        pending = iter(enumerate(requests))
+        with open(Batch.results_path(batch.id), "a") as results:
+
+            async def worker():
+                for index, request in pending:
+                    async with self._slots:
+                        result = await self._complete(batch, index, request)
+                    if result["error"]:
+                        batch.failed += 1
+                    else:
+                        batch.completed += 1
+                    results.write(json.dumps(result) + "\n")
+                    results.flush()
+                    self._notify(batch.id)
+
+            try:
+                with scheduler.priority(Priority.BACKGROUND):
+                    await asyncio.gather(*(worker() for _ in range(min(self.workers, len(requests)))))
+            except asyncio.CancelledError:
+                batch.status = BatchStatus.CANCELLED
+            except Exception as e:
+                logger.exception("Batch %s failed", batch.id)
+                batch.status = BatchStatus.FAILED
+                batch.error = str(e)
+            else:
+                batch.status = BatchStatus.COMPLETED
+            finally:
+                batch.finished_at = datetime.now()
+                batch.save_to_disk()
+                del self._batches[batch.id]
+                del self._tasks[batch.id]
+                self._notify(batch.id)
+                del self._changed[batch.id]
+                logger.info("Batch %s %s", batch.id, batch.status)
+
+    async def _complete(self, batch: Batch, index: int, request: BatchRequest) -> dict:
+        result: dict = {"id": f"{batch.id}-{index}", "custom_id": request.custom_id, "response": None, "error": None}
+        try:
+            response = await create_completion(request.body)
+            result["response"] = {"status_code": 200, "body": response.model_dump(mode="json")}
+        except Exception as e:
+            logger.error("Request %s of batch %s failed: %s", request.custom_id, batch.id, e)
+            result["error"] = {"code": e.__class__.__name__, "message": str(e)}
+        return result
+
+    def _notify(self, batch_id: str):
+        event = self._changed[batch_id]
+        self._changed[batch_id] = asyncio.Event()
+        event.set()
+
+
+batches = Batches(BATCH_WORKERS)
+
+
+def parse_requests(content: bytes) -> list[BatchRequest]:
+    """Parse a JSONL body. Raises ValueError with the line number of the first invalid line."""
+    requests = []
+    custom_ids = set()
+    for number, line in enumerate(content.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            request = BatchRequest.model_validate_json(line)
+        except ValidationError as e:
+            raise ValueError(f"Line {number}: {e}") from None
+        if request.url != "/v1/chat/completions":
+            raise ValueError(f"Line {number}: Unsupported url {request.url}")
+        if request.custom_id in custom_ids:
+            raise ValueError(f"Line {number}: Duplicate custom_id {request.custom_id}")
+        custom_ids.add(request.custom_id)
+        requests.append(request)
+    if not requests:
+        raise ValueError("Batch is empty")
+    if len(requests) > BATCH_MAX_REQUESTS:
+        raise ValueError(f"Batch has more than {BATCH_MAX_REQUESTS} requests")
+    return requests
+
+
+async def create_batch(request: Request, stream: bool = False):
+    """
+    Start a batch of chat completion requests. The body is JSONL, e.g. sent with `curl --data-binary @requests.jsonl`.
+    Returns the batch with status code 202, or streams the results as JSONL if stream is true.
+    The batch continues if the client of the stream disconnects.
+    """
+    try:
+        requests = parse_requests(await request.body())
+    except ValueError as e:
+        return JSONResponse(status_code=422, content={"detail": str(e)})
+    # Fail early for unknown assistants
+    for model in {item.body.model for item in requests}:
+        registry.get_assistant(model)
+
+    batch = batches.submit(requests)
+    if stream:
+        return StreamingResponse(
+            batches.results(batch.id),
+            media_type="application/x-ndjson",
+            headers={"X-Batch-Id": batch.id},
+        )
+    return JSONResponse(status_code=202, content=batch.model_dump(mode="json"))
+
+
+async def get_batch(batch_id: str):
+    """Return the status of a batch."""
+    batch = batches.get(batch_id)
+    if not batch:
+        return JSONResponse(status_code=404, content={"detail": "Batch not found"})
+    return batch
+
+
+async def get_batch_results(batch_id: str):
+    """Return the results of a batch as JSONL in completion order. Streams until the batch finishes."""
+    if not batches.get(batch_id):
+        return JSONResponse(status_code=404, content={"detail": "Batch not found"})
+    return StreamingResponse(batches.results(batch_id), media_type="application/x-ndjson")
+
+
+async def cancel_batch(batch_id: str):
+    """Cancel a batch in progress."""
+    if not batches.get(batch_id):
+        return JSONResponse(status_code=404, content={"detail": "Batch not found"})
+    return {"cancelled": batches.cancel(batch_id)}
+
+
+def setup_routes(app: FastAPI):
+    app.add_api_route(
+        "/batches",
+        create_batch,
+        methods=["POST"],
+        response_model=Batch,
+        status_code=202,
+        summary="Start a batch of chat completion requests",
+    )
+    app.add_api_route("/batches/{batch_id}", get_batch, methods=["GET"], response_model=Batch)
+    app.add_api_route("/batches/{batch_id}/results", get_batch_results, methods=["GET"])
+    app.add_api_route("/batches/{batch_id}/cancel", cancel_batch, methods=["POST"])
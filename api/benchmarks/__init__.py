@@ -0,0 +1,6 @@
+"""
+Benchmarks for the API server.
+
+Run from the api directory, e.g. `python -m benchmarks.e2e --chats 20 --subscribers 2`
+or `python -m benchmarks.microbench --compare`.
+"""
@@ -0,0 +1,276 @@
+"""
+End-to-end streaming benchmark.
+
+Starts the fake LLM provider and the API server in subprocesses,
+then drives concurrent chats, each with multiple SSE subscribers, and reports the results as JSON.
+
+Measured per turn:
+- Time to first token: from sending the message until the first chunk is received by a subscriber
+- Latency: from sending the message until the response is received
+- Delivered: from sending the message until the last reply is received by all subscribers
+Measured for the API server process: CPU time and resident set size, read from /proc (Linux only).
+
+Usage: python -m benchmarks.e2e --chats 20 --subscribers 2 --turns 3 --tokens 200 --rate 100 --output result.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import httpx
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Subscriber:
+    """Reads the events of a chat and records when they are received."""
+
+    def __init__(self, client: httpx.AsyncClient, chat_id: str):
+        self.client = client
+        self.chat_id = chat_id
+        self.events = 0
+        self.first_chunk_at: Optional[float] = None
+        self.connected = asyncio.Event()
+        self._ended: dict[str, asyncio.Event] = {}
+
+    async def run(self):
+        async with self.client.stream("GET", f"/chats/{self.chat_id}/events") as response:
+            self.connected.set()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                event = json.loads(line[5:])
+                self.events += 1
+                if event["type"] == "add_chunk" and self.first_chunk_at is None:
+                    self.first_chunk_at = time.perf_counter()
+                elif event["type"] == "end_message":
+                    self._end_event(event["id"]).set()
+
+    def _end_event(self, message_id: str) -> asyncio.Event:
+        return self._ended.setdefault(message_id, asyncio.Event())
+
+    async def wait_for_end(self, message_id: str):
+        await self._end_event(message_id).wait()
+
+
+async def run_chat(client: httpx.AsyncClient, chat_id: str, args) -> tuple[list[dict], int]:
+    """Send messages to a chat one by one. Returns the measurements of each turn and the number of events received."""
+    subscribers = [Subscriber(client, chat_id) for _ in range(args.subscribers)]
+    tasks = [asyncio.create_task(subscriber.run()) for subscriber in subscribers]
+    turns = []
+    try:
+        await asyncio.gather(*(subscriber.connected.wait() for subscriber in subscribers))
+        # Subscription happens after the response headers are sent.
+        await asyncio.sleep(0.1)
+
+        for turn in range(args.turns):
+            for subscriber in subscribers:
+                subscriber.first_chunk_at = None
+            started = time.perf_counter()
+            try:
+                response = await client.post(
+                    f"/chats/{chat_id}/messages", json={"content": f"Message {turn}", "assistant": "Benchmark"}
+                )
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                turns.append({"error": f"{e.__class__.__name__}: {e}"})
+                continue
+            latency = time.perf_counter() - started
+
+            # Wait until all subscribers have received the last message.
+            messages = response.json()
+            if messages and subscribers:
+                last_id = messages[-1]["id"]
+                await asyncio.wait_for(
+                    asyncio.gather(*(subscriber.wait_for_end(last_id) for subscriber in subscribers)),
+                    timeout=args.timeout,
+                )
+            delivered = time.perf_counter() - started
+
+            first_chunks = [s.first_chunk_at for s in subscribers if s.first_chunk_at is not None]
+            turns.append(
+                {
+                    "latency": latency,
+                    "delivered": delivered,
+                    "ttft": min(first_chunks) - started if first_chunks else None,
+                }
+            )
+    finally:
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Subscriber of {chat_id} failed: {result!r}", file=sys.stderr)
+    return turns, sum(subscriber.events for subscriber in subscribers)
+
+
+def summarize(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def percentile(p: float) -> float:
+        return values[min(len(values) - 1, int(p * len(values)))]
+
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "min": values[0],
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "max": values[-1],
+    }
+
+
+class ProcessStats:
+    """Samples CPU time and resident set size of a process from /proc."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.peak_rss = 0
+
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            # Command name may contain spaces, fields after it are separated by single spaces.
+            fields = f.read().rsplit(")", 1)[1].split()
+        utime, stime = int(fields[11]), int(fields[12])
+        return (utime + stime) / self.ticks
+
+    def rss(self) -> int:
+        with open(f"/proc/{self.pid}/statm") as f:
+            rss = int(f.read().split()[1]) * self.page_size
+        self.peak_rss = max(self.peak_rss, rss)
+        return rss
+
+    async def sample_rss(self, interval: float = 0.1):
+        while True:
+            self.rss()
+            await asyncio.sleep(interval)
+
+
+def start_process(*args: str) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", *args], cwd=API_DIR)
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Process exited with code {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise TimeoutError(f"{url} is not ready after {timeout} seconds")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=API_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark(args) -> dict:
+    llm_url = f"http://{args.host}:{args.llm_port}"
+    api_url = f"http://{args.host}:{args.api_port}"
+    llm = start_process(
+        "benchmarks.fake_llm",
+        f"--host={args.host}",
+        f"--port={args.llm_port}",
+        f"--tokens={args.tokens}",
+        f"--rate={args.rate}",
+        f"--tool-calls={args.tool_calls}",
+        f"--first-token-delay={args.first_token_delay}",
+    )
+    api = start_process(
+        "benchmarks.server", f"--host={args.host}", f"--port={args.api_port}", f"--llm-url={llm_url}/v1"
+    )
+    try:
+        await wait_until_ready(f"{llm_url}/docs", llm)
+        await wait_until_ready(f"{api_url}/health", api)
+
+        stats = ProcessStats(api.pid)
+        sampler = asyncio.create_task(stats.sample_rss())
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        timeout = httpx.Timeout(args.timeout, read=None)
+        async with httpx.AsyncClient(base_url=api_url, limits=limits, timeout=timeout) as client:
+            idle_rss = stats.rss()
+            cpu_started = stats.cpu_seconds()
+            started = time.perf_counter()
+            results = await asyncio.gather(*(run_chat(client, f"benchmark{i}", args) for i in range(args.chats)))
+            duration = time.perf_counter() - started
+            cpu = stats.cpu_seconds() - cpu_started
+        sampler.cancel()
+
+        turns = [turn for chat_turns, _ in results for turn in chat_turns]
+        events = sum(chat_events for _, chat_events in results)
+        succeeded = [turn for turn in turns if "error" not in turn]
+        return {
+            "turns": len(turns),
+            "errors": len(turns) - len(succeeded),
+            "duration_seconds": duration,
+            "turns_per_second": len(succeeded) / duration,
+            "ttft_seconds": summarize([turn["ttft"] for turn in succeeded if turn["ttft"] is not None]),
+            "latency_seconds": summarize([turn["latency"] for turn in succeeded]),
+            "delivered_seconds": summarize([turn["delivered"] for turn in succeeded]),
+            "events": events,
+            "events_per_second": events / duration,
+            "cpu_seconds": cpu,
+            "cpu_utilization": cpu / duration,
+            "idle_rss_bytes": idle_rss,
+            "peak_rss_bytes": stats.peak_rss,
+        }
+    finally:
+        for process in (api, llm):
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=10, help="Number of concurrent chats")
+    parser.add_argument("--subscribers", type=int, default=1, help="Number of SSE subscribers per chat")
+    parser.add_argument("--turns", type=int, default=3, help="Number of messages sent to each chat")
+    parser.add_argument("--tokens", type=int, default=200, help="Number of tokens in each reply")
+    parser.add_argument("--rate", type=float, default=0, help="Tokens per second per reply. 0 means no delay.")
+    parser.add_argument("--tool-calls", type=int, default=0, help="Number of tool calls before each reply")
+    parser.add_argument("--first-token-delay", type=float, default=0, help="Seconds before the first token")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for each turn")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--llm-port", type=int, default=9100)
+    parser.add_argument("--api-port", type=int, default=9200)
+    parser.add_argument("--output", help="Write results to this file instead of stdout")
+    args = parser.parse_args()
+
+    config = {name: value for name, value in vars(args).items() if name not in ("output", "host")}
+    results = asyncio.run(benchmark(args))
+    report = {
+        "benchmark": "e2e",
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": config,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
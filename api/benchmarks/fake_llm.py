@@ -0,0 +1,131 @@
+"""
+Fake OpenAI compatible LLM provider for benchmarks.
+
+Streams chat completion chunks at a fixed rate without doing any work, so the API server is the only bottleneck.
+If tool calls are enabled, the first replies of a turn call the "lookup" tool and the last one answers with text.
+
+Usage: python -m benchmarks.fake_llm --port 9100 --tokens 200 --rate 100 --tool-calls 1
+"""
+
+import argparse
+import asyncio
+import json
+import secrets
+import time
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+
+@dataclass
+class Config:
+    tokens: int = 200
+    """Number of content tokens in a text reply"""
+    rate: float = 0
+    """Tokens per second per request. 0 means no delay."""
+    tool_calls: int = 0
+    """Number of tool calls made before answering with text"""
+    first_token_delay: float = 0
+    """Seconds to wait before the first token"""
+
+
+def create_app(config: Config) -> FastAPI:
+    app = FastAPI(title="Fake LLM")
+
+    @app.post("/v1/chat/completions")
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        # Count tool replies since the last user message to decide whether to call a tool or answer.
+        tool_replies = 0
+        for message in reversed(body["messages"]):
+            if message["role"] == "user":
+                break
+            if message["role"] == "tool":
+                tool_replies += 1
+        call_tool = bool(body.get("tools")) and tool_replies < config.tool_calls
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        return StreamingResponse(
+            _stream(config, body.get("model", "fake"), call_tool, include_usage),
+            media_type="text/event-stream",
+        )
+
+    return app
+
+
+async def _stream(config: Config, model: str, call_tool: bool, include_usage: bool):
+    completion_id = f"chatcmpl-{secrets.token_hex(12)}"
+    created = int(time.time())
+    interval = 1 / config.rate if config.rate else 0
+
+    def chunk(delta: dict, finish_reason=None) -> str:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(data)}\n\n"
+
+    if config.first_token_delay:
+        await asyncio.sleep(config.first_token_delay)
+
+    if call_tool:
+        tool_call = {
+            "index": 0,
+            "id": f"call_{secrets.token_hex(12)}",
+            "type": "function",
+            "function": {"name": "lookup", "arguments": ""},
+        }
+        yield chunk({"role": "assistant", "content": None, "tool_calls": [tool_call]})
+        for part in ('{"query": ', '"benchmark"}'):
+            await asyncio.sleep(interval)
+            yield chunk({"tool_calls": [{"index": 0, "function": {"arguments": part}}]})
+        yield chunk({}, "tool_calls")
+        completion_tokens = 3
+    else:
+        yield chunk({"role": "assistant", "content": ""})
+        for i in range(config.tokens):
+            if interval:
+                await asyncio.sleep(interval)
+            yield chunk({"content": f"token{i} "})
+        yield chunk({}, "stop")
+        completion_tokens = config.tokens
+
+    if include_usage:
+        usage = {"prompt_tokens": 10, "completion_tokens": completion_tokens, "total_tokens": 10 + completion_tokens}
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [],
+            "usage": usage,
+        }
+        yield f"data: {json.dumps(data)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--tokens", type=int, default=Config.tokens)
+    parser.add_argument("--rate", type=float, default=Config.rate)
+    parser.add_argument("--tool-calls", type=int, default=Config.tool_calls)
+    parser.add_argument("--first-token-delay", type=float, default=Config.first_token_delay)
+    args = parser.parse_args()
+    config = Config(
+        tokens=args.tokens,
+        rate=args.rate,
+        tool_calls=args.tool_calls,
+        first_token_delay=args.first_token_delay,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""
+Microbenchmarks for the code that runs per token or per request.
+
+Inputs are generated with a fixed seed, so results of different commits are comparable on the same machine.
+Each case is run once for warm up, then timed several times. The fastest run is used for comparison
+because it is the least affected by other processes.
+
+Usage:
+    python -m benchmarks.microbench                    # Run all cases and print results
+    python -m benchmarks.microbench --save-baseline    # Store results as the baseline
+    python -m benchmarks.microbench --compare          # Fail if a case is slower than the baseline by the threshold
+    python -m benchmarks.microbench streaming.content  # Run selected cases
+
+Cases can also be run with pytest by setting AKSON_BENCHMARK=1.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import AsyncContextManager, Awaitable, Callable
+
+SEED = 1234
+REPEAT = 10
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Relative slowdown reported as a regression
+THRESHOLD = 0.2
+
+Run = Callable[[], Awaitable[None]]
+
+
+@dataclass
+class Case:
+    name: str
+    operations: int
+    """Number of operations done by a single run, e.g. number of deltas"""
+    setup: Callable[[random.Random], AsyncContextManager[Run]]
+    """Prepares the inputs and yields the function to time"""
+
+
+cases: dict[str, Case] = {}
+
+
+def case(name: str, operations: int):
+    def decorator(func):
+        cases[name] = Case(name, operations, contextlib.asynccontextmanager(func))
+        return func
+
+    return decorator
+
+
+def _text(rng: random.Random, length: int) -> str:
+    return "".join(rng.choices(string.ascii_letters + " ", k=length))
+
+
+@case("streaming.content", operations=10_000)
+async def streaming_content(rng: random.Random):
+    from litellm.types.utils import Delta
+
+    from framework.streaming import MessageBuilder
+
+    deltas = [Delta(role="assistant", content="")] + [Delta(content=_text(rng, 4)) for _ in range(10_000)]
+
+    async def run():
+        builder = MessageBuilder()
+        for delta in deltas:
+            builder.write(delta)
+        builder.getvalue()
+
+    yield run
+
+
+@case("streaming.tool_call", operations=10_000)
+async def streaming_tool_call(rng: random.Random):
+    from litellm.types.utils import ChatCompletionDeltaToolCall, Delta, Function
+
+    from framework.streaming import MessageBuilder
+
+    first = ChatCompletionDeltaToolCall(
+        index=0, id="call_1", type="function", function=Function(name="search", arguments="")
+    )
+    deltas = [Delta(role="assistant", tool_calls=[first])] + [
+        Delta(tool_calls=[ChatCompletionDeltaToolCall(index=0, function=Function(arguments=_text(rng, 4)))])
+        for _ in range(10_000)
+    ]
+
+    async def run():
+        builder = MessageBuilder()
+        for delta in deltas:
+            builder.write(delta)
+        builder.getvalue()
+
+    yield run
+
+
+@case("reply.add_chunk", operations=10_000)
+async def reply_add_chunk(rng: random.Random):
+    from akson import Chat
+
+    chunks = [_text(rng, 4) for _ in range(10_000)]
+
+    async def publish(_):
+        pass
+
+    async def run():
+        chat = Chat(publisher=publish)
+        reply = await chat.reply("assistant", name="Benchmark")
+        for chunk in chunks:
+            await reply.add_chunk(chunk)
+        await reply.end()
+
+    yield run
+
+
+@case("reply.long_tool_call", operations=100_000)
+async def reply_long_tool_call(rng: random.Random):
+    from akson import Chat
+
+    chunks = [_text(rng, 8) for _ in range(100_000)]
+
+    async def publish(_):
+        pass
+
+    async def run():
+        chat = Chat(publisher=publish)
+        reply = await chat.reply("assistant", name="Benchmark")
+        await reply.add_chunk("call_1", field="tool_call.id")
+        await reply.add_chunk("write_file", field="tool_call.name")
+        for chunk in chunks:
+            await reply.add_chunk(chunk, field="tool_call.arguments")
+        await reply.end()
+
+    yield run
+
+
+@case("pubsub.fanout", operations=1_000)
+async def pubsub_fanout(rng: random.Random):
+    from pubsub import PubSub
+
+    pubsub = PubSub()
+    messages = [
+        {"type": "add_chunk", "id": "message", "field": "content", "chunk": _text(rng, 4)} for _ in range(1_000)
+    ]
+    async with contextlib.AsyncExitStack() as stack:
+        queues = [await stack.enter_async_context(pubsub.subscribe("chat")) for _ in range(100)]
+
+        async def run():
+            for message in messages:
+                await pubsub.publish("chat", message)
+            for queue in queues:
+                while not queue.empty():
+                    queue.get_nowait()
+
+        yield run
+
+
+@case("pubsub.fanout_many", operations=1_000)
+async def pubsub_fanout_many(rng: random.Random):
+    from pubsub import PubSub
+
+    pubsub = PubSub()
+    messages = [
+        {"type": "add_chunk", "id": "message", "field": "content", "chunk": _text(rng, 4)} for _ in range(1_000)
+    ]
+    batches = [messages[i : i + 4] for i in range(0, len(messages), 4)]
+    async with contextlib.AsyncExitStack() as stack:
+        queues = [await stack.enter_async_context(pubsub.subscribe("chat")) for _ in range(100)]
+
+        async def run():
+            for batch in batches:
+                await pubsub.publish_many("chat", batch)
+            for queue in queues:
+                while not queue.empty():
+                    queue.get_nowait()
+
+        yield run
+
+
+def _chat_state(rng: random.Random, size: int):
+    from akson import ChatState, Message, ToolCall
+
+    messages = []
+    for i in range(size):
+        match i % 4:
+            case 0:
+                messages.append(Message(role="user", content=_text(rng, 100)))
+            case 1:
+                tool_call = ToolCall(id=f"call_{i}", name="search", arguments=json.dumps({"query": _text(rng, 20)}))
+                messages.append(Message(role="assistant", name="Benchmark", content="", tool_call=tool_call))
+            case 2:
+                messages.append(
+                    Message(role="tool", name="Benchmark", content=_text(rng, 200), tool_call_id=f"call_{i - 1}")
+                )
+            case 3:
+                messages.append(Message(role="assistant", name="Benchmark", content=_text(rng, 300)))
+    return ChatState(id="benchmark", messages=messages, assistant="Benchmark")
+
+
+@case("chat_state.save", operations=10_000)
+async def chat_state_save(rng: random.Random):
+    state = _chat_state(rng, 10_000)
+    with tempfile.TemporaryDirectory() as directory, contextlib.chdir(directory):
+
+        async def run():
+            state.save_to_disk()
+
+        yield run
+
+
+@case("chat_state.load", operations=10_000)
+async def chat_state_load(rng: random.Random):
+    from akson import ChatState
+
+    state = _chat_state(rng, 10_000)
+    with tempfile.TemporaryDirectory() as directory, contextlib.chdir(directory):
+        state.save_to_disk()
+
+        async def run():
+            ChatState.load_from_disk(state.id)
+
+        yield run
+
+
+@case("toolkit.dispatch", operations=1_000)
+async def toolkit_dispatch(rng: random.Random):
+    from litellm import ChatCompletionMessageToolCall
+
+    from framework.toolkit import FunctionToolkit, ToolContext
+    from logger import logger
+
+    def search(query: str, limit: int = 10) -> list[str]:
+        """
+        Search documents.
+
+        Args:
+            query: Search query
+            limit: Maximum number of results
+        """
+        return [query] * limit
+
+    toolkit = FunctionToolkit([search])
+    tool_calls = [
+        ChatCompletionMessageToolCall(
+            id=f"call_{i}",
+            type="function",
+            function={"name": "search", "arguments": json.dumps({"query": _text(rng, 20), "limit": 3})},
+        )
+        for i in range(1_000)
+    ]
+    context = ToolContext(caller="Benchmark")
+
+    # Measure dispatch, not the log handler.
+    level = logger.level
+    logger.setLevel("WARNING")
+    try:
+
+        async def run():
+            await toolkit.handle_tool_calls(tool_calls, context)
+
+        yield run
+    finally:
+        logger.setLevel(level)
+
+
+async def measure(case: Case, repeat: int = REPEAT) -> dict:
+    """Run the case and return the timings in seconds."""
+    async with case.setup(random.Random(SEED)) as run:
+        await run()
+        times = []
+        for _ in range(repeat):
+            gc.collect()
+            started = time.perf_counter()
+            await run()
+            times.append(time.perf_counter() - started)
+    return {
+        "operations": case.operations,
+        "min": min(times),
+        "median": statistics.median(times),
+        "per_operation": min(times) / case.operations,
+    }
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], threshold: float = THRESHOLD) -> list[str]:
+    """Return the descriptions of cases that are slower than the baseline by more than the threshold."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        change = result["min"] / baseline[name]["min"] - 1
+        if change > threshold:
+            regressions.append(f"{name}: {baseline[name]['min']:.4f}s -> {result['min']:.4f}s ({change:+.0%})")
+    return regressions
+
+
+def load_baseline(path: str = BASELINE) -> dict[str, dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)["results"]
+    except FileNotFoundError:
+        return {}
+
+
+async def run_cases(names: list[str], repeat: int) -> dict[str, dict]:
+    results = {}
+    for name in names:
+        results[name] = await measure(cases[name], repeat)
+        print(f"{name}: {results[name]['min']:.4f}s", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cases", nargs="*", metavar="case", help=f"Cases to run: {', '.join(cases)}. Default: all")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Number of timed runs per case")
+    parser.add_argument("--output", help="Write results to this file instead of stdout")
+    parser.add_argument("--baseline", default=BASELINE, help="Baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store results in the baseline file")
+    parser.add_argument("--compare", action="store_true", help="Exit with status 1 if there are regressions")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="Relative slowdown considered a regression")
+    args = parser.parse_args()
+    for name in args.cases:
+        if name not in cases:
+            parser.error(f"unknown case: {name}")
+
+    results = asyncio.run(run_cases(args.cases or list(cases), args.repeat))
+    report = {"benchmark": "micro", "seed": SEED, "repeat": args.repeat, "results": results}
+    if args.save_baseline:
+        # Keep the baseline of cases that are not run.
+        baseline = {**load_baseline(args.baseline), **results}
+        with open(args.baseline, "w") as f:
+            json.dump({**report, "results": baseline}, f, indent=2)
+            f.write("\n")
+    elif args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        regressions = compare(results, load_baseline(args.baseline), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Runs the API server with a "Benchmark" assistant that sends completion requests to the fake LLM provider.
+
+Chats and runs are written to a temporary directory, so benchmarks do not touch the real chats.
+
+Usage: python -m benchmarks.server --port 9200 --llm-url http://127.0.0.1:9100/v1
+"""
+
+import argparse
+import os
+import tempfile
+
+import uvicorn
+
+MODEL = "openai/fake"
+
+
+def lookup(query: str) -> str:
+    """Look up information about the query."""
+    return f"Result for {query}"
+
+
+async def skip_title(_):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--llm-url", default="http://127.0.0.1:9100/v1")
+    parser.add_argument("--data-dir", help="Directory for chats and runs. Defaults to a temporary directory.")
+    args = parser.parse_args()
+
+    # Must be set before the app is imported.
+    os.environ.setdefault("DEFAULT_MODEL", MODEL)
+    os.environ.setdefault("DEFAULT_ASSISTANT", "Benchmark")
+
+    import main as api
+    import tasks
+    from deps import registry
+    from framework import FunctionToolkit, LLMAssistant
+
+    # Titles are generated by a real model, which is not part of the benchmark.
+    tasks.update_title = skip_title
+
+    registry.register(
+        LLMAssistant(
+            name="Benchmark",
+            model=MODEL,
+            api_key="fake",
+            api_base=args.llm_url,
+            toolkit=FunctionToolkit([lookup]),
+        )
+    )
+
+    # Assistants are loaded at import, chats and runs are written relative to the working directory.
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="akson-benchmark-")
+    os.makedirs(os.path.join(data_dir, "chats"), exist_ok=True)
+    os.chdir(data_dir)
+
+    uvicorn.run(api.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
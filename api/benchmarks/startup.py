@@ -0,0 +1,132 @@
+"""
+Startup benchmark.
+
+Starts the API server in a subprocess with LAZY_STARTUP disabled and enabled, and reports the results as JSON.
+
+Measured per start:
+- Import: time to import the app in a separate process
+- Health: from starting the server process until /health answers
+- Assistants: from starting the server process until /assistants answers
+
+Chats and runs are written to a temporary directory, so the benchmark does not touch the real chats.
+
+Usage: python -m benchmarks.startup --repeat 5 --output result.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks.e2e import API_DIR, git_commit, summarize
+
+MODES = {"eager": "false", "lazy": "true"}
+
+IMPORT_SCRIPT = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+
+def environment(lazy: str) -> dict:
+    env = dict(os.environ, LAZY_STARTUP=lazy, PYTHONPATH=API_DIR)
+    env.setdefault("DEFAULT_MODEL", "gpt-4.1")
+    env.setdefault("MCP_TOOL_CACHE_DIR", os.path.join(API_DIR, "mcp_tools"))
+    return env
+
+
+def data_dir() -> str:
+    """Temporary working directory of the server. Assistants are loaded relative to the working directory."""
+    path = tempfile.mkdtemp(prefix="akson-startup-")
+    os.symlink(os.path.join(API_DIR, "assistants"), os.path.join(path, "assistants"))
+    return path
+
+
+def measure_import(env: dict, cwd: str) -> float:
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT], cwd=cwd, env=env, text=True)
+    return float(output.strip().splitlines()[-1])
+
+
+async def wait_for(client: httpx.AsyncClient, url: str, process: subprocess.Popen, timeout: float) -> float:
+    """Return the time when the URL first answers with success."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            response = await client.get(url)
+            if response.is_success:
+                return time.perf_counter()
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.01)
+    raise TimeoutError(f"{url} is not ready after {timeout} seconds")
+
+
+async def measure_server(env: dict, cwd: str, args) -> tuple[float, float]:
+    """Return the seconds until /health and /assistants first answer."""
+    url = f"http://{args.host}:{args.port}"
+    command = [sys.executable, "-m", "uvicorn", "main:app", f"--host={args.host}", f"--port={args.port}"]
+    started = time.perf_counter()
+    server = subprocess.Popen([*command, "--log-level=warning"], cwd=cwd, env=env)
+    try:
+        async with httpx.AsyncClient(timeout=args.timeout) as client:
+            healthy = await wait_for(client, f"{url}/health", server, args.timeout)
+            listed = await wait_for(client, f"{url}/assistants", server, args.timeout)
+        return healthy - started, listed - started
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def benchmark(args) -> dict:
+    results = {}
+    for mode, lazy in MODES.items():
+        env = environment(lazy)
+        cwd = data_dir()
+        imports, health, assistants = [], [], []
+        for _ in range(args.repeat):
+            imports.append(measure_import(env, cwd))
+            healthy, listed = await measure_server(env, cwd, args)
+            health.append(healthy)
+            assistants.append(listed)
+        results[mode] = {
+            "import_seconds": summarize(imports),
+            "health_seconds": summarize(health),
+            "assistants_seconds": summarize(assistants),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="Number of starts in each mode")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for the server to start")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9300)
+    parser.add_argument("--output", help="Write results to this file instead of stdout")
+    args = parser.parse_args()
+
+    config = {name: value for name, value in vars(args).items() if name not in ("output", "host")}
+    results = asyncio.run(benchmark(args))
+    report = {
+        "benchmark": "startup",
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": config,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import os
+
+import pytest
+
+from . import microbench
+
+pytestmark = pytest.mark.skipif(os.getenv("AKSON_BENCHMARK") != "1", reason="Set AKSON_BENCHMARK=1 to run benchmarks")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", list(microbench.cases))
+async def test_microbench(name):
+    result = await microbench.measure(microbench.cases[name])
+    threshold = float(os.getenv("AKSON_BENCHMARK_THRESHOLD", microbench.THRESHOLD))
+    regressions = microbench.compare({name: result}, microbench.load_baseline(), threshold)
+    assert not regressions
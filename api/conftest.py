@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Run the test in a temporary directory, so chats and runs are not written to the real directories."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
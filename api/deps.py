@@ -10,15 +10,31 @@ import models
 from akson import Assistant, Chat, ChatState
 from pubsub import PubSub
 from registry import Registry, UnknownAssistant
+from runs import RunManager, RunQueue, Submissions
 
 # Load environment variables
 DEFAULT_ASSISTANT = os.getenv("DEFAULT_ASSISTANT", "ChatGPT")
+CANCEL_ON_DISCONNECT = os.getenv("CANCEL_ON_DISCONNECT", "false").lower() == "true"
+RUN_WORKERS = int(os.getenv("RUN_WORKERS", "4"))
+RESUME_RUNS = os.getenv("RESUME_RUNS", "true").lower() == "true"
+LAZY_STARTUP = os.getenv("LAZY_STARTUP", "false").lower() == "true"
+PUBSUB_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", "1000"))
 
 # Manages assistants
-registry = Registry()
+registry = Registry(lazy=LAZY_STARTUP)
 
 # For sending chat events to clients
-pubsub = PubSub()
+pubsub = PubSub(max_queue_size=PUBSUB_QUEUE_SIZE)
+pubsub.register_metrics()
+
+# Tracks assistant runs in progress
+runs = RunManager()
+
+# Detects messages submitted again by clients, e.g. when a request is retried
+submissions = Submissions()
+
+# Executes runs queued by clients that do not wait for the response
+run_queue = RunQueue(RUN_WORKERS, resume=RESUME_RUNS)
 
 # Ensure chats directory exists
 os.makedirs("chats", exist_ok=True)
@@ -28,6 +44,14 @@ def get_pubsub() -> PubSub:
     return pubsub
 
 
+def get_runs() -> RunManager:
+    return runs
+
+
+def get_run_queue() -> RunQueue:
+    return run_queue
+
+
 def get_chat_state(chat_id: str) -> ChatState:
     try:
         return ChatState.load_from_disk(chat_id)
@@ -39,7 +63,10 @@ def get_chat(chat_id: str) -> Chat:
     async def publish(message):
         return await pubsub.publish(chat_id, message)
 
-    return Chat(state=get_chat_state(chat_id), publisher=publish)
+    async def publish_many(messages):
+        return await pubsub.publish_many(chat_id, messages)
+
+    return Chat(state=get_chat_state(chat_id), publisher=publish, batch_publisher=publish_many)
 
 
 def get_assistant(message: models.SendMessageRequest, chat: Chat = Depends(get_chat)) -> Assistant:
@@ -57,4 +84,4 @@ def _get_default_assistant() -> Assistant:
     try:
         return registry.get_assistant(DEFAULT_ASSISTANT)
     except UnknownAssistant:
-        return registry.assistants[0]
+        return registry.get_assistant(registry.names[0])
@@ -1,21 +1,54 @@
 """
 framework package contains utilities for building assistants.
+
+Classes are imported from their modules on first access, so importing a submodule such as framework.scheduler
+does not import LiteLLM and the MCP client.
 """
 
-from .llm_assistant import LLMAssistant
-from .toolkit import (
-    AssistantToolkit,
-    FunctionToolkit,
-    MCPToolkit,
-    MultiToolkit,
-    Toolkit,
-)
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .llm_assistant import LLMAssistant
+    from .router import Router
+    from .toolkit import (
+        AssistantToolkit,
+        FunctionToolkit,
+        MCPToolkit,
+        MultiToolkit,
+        Toolkit,
+    )
 
 __all__ = [
     "LLMAssistant",
+    "Router",
     "Toolkit",
     "MultiToolkit",
     "FunctionToolkit",
     "AssistantToolkit",
     "MCPToolkit",
 ]
+
+# Module of each exported name
+_modules = {
+    "LLMAssistant": ".llm_assistant",
+    "Router": ".router",
+    "Toolkit": ".toolkit",
+    "MultiToolkit": ".toolkit",
+    "FunctionToolkit": ".toolkit",
+    "AssistantToolkit": ".toolkit",
+    "MCPToolkit": ".toolkit",
+}
+
+
+def __getattr__(name: str):
+    module = _modules.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *__all__])
@@ -0,0 +1,165 @@
+"""
+Record and replay of LLM streams and MCP tool results.
+
+In record mode, chunks of completion streams are written to cassette files with the time they were received,
+and results of MCP tool calls are written with their duration.
+In replay mode, completions and tool calls are served from the cassettes through the same code path,
+so real agent sessions can be rerun under load and profiled without network access.
+
+Completions are matched by model, tools and the conversation. System messages are not matched
+because the system prompt contains the current time. Tool calls are matched by server, tool name and arguments.
+
+Configured with environment variables:
+    AKSON_CASSETTE_MODE: off (default), record or replay
+    AKSON_CASSETTE_DIR: Directory of cassette files (default: cassettes)
+    AKSON_CASSETTE_SPEED: Replay speed. 1 is the original speed, 10 is 10x faster, 0 is as fast as possible.
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Literal, Optional
+
+from logger import logger
+
+from .files import short_hash, write_json
+
+Mode = Literal["off", "record", "replay"]
+
+
+class CassetteNotFound(Exception):
+    def __init__(self, kind: str, key: str):
+        super().__init__(f"No {kind} cassette recorded for {key}")
+
+
+def completion_key(model: str, messages: list, tools: Optional[list] = None) -> str:
+    conversation = []
+    for message in messages:
+        if message.get("role") == "system":
+            continue
+        tool_calls = message.get("tool_calls") or []
+        conversation.append(
+            [
+                message.get("role"),
+                message.get("name"),
+                message.get("content"),
+                message.get("tool_call_id"),
+                [[tool_call.id, tool_call.function.name, tool_call.function.arguments] for tool_call in tool_calls],
+            ]
+        )
+    tool_names = sorted(tool["function"]["name"] for tool in tools or [])
+    return short_hash([model, tool_names, conversation])
+
+
+class RecordingStream:
+    """Passes the chunks of a completion stream through and writes them to a cassette when the stream ends."""
+
+    def __init__(self, stream, path: str, started: float):
+        self.stream = stream
+        self.path = path
+        self.started = started
+
+    def __getattr__(self, name: str):
+        # Used for closing the underlying stream
+        return getattr(self.stream, name)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        chunks = []
+        async for chunk in self.stream:
+            chunks.append({"time": time.perf_counter() - self.started, "chunk": chunk.model_dump(mode="json")})
+            yield chunk
+        # Incomplete streams are not written.
+        write_json(self.path, {"chunks": chunks})
+
+
+class ReplayStream:
+    """Yields recorded chunks at the recorded times, adjusted by speed."""
+
+    completion_stream = None
+
+    def __init__(self, chunks: list[dict], speed: float):
+        self.chunks = chunks
+        self.speed = speed
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        from litellm.types.utils import ModelResponseStream
+
+        started = time.perf_counter()
+        for item in self.chunks:
+            if self.speed:
+                delay = item["time"] / self.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield ModelResponseStream(**item["chunk"])
+
+
+class Cassettes:
+    def __init__(self, mode: Mode = "off", directory: str = "cassettes", speed: float = 1):
+        self.mode = mode
+        self.directory = directory
+        self.speed = speed
+
+    @classmethod
+    def from_env(cls):
+        mode = os.getenv("AKSON_CASSETTE_MODE", "off")
+        if mode not in ("off", "record", "replay"):
+            raise ValueError(f"Invalid AKSON_CASSETTE_MODE: {mode}")
+        return cls(
+            mode,  # type: ignore
+            directory=os.getenv("AKSON_CASSETTE_DIR", "cassettes"),
+            speed=float(os.getenv("AKSON_CASSETTE_SPEED", "1")),
+        )
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.directory, kind, f"{key}.json")
+
+    def _read(self, kind: str, key: str) -> dict:
+        try:
+            with open(self._path(kind, key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise CassetteNotFound(kind, key) from None
+
+    def record_completion(self, key: str, stream, started: float) -> RecordingStream:
+        """Wrap the stream returned by acompletion. started is the time the request was sent."""
+        return RecordingStream(stream, self._path("completions", key), started)
+
+    def replay_completion(self, key: str) -> ReplayStream:
+        """Return a stream that can be used in place of the stream returned by acompletion."""
+        logger.info("Replaying completion %s", key)
+        return ReplayStream(self._read("completions", key)["chunks"], self.speed)
+
+    def record_tools(self, server: str, tools: list):
+        write_json(self._path("tools", short_hash(server)), {"tools": tools})
+
+    def replay_tools(self, server: str) -> list:
+        return self._read("tools", short_hash(server))["tools"]
+
+    def record_tool_result(self, server: str, name: str, arguments: dict, result: str, duration: float):
+        key = short_hash([server, name, arguments])
+        write_json(self._path("tool_results", key), {"name": name, "result": result, "duration": duration})
+
+    async def replay_tool_result(self, server: str, name: str, arguments: dict) -> str:
+        recorded = self._read("tool_results", short_hash([server, name, arguments]))
+        if self.speed:
+            await asyncio.sleep(recorded["duration"] / self.speed)
+        return recorded["result"]
+
+
+# Shared by all assistants and toolkits in the process
+cassettes = Cassettes.from_env()
@@ -0,0 +1,23 @@
+"""
+Helpers for the JSON files written by the framework, e.g. cassettes and the MCP tool cache.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any
+
+
+def short_hash(value: Any) -> str:
+    """Short, stable hash of a JSON serializable value. Used as a file name."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def write_json(path: str, content: dict):
+    """Write the file atomically, so concurrent readers never read a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first, then replace the file.
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+        json.dump(content, f)
+    os.replace(f.name, path)
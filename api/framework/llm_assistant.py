@@ -1,3 +1,4 @@
+import asyncio
 import os
 import re
 import time
@@ -5,28 +6,68 @@ from datetime import datetime
 from typing import Optional
 
 import litellm
-from langfuse.decorators import langfuse_context
 from litellm import ChatCompletionMessageToolCall as LitellmToolCall
 from litellm import CustomStreamWrapper
 from litellm import Message as LitellmMessage
 from litellm import acompletion
+from litellm.exceptions import RateLimitError
 from litellm.types.utils import Function as LitellmFunction
 from litellm.types.utils import Message as LitellmMessage
+from litellm.utils import token_counter
 from pydantic import BaseModel
 
-from akson import Assistant, Chat, Message, ToolCall
+import metrics
+from akson import Assistant, Chat, Message, Reply, ToolCall, Usage
 from logger import logger
 
+from .cassette import RecordingStream, ReplayStream, cassettes, completion_key
+from .scheduler import Priority, estimate_tokens, retry_after, scheduler
 from .streaming import MessageBuilder
-from .toolkit import ToolContext, Toolkit
+from .toolkit import AssistantToolkit, MultiToolkit, ToolContext, Toolkit
 
-DEFAULT_MODEL = os.environ["DEFAULT_MODEL"]
+# Number of times a completion request is retried after the provider returns 429
+MAX_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "3"))
 
 litellm.drop_params = True
 if os.getenv("LANGFUSE_PUBLIC_KEY") and os.getenv("LANGFUSE_SECRET_KEY"):
     litellm.success_callback = ["langfuse"]
     litellm.failure_callback = ["langfuse"]
 
+prompt_duration = metrics.Histogram(
+    "llm_prompt_seconds", "Time spent assembling the messages of a run from the chat history.", ("model",)
+)
+time_to_first_token = metrics.Histogram(
+    "llm_time_to_first_token_seconds", "Time from sending the request until the first chunk is received.", ("model",)
+)
+inter_token_duration = metrics.Histogram(
+    "llm_inter_token_seconds", "Time between consecutive chunks of a stream.", ("model",), buckets=metrics.FAST_BUCKETS
+)
+requests_in_progress = metrics.Gauge(
+    "llm_requests_in_progress", "Number of completion requests in progress.", ("assistant", "model")
+)
+errors = metrics.Counter("llm_errors_total", "Errors returned by LLM providers.", ("model", "type"))
+token_usage = metrics.Counter(
+    "llm_tokens_total",
+    "Tokens used by completions. Cached tokens are part of prompt tokens. Estimated tokens are counted locally.",
+    ("model", "type"),
+)
+prompt_cache_requests = metrics.Counter(
+    "llm_prompt_cache_requests_total",
+    "Completions by whether the provider reported cached prompt tokens (hit) or not (miss).",
+    ("model", "result"),
+)
+tokens_per_second = metrics.Histogram(
+    "llm_tokens_per_second",
+    "Completion tokens received per second after the first chunk.",
+    ("model",),
+    buckets=(1, 5, 10, 25, 50, 100, 200, 500, 1000),
+)
+
+
+def default_model() -> str:
+    """Model of assistants that do not set one. Read when an assistant is created, not when the module is imported."""
+    return os.environ["DEFAULT_MODEL"]
+
 
 class LLMAssistant(Assistant):
     """Provides an Assistant implementation with a given system prompt and toolkit."""
@@ -35,42 +76,74 @@ class LLMAssistant(Assistant):
         self,
         name: str,
         description: Optional[str] = None,
-        model: str = DEFAULT_MODEL,
+        model: Optional[str] = None,
         system_prompt: Optional[str] = None,
         output_type: Optional[type[BaseModel]] = None,
         toolkit: Optional[Toolkit] = None,
         max_turns: int = 10,
+        priority: Priority = Priority.INTERACTIVE,
+        parallel_tool_calls: Optional[bool] = None,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None,
     ):
         """
         Creates a new LLMAssistant.
+
+        model defaults to the DEFAULT_MODEL environment variable.
+        Requests with background priority wait until interactive requests to the same model are sent.
+        If parallel_tool_calls is true, the model can call several tools in one response. They are passed to
+        the toolkit together, e.g. so delegated tasks run concurrently. Defaults to true if the toolkit delegates
+        tasks to other assistants (contains an AssistantToolkit), false otherwise.
+        api_key and api_base override the provider defaults of LiteLLM.
         """
         self.name = name
         self.description = description
-        self.model = model
+        self.model = model or default_model()
         self.system_prompt = system_prompt
         self.output_type = output_type
         self.toolkit = toolkit
         self.max_turns = max_turns
+        self.priority = priority
+        if parallel_tool_calls is None:
+            parallel_tool_calls = toolkit is not None and _delegates_tasks(toolkit)
+        self.parallel_tool_calls = parallel_tool_calls
+        self.api_key = api_key
+        self.api_base = api_base
         self.examples: list[tuple[str, BaseModel]] = []
 
     async def run(self, chat: Chat) -> None:
         logger.info("Running assistant %s", self.name)
 
         # These messages are sent to the LLM API, prefixed by the system prompt.
-        messages = self._get_messages(chat)
+        with metrics.timed(prompt_duration.labels(self.model), "prompt"):
+            messages = self._get_messages(chat)
 
         async def handle_tool_calls(message: LitellmMessage):
             assert self.toolkit
             assert message.tool_calls
-            tool_messages = await self.toolkit.handle_tool_calls(message.tool_calls, ToolContext(caller=self.name))
+            try:
+                tool_messages = await self.toolkit.handle_tool_calls(
+                    message.tool_calls, ToolContext(caller=self.name, chat=chat)
+                )
+            except asyncio.CancelledError:
+                # Every tool call must be followed by a tool message. Otherwise, the chat cannot be continued.
+                async with chat.batch():
+                    for tool_call in message.tool_calls:
+                        reply = await chat.reply("tool", name=self.name)
+                        await reply.add_chunk(tool_call.id, field="tool_call_id")
+                        await reply.add_chunk("Cancelled by user")
+                        await reply.end()
+                raise
             assert len(tool_messages) == len(message.tool_calls)
-            for tool_message in tool_messages:
-                messages.append(tool_message)
-                reply = await chat.reply("tool", name=self.name)
-                await reply.add_chunk(tool_message["tool_call_id"], field="tool_call_id")
-                if tool_message.content:
-                    await reply.add_chunk(tool_message.content)
-                await reply.end()
+            # Tool results are complete, send them to clients at once.
+            async with chat.batch():
+                for tool_message in tool_messages:
+                    messages.append(tool_message)
+                    reply = await chat.reply("tool", name=self.name)
+                    await reply.add_chunk(tool_message["tool_call_id"], field="tool_call_id")
+                    if tool_message.content:
+                        await reply.add_chunk(tool_message.content)
+                    await reply.end()
 
         # We start by sending the first message.
         message = await self._complete(messages, chat)
@@ -90,6 +163,9 @@ class LLMAssistant(Assistant):
             messages.append(message)
 
     async def _complete(self, messages: list[LitellmMessage], chat: Chat) -> LitellmMessage:
+        # Slow to import, so imported by the first completion instead of at startup
+        from langfuse.decorators import langfuse_context
+
         # Replace invalid characters in assistant name
         for message in messages:
             if message.get("name"):
@@ -105,26 +181,83 @@ class LLMAssistant(Assistant):
             if tools:
                 kwargs["tools"] = tools
                 kwargs["tool_choice"] = "auto"
-                kwargs["parallel_tool_calls"] = False
+                kwargs["parallel_tool_calls"] = self.parallel_tool_calls
 
         if self.output_type:
             kwargs["response_format"] = self.output_type
 
-        response = await acompletion(
-            model=self.model,
-            messages=messages,
-            stream=True,
-            metadata={
-                "existing_trace_id": langfuse_context.get_current_trace_id(),
-                "parent_observation_id": langfuse_context.get_current_observation_id(),
-            },
-            **kwargs,
-        )
-        assert isinstance(response, CustomStreamWrapper)
+        if self.api_key:
+            kwargs["api_key"] = self.api_key
+        if self.api_base:
+            kwargs["api_base"] = self.api_base
+
+        # Slot is held until the stream is consumed, so the concurrency limit applies to in-flight streams.
+        async with scheduler.slot(
+            self.model,
+            api_key=self.api_key,
+            priority=self.priority,
+            tokens=estimate_tokens(messages),
+        ) as slot:
+            in_progress = requests_in_progress.labels(self.name, self.model)
+            in_progress.inc()
+            try:
+                started = time.perf_counter()
+                key = completion_key(self.model, messages, kwargs.get("tools")) if cassettes.mode != "off" else ""
+                attempt = 0
+                while True:
+                    if cassettes.replaying:
+                        response = cassettes.replay_completion(key)
+                        break
+                    try:
+                        response = await acompletion(
+                            model=self.model,
+                            messages=messages,
+                            stream=True,
+                            stream_options={"include_usage": True},
+                            metadata={
+                                "existing_trace_id": langfuse_context.get_current_trace_id(),
+                                "parent_observation_id": langfuse_context.get_current_observation_id(),
+                            },
+                            **kwargs,
+                        )
+                        if cassettes.recording:
+                            response = cassettes.record_completion(key, response, started)
+                        break
+                    except RateLimitError as e:
+                        if attempt >= MAX_RATE_LIMIT_RETRIES:
+                            raise
+                        errors.labels(self.model, "RateLimitError").inc()
+                        await slot.backoff(attempt, retry_after(getattr(e.response, "headers", None)))
+                        attempt += 1
+
+                message, reported, generation = await self._stream_reply(response, chat, started)
+                usage = self._get_usage(reported, messages, kwargs.get("tools"), message)
+                if generation > 0 and usage.completion_tokens:
+                    tokens_per_second.labels(self.model).observe(usage.completion_tokens / generation)
+                # Corrects the tokens per minute limit, which was charged by the estimate.
+                slot.record_usage(usage.total_tokens)
+                chat.add_usage(usage)
+                return message
+            except Exception as e:
+                errors.labels(self.model, e.__class__.__name__).inc()
+                raise
+            finally:
+                in_progress.dec()
+
+    async def _stream_reply(
+        self, response, chat: Chat, started: float
+    ) -> tuple[LitellmMessage, Optional[litellm.Usage], float]:
+        """
+        Stream the response to the chat.
+        Returns the message, the usage reported by the provider, if any, and the seconds after the first chunk.
+        """
+        assert isinstance(response, (CustomStreamWrapper, RecordingStream, ReplayStream))
 
         # We start by sending a begin_message event to the web client.
         # This will cause the web client to draw a new message box for the assistant.
         reply = await chat.reply("assistant", name=self.name)
+        # A message holds one tool call. Parallel tool calls after the first are sent as separate messages.
+        tool_call_replies: dict[int, Reply] = {}
 
         # We will aggregate delta messages and store them in this variable until we see a finish_reason.
         # This is the only way to get the full content of the message.
@@ -134,25 +267,114 @@ class LLMAssistant(Assistant):
         # We will return this value at the end of the function.
         message: Optional[LitellmMessage] = None
 
-        # Do not break this loop. Otherwise, litellm will not be able to run callbacks.
-        async for chunk in response:
-            assert chunk.__class__.__name__ == "ModelResponseStream"
-            assert len(chunk.choices) == 1
-            choice = chunk.choices[0]
-            events = builder.write(choice.delta)
-            for event in events:
-                await reply.add_chunk(event.chunk, field=event.name)
-
-            if finish_reason := choice.finish_reason:
-                message = builder.getvalue()
-                if finish_reason not in ("stop", "tool_calls"):
-                    raise NotImplementedError(f"finish_reason={finish_reason}")
+        # Totals of the request. Some providers report them more than once, the last report wins.
+        usage: Optional[litellm.Usage] = None
+
+        # For measuring streaming latency
+        first_chunk_at = last_chunk_at = 0.0
+        chunk_count = 0
+        inter_token = inter_token_duration.labels(self.model)
+
+        try:
+            # Do not break this loop. Otherwise, litellm will not be able to run callbacks.
+            async for chunk in response:
+                now = time.perf_counter()
+                if not chunk_count:
+                    first_chunk_at = now
+                    time_to_first_token.labels(self.model).observe(now - started)
+                    metrics.add_timing("ttft", now - started)
+                else:
+                    inter_token.observe(now - last_chunk_at)
+                last_chunk_at = now
+                chunk_count += 1
+
+                assert chunk.__class__.__name__ == "ModelResponseStream"
+                if chunk_usage := getattr(chunk, "usage", None):
+                    usage = chunk_usage
+                if not chunk.choices:
+                    # Usage is sent in a chunk without choices after the finish reason.
+                    continue
+                assert len(chunk.choices) == 1
+                choice = chunk.choices[0]
+                events = builder.write(choice.delta)
+                for event in events:
+                    target = reply
+                    if event.name != "content":
+                        target = tool_call_replies.get(event.tool_index)
+                        if target is None:
+                            if tool_call_replies:
+                                target = await chat.reply("assistant", name=self.name)
+                            else:
+                                target = reply
+                            tool_call_replies[event.tool_index] = target
+                    await target.add_chunk(event.chunk, field=event.name)
+
+                if finish_reason := choice.finish_reason:
+                    message = builder.getvalue()
+                    if finish_reason not in ("stop", "tool_calls"):
+                        raise NotImplementedError(f"finish_reason={finish_reason}")
+                    await reply.end()
+                    for tool_call_reply in tool_call_replies.values():
+                        if tool_call_reply is not reply:
+                            await tool_call_reply.end()
+        except asyncio.CancelledError:
+            await _close_stream(response)
+            if not message:
+                # Keep the partial content. Incomplete tool calls cannot be sent to the LLM, so they are dropped.
+                reply.discard_tool_call()
                 await reply.end()
+                for tool_call_reply in tool_call_replies.values():
+                    if tool_call_reply is not reply:
+                        # Holds only the tool call, so nothing is left to save.
+                        await tool_call_reply.discard()
+            raise
 
         if not message:
             raise Exception("Stream ended unexpectedly")
 
-        return message
+        generation = last_chunk_at - first_chunk_at
+        metrics.add_timing("generation", generation)
+        return message, usage, generation
+
+    def _get_usage(
+        self,
+        reported: Optional[litellm.Usage],
+        messages: list[LitellmMessage],
+        tools: Optional[list],
+        message: LitellmMessage,
+    ) -> Usage:
+        """Convert the usage reported by the provider. Tokens are counted locally if the provider did not report them."""
+        if reported and (reported.prompt_tokens or reported.completion_tokens):
+            details = getattr(reported, "prompt_tokens_details", None)
+            usage = Usage(
+                prompt_tokens=reported.prompt_tokens or 0,
+                completion_tokens=reported.completion_tokens or 0,
+                cached_tokens=(details and details.cached_tokens) or 0,
+            )
+            prompt_cache_requests.labels(self.model, "hit" if usage.cached_tokens else "miss").inc()
+        else:
+            completion = message.content or ""
+            for tool_call in message.tool_calls or []:
+                completion += (tool_call.function.name or "") + tool_call.function.arguments
+            prompt_tokens, completion_tokens = self._count_tokens(messages, tools, completion)
+            usage = Usage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, estimated=True)
+            token_usage.labels(self.model, "estimated").inc(usage.total_tokens)
+
+        token_usage.labels(self.model, "prompt").inc(usage.prompt_tokens)
+        token_usage.labels(self.model, "completion").inc(usage.completion_tokens)
+        if usage.cached_tokens:
+            token_usage.labels(self.model, "cached").inc(usage.cached_tokens)
+        return usage
+
+    def _count_tokens(self, messages: list[LitellmMessage], tools: Optional[list], completion: str) -> tuple[int, int]:
+        """Count prompt and completion tokens locally. Falls back to a rough estimate if the model is not known."""
+        try:
+            prompt_tokens = token_counter(model=self.model, messages=messages, tools=tools)
+            completion_tokens = token_counter(model=self.model, text=completion) if completion else 0
+            return prompt_tokens, completion_tokens
+        except Exception as e:
+            logger.warning("Cannot count tokens of %s, estimating: %r", self.model, e)
+            return estimate_tokens(messages), len(completion) // 4
 
     def _get_messages(self, chat: Chat) -> list[LitellmMessage]:
         messages: list[LitellmMessage] = []
@@ -180,7 +402,14 @@ class LLMAssistant(Assistant):
                 ]
             )
 
-        messages.extend([message_to_litellm(message) for message in chat.state.messages])
+        for message in chat.state.messages:
+            previous = messages[-1]
+            if message.role == "assistant" and not message.content and message.tool_call:
+                if previous.role == "assistant" and previous.tool_calls and previous.get("name") == message.name:
+                    # Parallel tool calls are stored as separate messages, but must be sent as one.
+                    previous.tool_calls.append(tool_call_to_litellm(message.tool_call))
+                    continue
+            messages.append(message_to_litellm(message))
         return messages
 
     def _get_system_prompt(self) -> str:
@@ -199,6 +428,22 @@ class LLMAssistant(Assistant):
         self.examples.append((user_message, response))
 
 
+def _delegates_tasks(toolkit: Toolkit) -> bool:
+    if isinstance(toolkit, AssistantToolkit):
+        return True
+    return isinstance(toolkit, MultiToolkit) and any(_delegates_tasks(child) for child in toolkit.toolkits)
+
+
+async def _close_stream(response: CustomStreamWrapper | RecordingStream | ReplayStream):
+    """Close the connection to the provider, so it stops generating tokens."""
+    aclose = getattr(response.completion_stream, "aclose", None)
+    if aclose:
+        try:
+            await aclose()
+        except Exception as e:
+            logger.debug("Error closing stream: %s", e)
+
+
 def tool_call_from_litellm(tool_call: LitellmToolCall):
     return ToolCall(
         id=tool_call.id,
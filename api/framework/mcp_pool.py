@@ -0,0 +1,258 @@
+"""
+Pool of sessions to an MCP server.
+
+Each session is a separate server process (or container), so tool calls from different chats run in parallel
+instead of waiting for each other on a single session. Sessions are started before they are needed,
+checked periodically, restarted when they fail and stopped when they are idle for a while.
+
+Pools of all toolkits are started in the background when the app starts, so the first user does not wait for
+the server to start. Lazy pools are started on first use instead.
+With LAZY_STARTUP, only the pools of assistant modules imported at startup exist when the app starts.
+Pools of the modules imported later are started by their first use, like lazy pools.
+"""
+
+import asyncio
+import contextlib
+import time
+from typing import TYPE_CHECKING, AsyncIterator, Callable
+
+import metrics
+from logger import logger
+
+if TYPE_CHECKING:
+    from fastmcp import Client as FastMCPClient
+
+sessions_gauge = metrics.Gauge("mcp_sessions", "Number of MCP server sessions.", ("server", "state"))
+session_failures = metrics.Counter("mcp_session_failures_total", "MCP server sessions that failed.", ("server",))
+
+# All pools created in the process, for starting and stopping them with the app
+pools: list["MCPSessionPool"] = []
+
+
+class _Session:
+    __slots__ = ("client", "last_used")
+
+    def __init__(self, client: "FastMCPClient"):
+        self.client = client
+        self.last_used = time.monotonic()
+
+
+class MCPSessionPool:
+    """Sessions to the same MCP server. Each call uses a session exclusively."""
+
+    def __init__(
+        self,
+        factory: Callable[[], "FastMCPClient"],
+        *,
+        name: str = "",
+        min_size: int = 1,
+        max_size: int = 1,
+        idle_timeout: float = 300,
+        health_check_interval: float = 30,
+        health_check_timeout: float = 5,
+        lazy: bool = False,
+    ):
+        """
+        Args:
+            factory: Creates a client for a new session. Each client must start its own server.
+            name: Name of the server in logs and metrics
+            min_size: Number of sessions started in advance and kept running
+            max_size: Maximum number of sessions. Calls wait for a free session above this.
+            idle_timeout: Sessions above min_size are stopped after being idle this many seconds.
+            health_check_interval: Idle sessions are pinged at this interval. Sessions that fail are restarted.
+            health_check_timeout: Sessions that do not answer the ping in this many seconds are restarted.
+            lazy: Do not start the pool with the app, but on first use.
+        """
+        assert 0 <= min_size <= max_size, "min_size must be between 0 and max_size"
+        assert max_size > 0, "max_size must be positive"
+        self.factory = factory
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.lazy = lazy
+        self._sessions: list[_Session] = []
+        # Most recently used last, so sessions at the start become idle and are stopped first.
+        self._idle: list[_Session] = []
+        # Sessions in use or starting
+        self._slots = asyncio.Semaphore(max_size)
+        self._monitor: asyncio.Task | None = None
+        self._closed = False
+        pools.append(self)
+
+    @property
+    def size(self) -> int:
+        return len(self._sessions)
+
+    async def start(self):
+        """Start min_size sessions and the health checks. Called on first use if not called before."""
+        if self._monitor:
+            return
+        self._closed = False
+        self._monitor = asyncio.create_task(self._run_monitor())
+        await self._fill()
+
+    async def close(self):
+        """Stop all sessions."""
+        self._closed = True
+        if self._monitor:
+            self._monitor.cancel()
+            self._monitor = None
+        sessions, self._sessions, self._idle = self._sessions, [], []
+        await asyncio.gather(*(self._stop(session) for session in sessions))
+        self._update_metrics()
+
+    @contextlib.asynccontextmanager
+    async def session(self) -> AsyncIterator["FastMCPClient"]:
+        """
+        Use a session for a call. Waits if max_size sessions are in use.
+        The session is restarted if the call fails with an error other than an error returned by the tool.
+        """
+        from fastmcp.exceptions import ToolError
+
+        await self.start()
+        await self._slots.acquire()
+        try:
+            session = await self._take_idle() or await self._start_session()
+        except BaseException:
+            self._slots.release()
+            raise
+        self._update_metrics()
+        healthy = False
+        try:
+            yield session.client
+            healthy = True
+        except (ToolError, asyncio.CancelledError):
+            # The server answered, or we stopped waiting for the answer. The session can be reused.
+            healthy = True
+            raise
+        finally:
+            session.last_used = time.monotonic()
+            if healthy:
+                self._idle.append(session)
+            else:
+                session_failures.labels(self.name).inc()
+                logger.warning("Restarting session of MCP server %s after failed call", self.name)
+                self._remove(session)
+                asyncio.create_task(self._stop(session))
+            self._slots.release()
+            self._update_metrics()
+
+    async def _take_idle(self) -> _Session | None:
+        """Return the most recently used idle session. Sessions of servers that exited are dropped."""
+        while self._idle:
+            session = self._idle.pop()
+            if session.client.is_connected():
+                return session
+            session_failures.labels(self.name).inc()
+            logger.warning("Session of MCP server %s is closed, restarting", self.name)
+            self._remove(session)
+            await self._stop(session)
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "server": self.name,
+            "sessions": len(self._sessions),
+            "idle": len(self._idle),
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "lazy": self.lazy,
+        }
+
+    async def check(self):
+        """Stop idle sessions above min_size, restart sessions that do not answer a ping and start missing sessions."""
+        now = time.monotonic()
+        # Removed before stopping any of them, so a call cannot take an expired session while others are stopped.
+        expired: list[_Session] = []
+        for session in list(self._idle):
+            if len(self._sessions) > self.min_size and now - session.last_used > self.idle_timeout:
+                self._remove(session)
+                expired.append(session)
+        if expired:
+            logger.info("Stopping %d idle session(s) of MCP server %s", len(expired), self.name)
+            await asyncio.gather(*(self._stop(session) for session in expired))
+        await asyncio.gather(*(self._ping(session) for session in list(self._idle)))
+        await self._fill()
+        self._update_metrics()
+
+    async def _ping(self, session: _Session):
+        try:
+            async with asyncio.timeout(self.health_check_timeout):
+                await session.client.ping()
+        except Exception as e:
+            if session not in self._idle:
+                # Taken by a call or removed while waiting. Calls restart sessions that fail.
+                return
+            session_failures.labels(self.name).inc()
+            logger.warning("Restarting session of MCP server %s after failed health check: %r", self.name, e)
+            self._remove(session)
+            await self._stop(session)
+
+    async def _fill(self):
+        """Start sessions until there are min_size sessions."""
+
+        async def add():
+            async with self._slots:
+                session = await self._start_session()
+                self._idle.append(session)
+
+        missing = self.min_size - len(self._sessions)
+        if missing > 0:
+            results = await asyncio.gather(*(add() for _ in range(missing)), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error("Error starting MCP server %s: %r", self.name, result)
+            self._update_metrics()
+
+    async def _start_session(self) -> _Session:
+        started = time.perf_counter()
+        client = self.factory()
+        # The client runs the session in its own task, so the session outlives this call. It is stopped by close().
+        await client.__aenter__()
+        session = _Session(client)
+        self._sessions.append(session)
+        logger.info("Started session of MCP server %s in %.2f seconds", self.name, time.perf_counter() - started)
+        return session
+
+    def _remove(self, session: _Session):
+        if session in self._sessions:
+            self._sessions.remove(session)
+        if session in self._idle:
+            self._idle.remove(session)
+
+    async def _stop(self, session: _Session):
+        try:
+            await session.client.close()
+        except Exception as e:
+            logger.debug("Error closing session of MCP server %s: %r", self.name, e)
+
+    async def _run_monitor(self):
+        while not self._closed:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                await self.check()
+            except Exception:
+                logger.exception("Error checking sessions of MCP server %s", self.name)
+
+    def _update_metrics(self):
+        sessions_gauge.labels(self.name, "idle").set(len(self._idle))
+        sessions_gauge.labels(self.name, "busy").set(len(self._sessions) - len(self._idle))
+
+
+async def start_all():
+    """
+    Start the pools that are not lazy. Errors are logged, so a broken server does not stop the others.
+    Only the pools created so far are started, pools of modules imported later are started on first use.
+    """
+    eager = [pool for pool in pools if not pool.lazy]
+    results = await asyncio.gather(*(pool.start() for pool in eager), return_exceptions=True)
+    for pool, result in zip(eager, results):
+        if isinstance(result, Exception):
+            logger.error("Error starting MCP server %s: %r", pool.name, result)
+
+
+async def close_all():
+    await asyncio.gather(*(pool.close() for pool in pools), return_exceptions=True)
@@ -0,0 +1,170 @@
+"""
+Router assistant that sends each turn to a fast or a strong model.
+
+Turns are classified with cheap local heuristics first. Short questions go to the fast model,
+long messages, code and multi-step tool use go to the strong model.
+Turns in between are classified by a small model if one is configured, otherwise they go to the fast model.
+
+Routing decisions are logged and counted in router_decisions_total, and the duration of the runs is recorded in
+router_run_seconds by tier, so the thresholds can be tuned.
+"""
+
+import asyncio
+import re
+import time
+from typing import Literal, NamedTuple, Optional
+
+from pydantic import BaseModel
+
+import metrics
+from akson import Assistant, Chat
+from logger import logger
+
+from .llm_assistant import LLMAssistant, default_model
+from .toolkit import Toolkit
+
+Tier = Literal["fast", "strong"]
+
+decisions = metrics.Counter(
+    "router_decisions_total", "Routing decisions of router assistants.", ("router", "tier", "reason")
+)
+run_duration = metrics.Histogram("router_run_seconds", "Duration of runs by routed tier.", ("router", "tier"))
+
+# Fenced code, stack traces and common syntax of programming languages
+CODE_PATTERN = re.compile(
+    r"```|Traceback \(most recent call last\)|^\s*(def|class|import|from|function|const|let|SELECT|#include)\s"
+    r"|[;{}]\s*$",
+    re.MULTILINE,
+)
+
+
+class Route(NamedTuple):
+    tier: Tier
+    reason: str
+
+
+class Classification(BaseModel):
+    complex: bool
+    """True if the message needs reasoning, expert knowledge, code or several steps to answer"""
+
+
+class Router(Assistant):
+    """Routes each turn to a fast or a strong model. Both use the same system prompt and toolkit."""
+
+    def __init__(
+        self,
+        name: str,
+        description: Optional[str] = None,
+        fast_model: str = "gpt-4.1-nano",
+        strong_model: Optional[str] = None,
+        classifier_model: Optional[str] = None,
+        system_prompt: Optional[str] = None,
+        toolkit: Optional[Toolkit] = None,
+        short_length: int = 80,
+        long_length: int = 1000,
+        classifier_timeout: float = 2.0,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None,
+    ):
+        """
+        Creates a new Router.
+
+        strong_model defaults to the DEFAULT_MODEL environment variable.
+        Messages shorter than short_length characters go to the fast model without asking the classifier,
+        messages longer than long_length characters go to the strong model.
+        If the classifier does not answer in classifier_timeout seconds, the strong model is used.
+        api_key and api_base are used for all models.
+        """
+        self.name = name
+        self.description = description
+        self.short_length = short_length
+        self.long_length = long_length
+        self.classifier_timeout = classifier_timeout
+        # Tiers reply with the router's name, so the replies can be retried through the registry.
+        models: list[tuple[Tier, str]] = [("fast", fast_model), ("strong", strong_model or default_model())]
+        self.tiers: dict[Tier, LLMAssistant] = {
+            tier: LLMAssistant(
+                name,
+                model=model,
+                system_prompt=system_prompt,
+                toolkit=toolkit,
+                api_key=api_key,
+                api_base=api_base,
+            )
+            for tier, model in models
+        }
+        self.classifier: Optional[LLMAssistant] = None
+        if classifier_model:
+            self.classifier = LLMAssistant(
+                f"{name}Classifier",
+                model=classifier_model,
+                system_prompt="Decide if the user's message is complex. Simple messages are greetings, "
+                "small talk, short factual questions and simple rewrites.",
+                output_type=Classification,
+                api_key=api_key,
+                api_base=api_base,
+            )
+
+    async def run(self, chat: Chat) -> None:
+        started = time.perf_counter()
+        route = await self.route(chat)
+        classified = time.perf_counter()
+        decisions.labels(self.name, route.tier, route.reason).inc()
+        try:
+            await self.tiers[route.tier].run(chat)
+        finally:
+            elapsed = time.perf_counter() - classified
+            run_duration.labels(self.name, route.tier).observe(elapsed)
+            logger.info(
+                "Routed to %s (%s, %s) in %.2fs, run took %.2fs",
+                route.tier,
+                self.tiers[route.tier].model,
+                route.reason,
+                classified - started,
+                elapsed,
+            )
+
+    async def route(self, chat: Chat) -> Route:
+        """Choose the tier for the current turn."""
+        route = self.classify_locally(chat)
+        if route:
+            return route
+        if not self.classifier:
+            return Route("fast", "default")
+        try:
+            async with asyncio.timeout(self.classifier_timeout):
+                is_complex = await self._classify(chat)
+        except Exception as e:
+            logger.warning("Classifier failed, using the strong model: %r", e)
+            return Route("strong", "classifier_error")
+        return Route("strong" if is_complex else "fast", "classifier")
+
+    def classify_locally(self, chat: Chat) -> Optional[Route]:
+        """Classify the turn with heuristics. Returns None if the heuristics are not conclusive."""
+        messages = chat.state.messages
+        user_messages = [message for message in messages if message.role == "user"]
+        if not user_messages:
+            return Route("fast", "empty")
+        content = user_messages[-1].content
+        if CODE_PATTERN.search(content):
+            return Route("strong", "code")
+        if len(content) > self.long_length:
+            return Route("strong", "long")
+        # Tool calls in the previous turn mean a multi-step task is in progress.
+        last_user = max(i for i, message in enumerate(messages) if message.role == "user")
+        previous_turn = max((i for i, message in enumerate(messages[:last_user]) if message.role == "user"), default=0)
+        if any(message.tool_call for message in messages[previous_turn:]):
+            return Route("strong", "tools")
+        if len(content) < self.short_length:
+            return Route("fast", "short")
+        return None
+
+    async def _classify(self, chat: Chat) -> bool:
+        assert self.classifier
+        user_message = [message for message in chat.state.messages if message.role == "user"][-1]
+        # Only the last message is sent, so the classification is cheap and fast.
+        temp = Chat()
+        temp.state.messages = [user_message]
+        await self.classifier.run(temp)
+        chat.add_usage(temp.usage)
+        return Classification.model_validate_json(temp.state.messages[-1].content).complex
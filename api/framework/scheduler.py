@@ -0,0 +1,316 @@
+"""
+Scheduler for completion requests sent to LLM providers.
+
+Requests are limited per model and API key by a concurrency limit and by token buckets for requests/min and tokens/min.
+When a limit is reached, requests wait in a queue ordered by priority, so interactive turns go ahead of background work.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from enum import IntEnum
+from typing import AsyncIterator, Mapping, Optional
+
+import metrics
+from logger import logger
+
+queue_wait = metrics.Histogram(
+    "llm_queue_wait_seconds",
+    "Time spent waiting in the scheduler queue before sending a completion request.",
+    ("model", "priority"),
+)
+
+
+class Priority(IntEnum):
+    """Lower values are scheduled first."""
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+# Overrides the priority of requests sent in the current context. Set with Scheduler.priority.
+_priority_override: ContextVar[Optional[Priority]] = ContextVar("priority_override", default=None)
+
+
+@dataclass
+class Limits:
+    """Limits for a single model and API key. None means unlimited."""
+
+    concurrency: Optional[int] = None
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+
+
+class TokenBucket:
+    """Token bucket that refills continuously at the given rate per minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Return the number of seconds until the amount is available."""
+        self._refill()
+        # Requests larger than the capacity would never fit, let them go when the bucket is full.
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    tokens: int
+    future: asyncio.Future
+
+
+class ModelLimiter:
+    """Limits requests to a single model with a single API key."""
+
+    def __init__(self, model: str, limits: Limits):
+        self.model = model
+        self.limits = limits
+        self.active = 0
+        self._requests = TokenBucket(limits.requests_per_minute) if limits.requests_per_minute else None
+        self._tokens = TokenBucket(limits.tokens_per_minute) if limits.tokens_per_minute else None
+        self._waiters: list[_Waiter] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._paused_until = 0.0
+
+    async def acquire(self, priority: Priority, tokens: int):
+        waiter = _Waiter(priority, next(self._seq), tokens, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted just before cancellation.
+                self.release()
+            else:
+                waiter.future.cancel()
+                self._dispatch()
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def record_tokens(self, estimated: int, actual: int):
+        """Correct the token bucket after the actual token usage is known."""
+        if self._tokens:
+            self._tokens.consume(actual - estimated)
+
+    def pause(self, seconds: float):
+        """Stop sending new requests for a while, e.g. after the provider returns 429."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _dispatch(self):
+        """Grant slots to waiters in priority order while limits allow."""
+        while self._waiters:
+            waiter = self._waiters[0]
+            if waiter.future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.limits.concurrency and self.active >= self.limits.concurrency:
+                # Next release will call this method again.
+                return
+            delay = self._paused_until - time.monotonic()
+            if self._requests:
+                delay = max(delay, self._requests.delay(1))
+            if self._tokens:
+                delay = max(delay, self._tokens.delay(waiter.tokens))
+            if delay > 0:
+                self._schedule(delay)
+                return
+            heapq.heappop(self._waiters)
+            if self._requests:
+                self._requests.consume(1)
+            if self._tokens:
+                self._tokens.consume(waiter.tokens)
+            self.active += 1
+            waiter.future.set_result(None)
+
+    def _schedule(self, delay: float):
+        if self._timer:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model,
+            "active": self.active,
+            "queued": sum(1 for waiter in self._waiters if not waiter.future.done()),
+            "limits": {
+                "concurrency": self.limits.concurrency,
+                "requests_per_minute": self.limits.requests_per_minute,
+                "tokens_per_minute": self.limits.tokens_per_minute,
+            },
+        }
+
+
+class Slot:
+    """Permission to send a single completion request. Returned by Scheduler.slot."""
+
+    def __init__(self, limiter: ModelLimiter, tokens: int):
+        self.limiter = limiter
+        self.tokens = tokens
+
+    def record_usage(self, total_tokens: int):
+        """Report the actual number of tokens used by the request."""
+        self.limiter.record_tokens(self.tokens, total_tokens)
+        self.tokens = total_tokens
+
+    async def backoff(self, attempt: int, retry_after: Optional[float] = None):
+        """Wait before retrying a rate limited request. Other requests to the same model are paused too."""
+        delay = retry_after if retry_after is not None else min(2**attempt, 30)
+        logger.warning("Rate limited by %s, retrying in %.1f seconds", self.limiter.model, delay)
+        self.limiter.pause(delay)
+        await asyncio.sleep(delay)
+
+
+def retry_after(headers: Optional[Mapping[str, str]], max_delay: float = 60) -> Optional[float]:
+    """
+    Return the seconds to wait from retry-after-ms or Retry-After headers of a 429 response, or None if not sent.
+    Retry-After is either a number of seconds or an HTTP date. The delay is capped at max_delay.
+    """
+    if not headers:
+        return None
+    try:
+        if value := headers.get("retry-after-ms"):
+            delay = float(value) / 1000
+        elif value := headers.get("retry-after"):
+            try:
+                delay = float(value)
+            except ValueError:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+        else:
+            return None
+    except (TypeError, ValueError):
+        return None
+    return min(max(delay, 0), max_delay)
+
+
+class Scheduler:
+    """Schedules completion requests across models and API keys."""
+
+    def __init__(self, default_limits: Optional[Limits] = None, model_limits: Optional[dict[str, Limits]] = None):
+        self.default_limits = default_limits or Limits()
+        self.model_limits = model_limits or {}
+        self._limiters: dict[tuple[str, str], ModelLimiter] = {}
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a scheduler from environment variables.
+
+        LLM_MAX_CONCURRENCY, LLM_REQUESTS_PER_MINUTE and LLM_TOKENS_PER_MINUTE set the default limits.
+        LLM_LIMITS is a JSON object that overrides the limits per model,
+        e.g. {"gpt-4.1": {"concurrency": 4, "tokens_per_minute": 30000}}
+        """
+
+        def number(name: str):
+            value = os.getenv(name)
+            return float(value) if value else None
+
+        concurrency = os.getenv("LLM_MAX_CONCURRENCY")
+        default_limits = Limits(
+            concurrency=int(concurrency) if concurrency else None,
+            requests_per_minute=number("LLM_REQUESTS_PER_MINUTE"),
+            tokens_per_minute=number("LLM_TOKENS_PER_MINUTE"),
+        )
+        model_limits = {model: Limits(**limits) for model, limits in json.loads(os.getenv("LLM_LIMITS", "{}")).items()}
+        return cls(default_limits, model_limits)
+
+    def configure(self, model: str, limits: Limits):
+        """Set limits for a model. Must be called before the first request to the model."""
+        self.model_limits[model] = limits
+
+    def _get_limiter(self, model: str, api_key: Optional[str]) -> ModelLimiter:
+        # Do not keep API keys in memory as plain text.
+        key_hash = hashlib.sha256(api_key.encode()).hexdigest()[:8] if api_key else ""
+        key = (model, key_hash)
+        try:
+            return self._limiters[key]
+        except KeyError:
+            limits = self.model_limits.get(model, self.default_limits)
+            limiter = self._limiters[key] = ModelLimiter(model, limits)
+            return limiter
+
+    @staticmethod
+    @contextlib.contextmanager
+    def priority(priority: Priority):
+        """Send the requests made in the block with the given priority, regardless of the assistant's priority."""
+        token = _priority_override.set(priority)
+        try:
+            yield
+        finally:
+            _priority_override.reset(token)
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self,
+        model: str,
+        *,
+        api_key: Optional[str] = None,
+        priority: Priority = Priority.INTERACTIVE,
+        tokens: int = 0,
+    ) -> AsyncIterator[Slot]:
+        """
+        Wait until a request can be sent to the model and hold the slot until the context exits.
+
+        Args:
+            model: Model name
+            api_key: API key used for the request. Each key has its own limits.
+            priority: Requests with lower priority value are scheduled first.
+            tokens: Estimated number of tokens used by the request
+        """
+        override = _priority_override.get()
+        if override is not None:
+            priority = override
+        limiter = self._get_limiter(model, api_key)
+        started = time.monotonic()
+        await limiter.acquire(priority, tokens)
+        waited = time.monotonic() - started
+        queue_wait.labels(model, priority.name.lower()).observe(waited)
+        metrics.add_timing("queue", waited)
+        if waited > 1:
+            logger.info("Waited %.1f seconds in queue for %s", waited, model)
+        try:
+            yield Slot(limiter, tokens)
+        finally:
+            limiter.release()
+
+    def stats(self) -> list[dict]:
+        return [limiter.stats() for limiter in self._limiters.values()]
+
+
+def estimate_tokens(messages: list) -> int:
+    """Cheap estimate of the prompt size. Roughly 4 characters per token."""
+    return sum(len(str(message.get("content") or "")) for message in messages) // 4
+
+
+# Shared by all assistants in the process
+scheduler = Scheduler.from_env()
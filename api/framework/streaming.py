@@ -1,5 +1,4 @@
-from io import StringIO
-from typing import Literal, Optional
+from typing import Literal, NamedTuple, Optional
 
 from litellm.types.utils import (
     ChatCompletionMessageToolCall,
@@ -7,61 +6,100 @@ from litellm.types.utils import (
     Function,
     Message,
 )
-from pydantic import BaseModel
 
 # Allowed fields for streaming chunks
 EventType = Literal["content", "tool_call.id", "tool_call.name", "tool_call.arguments"]
 
 
-class Event(BaseModel):
+class Event(NamedTuple):
     name: EventType
     chunk: str
+    tool_index: int = 0
+    """Index of the tool call for tool_call.* events"""
+
+
+class _ToolCallBuilder:
+    __slots__ = ("id", "type", "name", "arguments")
+
+    def __init__(self):
+        self.id: Optional[str] = None
+        self.type: Optional[str] = None
+        self.name: list[str] = []
+        self.arguments: list[str] = []
 
 
 class MessageBuilder:
-    """A class for building a Message object from a stream of deltas. Usage is similar to io.StringIO."""
+    """
+    A class for building a Message object from a stream of deltas. Usage is similar to io.StringIO.
+
+    Chunks are collected in lists and joined once in getvalue, so the cost of a delta does not grow with the message.
+    """
+
+    __slots__ = ("_role", "_content", "_tool_calls")
 
     def __init__(self):
-        self.values = Values(
-            message_role=StrValue(),
-            message_content=StrValue("content", streamable=True),
-            tool_call_id=StrValue("tool_call.id"),
-            tool_call_type=StrValue(),
-            function_name=StrValue("tool_call.name", streamable=True),
-            function_arguments=StrValue("tool_call.arguments", streamable=True),
-        )
+        self._role: Optional[str] = None
+        self._content: list[str] = []
+        # Keyed by index of the tool call
+        self._tool_calls: dict[int, _ToolCallBuilder] = {}
 
     def write(self, delta: Delta) -> list[Event]:
         """Apply a delta to the current state of the builder."""
-        self.values.write("message_role", delta.role)
-        self.values.write("message_content", delta.content)
-        if delta.tool_calls:
-            assert len(delta.tool_calls) == 1
-            tool_call = delta.tool_calls[0]
-            assert tool_call.index == 0
-            self.values.write("tool_call_id", tool_call.id)
-            self.values.write("tool_call_type", tool_call.type)
-            self.values.write("function_name", tool_call.function.name)
-            self.values.write("function_arguments", tool_call.function.arguments)
+        events = []
 
-        return self.values.getevents()
+        role = delta.role
+        if role is not None:
+            if self._role is not None and self._role != role:
+                raise ValueError("Value is not streamable")
+            self._role = role
+
+        content = delta.content
+        if content:
+            self._content.append(content)
+            events.append(Event("content", content))
+
+        if delta.tool_calls:
+            for tool_call in delta.tool_calls:
+                index = tool_call.index or 0
+                builder = self._tool_calls.get(index)
+                if builder is None:
+                    builder = self._tool_calls[index] = _ToolCallBuilder()
+                if tool_call.id:
+                    if builder.id is None:
+                        builder.id = tool_call.id
+                        events.append(Event("tool_call.id", tool_call.id, index))
+                    elif builder.id != tool_call.id:
+                        raise ValueError("Value is not streamable")
+                if tool_call.type:
+                    builder.type = tool_call.type
+                function = tool_call.function
+                if function.name:
+                    builder.name.append(function.name)
+                    events.append(Event("tool_call.name", function.name, index))
+                if function.arguments:
+                    builder.arguments.append(function.arguments)
+                    events.append(Event("tool_call.arguments", function.arguments, index))
+
+        return events
 
     def getvalue(self) -> Message:
         """Construct a Message object from the current state of the builder."""
         message = Message(
-            role=self.values["message_role"],  # type: ignore
-            content=self.values["message_content"],
+            role=self._role,  # type: ignore
+            content="".join(self._content),
         )
-        if self.values["tool_call_id"]:
+        tool_calls = [self._tool_calls[index] for index in sorted(self._tool_calls) if self._tool_calls[index].id]
+        if tool_calls:
             message.tool_calls = [
                 ChatCompletionMessageToolCall(
-                    id=self.values["tool_call_id"],
-                    type=self.values["tool_call_type"],
+                    id=tool_call.id,
+                    type=tool_call.type,
                     function=Function(
-                        name=self.values["function_name"],
-                        arguments=self.values["function_arguments"],
+                        name="".join(tool_call.name),
+                        arguments="".join(tool_call.arguments),
                     ),
                 )
+                for tool_call in tool_calls
             ]
         return message
 
@@ -69,17 +107,18 @@ class MessageBuilder:
 class StrValue:
     """Helper class for building a string value from a stream of chunks."""
 
+    __slots__ = ("event_name", "streamable", "_value", "_chunks")
+
     def __init__(self, event_name: Optional[EventType] = None, streamable: bool = False):
         self.event_name: Optional[EventType] = event_name
-        if streamable:
-            self.str = StringIO()
-        else:
-            self.str = None
+        self.streamable = streamable
+        self._value: Optional[str] = None
+        self._chunks: list[str] = []
 
     def __bool__(self):
-        if isinstance(self.str, StringIO):
-            return bool(self.str.getvalue())
-        return bool(self.str)
+        if self.streamable:
+            return bool(self._chunks)
+        return bool(self._value)
 
     def write(self, chunk: str | None) -> Event | None:
         """
@@ -87,32 +126,33 @@ class StrValue:
         Returns an event if event_name is set.
         """
         if chunk is None:
-            return
-        elif isinstance(self.str, StringIO):
-            if chunk:
-                self.str.write(chunk)
-                if self.event_name:
-                    return Event(name=self.event_name, chunk=chunk)
-        elif self.str is not None and self.str != chunk:
+            return None
+        if self.streamable:
+            if not chunk:
+                return None
+            self._chunks.append(chunk)
+        elif self._value is not None and self._value != chunk:
             raise ValueError("Value is not streamable")
         else:
-            self.str = chunk
-            if self.event_name:
-                return Event(name=self.event_name, chunk=chunk)
+            self._value = chunk
+        if self.event_name:
+            return Event(self.event_name, chunk)
+        return None
 
     def getvalue(self) -> str | None:
-        if isinstance(self.str, StringIO):
-            return self.str.getvalue()
-        else:
-            return self.str
+        if self.streamable:
+            return "".join(self._chunks)
+        return self._value
 
 
 class Values:
     """Helper class for generating a list of events from a stream of chunks."""
 
+    __slots__ = ("_values", "_events")
+
     def __init__(self, **kwargs: StrValue):
         self._values = kwargs
-        self._events = []
+        self._events: list[Event] = []
 
     def __getitem__(self, name: str) -> str | None:
         return self._values[name].getvalue()
@@ -0,0 +1,57 @@
+import pytest
+from litellm import Message as LitellmMessage
+from litellm.types.utils import Delta, ModelResponseStream, StreamingChoices
+
+from .cassette import CassetteNotFound, Cassettes, completion_key
+
+
+def _chunk(content: str, finish_reason=None) -> ModelResponseStream:
+    return ModelResponseStream(
+        id="chatcmpl-1",
+        model="gpt-4.1",
+        choices=[StreamingChoices(index=0, delta=Delta(content=content), finish_reason=finish_reason)],
+    )
+
+
+async def _stream():
+    yield _chunk("Hello")
+    yield _chunk(" world", finish_reason="stop")
+
+
+def test_completion_key_ignores_system_messages():
+    messages = [
+        LitellmMessage(role="system", content="Today is Monday"),  # type: ignore
+        LitellmMessage(role="user", content="Hi"),  # type: ignore
+    ]
+    key = completion_key("gpt-4.1", messages)
+    messages[0]["content"] = "Today is Tuesday"
+    assert completion_key("gpt-4.1", messages) == key
+    messages[1]["content"] = "Hello"
+    assert completion_key("gpt-4.1", messages) != key
+
+
+@pytest.mark.asyncio
+async def test_record_and_replay(tmp_path):
+    recorder = Cassettes("record", str(tmp_path))
+    recorded = [chunk async for chunk in recorder.record_completion("key", _stream(), 0)]
+
+    player = Cassettes("replay", str(tmp_path), speed=0)
+    replayed = [chunk async for chunk in player.replay_completion("key")]
+
+    assert [chunk.choices[0].delta.content for chunk in replayed] == ["Hello", " world"]
+    assert replayed[-1].choices[0].finish_reason == "stop"
+    assert len(replayed) == len(recorded)
+
+    with pytest.raises(CassetteNotFound):
+        player.replay_completion("other")
+
+
+@pytest.mark.asyncio
+async def test_replay_tool_result(tmp_path):
+    recorder = Cassettes("record", str(tmp_path))
+    recorder.record_tools("server", [{"type": "function", "function": {"name": "search"}}])
+    recorder.record_tool_result("server", "search", {"query": "akson"}, "result", 0.5)
+
+    player = Cassettes("replay", str(tmp_path), speed=0)
+    assert player.replay_tools("server")[0]["function"]["name"] == "search"
+    assert await player.replay_tool_result("server", "search", {"query": "akson"}) == "result"
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import shlex
+import sys
+from typing import cast
+
+import pytest
+from fastmcp import Client as FastMCPClient
+from fastmcp.client.transports import StdioTransport
+from litellm import ChatCompletionMessageToolCall
+from litellm.types.utils import Function
+
+from .mcp_pool import MCPSessionPool
+from .tool_cache import lookups, tool_cache
+from .toolkit import MCPToolkit, ToolContext
+
+SERVER = os.path.join(os.path.dirname(__file__), "testdata", "mcp_server.py")
+
+
+@pytest.fixture(autouse=True)
+def empty_tool_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(tool_cache, "directory", str(tmp_path))
+
+
+def _call(name: str, arguments: str = "{}", id: str = "1"):
+    return ChatCompletionMessageToolCall(id=id, function=Function(name=name, arguments=arguments))
+
+
+async def _pid(toolkit: MCPToolkit, name: str = "pid", arguments: str = "{}") -> str:
+    messages = await toolkit.handle_tool_calls([_call(name, arguments)], ToolContext(caller="test"))
+    return messages[0]["content"]
+
+
+@pytest.mark.asyncio
+async def test_prewarm():
+    toolkit = MCPToolkit.from_config(sys.executable, [SERVER], min_sessions=2, max_sessions=3)
+    try:
+        await toolkit.pool.start()
+        assert toolkit.pool.stats()["idle"] == 2
+    finally:
+        await toolkit.pool.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_use_separate_sessions():
+    toolkit = MCPToolkit.from_config(sys.executable, [SERVER], min_sessions=0, max_sessions=2)
+    try:
+        await toolkit.get_tools()
+        async with asyncio.timeout(10):
+            pids = await asyncio.gather(*(_pid(toolkit, "sleep", '{"seconds": 1}') for _ in range(2)))
+        assert len(set(pids)) == 2
+        assert toolkit.pool.size == 2
+    finally:
+        await toolkit.pool.close()
+
+
+@pytest.mark.asyncio
+async def test_restart_after_crash():
+    toolkit = MCPToolkit.from_config(sys.executable, [SERVER], min_sessions=1, max_sessions=1)
+    try:
+        before = await _pid(toolkit)
+        with pytest.raises(Exception):
+            await _pid(toolkit, "crash")
+        after = await _pid(toolkit)
+        assert after.isdigit()
+        assert after != before
+    finally:
+        await toolkit.pool.close()
+
+
+@pytest.mark.asyncio
+async def test_idle_sessions_are_stopped():
+    toolkit = MCPToolkit.from_config(sys.executable, [SERVER], min_sessions=1, max_sessions=2)
+    toolkit.pool.idle_timeout = 0
+    try:
+        await asyncio.gather(*(_pid(toolkit, "sleep", '{"seconds": 0.5}') for _ in range(2)))
+        assert toolkit.pool.size == 2
+        await toolkit.pool.check()
+        assert toolkit.pool.size == 1
+    finally:
+        await toolkit.pool.close()
+
+
+@pytest.mark.asyncio
+async def test_tools_are_served_from_cache():
+    hits, misses = lookups.labels("hit").value, lookups.labels("miss").value
+    toolkit = MCPToolkit.from_config(sys.executable, [SERVER], min_sessions=0)
+    assert lookups.labels("miss").value - misses == 1
+    try:
+        tools = await toolkit.get_tools()
+    finally:
+        await toolkit.pool.close()
+
+    cached = MCPToolkit.from_config(sys.executable, [SERVER], min_sessions=0)
+    try:
+        assert cached.pool.lazy
+        assert lookups.labels("hit").value - hits == 1
+        assert await cached.get_tools() == tools
+        # The server is started by the first call.
+        assert cached.pool.size == 0
+        assert (await _pid(cached)).isdigit()
+        assert cached.pool.size == 1
+    finally:
+        await cached.pool.close()
+
+
+@pytest.mark.asyncio
+async def test_tools_are_refreshed_when_changed():
+    toolkit = MCPToolkit.from_config(sys.executable, [SERVER], min_sessions=0)
+    try:
+        await toolkit.get_tools()
+        await _pid(toolkit, "add_tool", '{"name": "hello"}')
+        async with asyncio.timeout(5):
+            while "hello" not in [tool["function"]["name"] for tool in await toolkit.get_tools()]:
+                await asyncio.sleep(0.05)
+        entry = tool_cache.load(toolkit.key)
+        assert entry is not None
+        assert "hello" in [tool["function"]["name"] for tool in entry["tools"]]
+    finally:
+        await toolkit.pool.close()
+
+
+def test_key_of_single_client_leaves_out_env():
+    client = FastMCPClient(StdioTransport(sys.executable, [SERVER], env={"API_KEY": "secret"}))
+    toolkit = MCPToolkit(client, min_sessions=0)
+    assert toolkit.key == shlex.join([sys.executable, SERVER])
+    assert toolkit.pool.name == os.path.basename(sys.executable)
+    assert "secret" not in toolkit.key
+
+
+def test_key_is_required_for_single_client_without_command():
+    client = FastMCPClient("https://example.com/mcp?token=secret")
+    with pytest.raises(AssertionError, match="key is required"):
+        MCPToolkit(client)
+    assert MCPToolkit(client, key="example", min_sessions=0).pool.name == "example"
+
+
+class _FakeClient:
+    """Client that takes a while to close, so other calls run while sessions are stopped."""
+
+    def __init__(self):
+        self.connected = False
+        self.closed = False
+
+    async def __aenter__(self):
+        self.connected = True
+        return self
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def ping(self):
+        return True
+
+    async def close(self):
+        await asyncio.sleep(0.01)
+        self.connected = False
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_session_in_use_is_not_stopped_as_idle():
+    pool = MCPSessionPool(lambda: cast(FastMCPClient, _FakeClient()), name="fake", min_size=0, max_size=2)
+    pool.idle_timeout = 0
+    try:
+        async with pool.session(), pool.session():
+            pass
+        assert pool.stats()["idle"] == 2
+        await asyncio.sleep(0.01)
+
+        check = asyncio.create_task(pool.check())
+        await asyncio.sleep(0)
+        # Both sessions expired, so the call starts a new one instead of taking one that is being stopped.
+        async with pool.session() as client:
+            await asyncio.sleep(0.05)
+            assert not cast(_FakeClient, client).closed
+        await check
+        assert pool.size == 1
+    finally:
+        await pool.close()
@@ -0,0 +1,83 @@
+from typing import Optional, cast
+
+import httpx
+import pytest
+from litellm.exceptions import RateLimitError
+from litellm.types.utils import Message as LitellmMessage
+
+from akson import Chat, Usage
+
+from . import llm_assistant
+from .llm_assistant import LLMAssistant
+from .scheduler import Slot
+
+
+class _Chat:
+    def __init__(self):
+        self.usage: list[Usage] = []
+
+    def add_usage(self, usage: Usage):
+        self.usage.append(usage)
+
+
+def _rate_limit_error(headers: dict) -> RateLimitError:
+    return RateLimitError(
+        "Too many requests", llm_provider="openai", model="gpt-4.1", response=httpx.Response(429, headers=headers)
+    )
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    """Replaces acompletion with a provider that returns 429 with the given headers until it runs out of errors."""
+    errors: list[RateLimitError] = []
+    backoffs: list[tuple[int, Optional[float]]] = []
+
+    async def acompletion(**kwargs):
+        if errors:
+            raise errors.pop(0)
+        return "response"
+
+    async def stream_reply(self, response, chat, started):
+        return LitellmMessage(content="Hi"), None, 0.0
+
+    async def backoff(self, attempt: int, retry_after: Optional[float] = None):
+        backoffs.append((attempt, retry_after))
+
+    monkeypatch.setattr(llm_assistant, "acompletion", acompletion)
+    monkeypatch.setattr(LLMAssistant, "_stream_reply", stream_reply)
+    monkeypatch.setattr(Slot, "backoff", backoff)
+    return errors, backoffs
+
+
+async def _complete(assistant: LLMAssistant) -> LitellmMessage:
+    messages = [LitellmMessage(role="user", content="Hello")]  # type: ignore
+    return await assistant._complete(messages, cast(Chat, _Chat()))
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_request_is_retried(provider):
+    errors, backoffs = provider
+    errors.extend([_rate_limit_error({"retry-after": "2"}), _rate_limit_error({})])
+    counted = llm_assistant.errors.labels("gpt-4.1", "RateLimitError").value
+
+    message = await _complete(LLMAssistant(name="Test", model="gpt-4.1"))
+
+    assert message.content == "Hi"
+    # Retry-After of the provider is used, then the exponential delay of the scheduler
+    assert backoffs == [(0, 2), (1, None)]
+    assert llm_assistant.errors.labels("gpt-4.1", "RateLimitError").value - counted == 2
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_request_gives_up(provider, monkeypatch):
+    monkeypatch.setattr(llm_assistant, "MAX_RATE_LIMIT_RETRIES", 1)
+    errors, backoffs = provider
+    errors.extend([_rate_limit_error({"retry-after-ms": "500"}), _rate_limit_error({"retry-after": "1"})])
+    counted = llm_assistant.errors.labels("gpt-4.1", "RateLimitError").value
+
+    with pytest.raises(RateLimitError):
+        await _complete(LLMAssistant(name="Test", model="gpt-4.1"))
+
+    assert backoffs == [(0, 0.5)]
+    # Each 429 is counted once
+    assert llm_assistant.errors.labels("gpt-4.1", "RateLimitError").value - counted == 2
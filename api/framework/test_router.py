@@ -0,0 +1,40 @@
+import pytest
+
+from akson import Chat, Message, ToolCall
+
+from .router import Route, Router
+
+
+def _chat(*messages: Message) -> Chat:
+    chat = Chat()
+    chat.state.messages = list(messages)
+    return chat
+
+
+def test_classify_locally():
+    router = Router("Auto", fast_model="fast", strong_model="strong")
+
+    assert router.classify_locally(_chat(Message(role="user", content="Hi!"))) == Route("fast", "short")
+    code = "Why does this fail?\n```py\nprint(1/0)\n```"
+    assert router.classify_locally(_chat(Message(role="user", content=code))) == Route("strong", "code")
+    assert router.classify_locally(_chat(Message(role="user", content="a" * 2000))) == Route("strong", "long")
+    assert router.classify_locally(_chat(Message(role="user", content="word " * 50))) is None
+
+
+def test_classify_locally_after_tool_calls():
+    router = Router("Auto", fast_model="fast", strong_model="strong")
+    chat = _chat(
+        Message(role="user", content="Find flights to Berlin"),
+        Message(role="assistant", content="", tool_call=ToolCall(id="1", name="search", arguments="{}")),
+        Message(role="tool", content="[]", tool_call_id="1"),
+        Message(role="assistant", content="There are no flights."),
+        Message(role="user", content="Try Munich"),
+    )
+    assert router.classify_locally(chat) == Route("strong", "tools")
+
+
+@pytest.mark.asyncio
+async def test_route_without_classifier():
+    router = Router("Auto", fast_model="fast", strong_model="strong")
+    chat = _chat(Message(role="user", content="word " * 50))
+    assert await router.route(chat) == Route("fast", "default")
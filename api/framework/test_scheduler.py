@@ -0,0 +1,146 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from .scheduler import Limits, Priority, Scheduler, TokenBucket, retry_after
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit():
+    scheduler = Scheduler(Limits(concurrency=2))
+    active = 0
+    max_active = 0
+
+    async def request():
+        nonlocal active, max_active
+        async with scheduler.slot("model"):
+            active += 1
+            max_active = max(max_active, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+    await asyncio.gather(*(request() for _ in range(10)))
+    assert max_active == 2
+
+
+@pytest.mark.asyncio
+async def test_priority_order():
+    scheduler = Scheduler(Limits(concurrency=1))
+    order = []
+
+    async def request(name: str, priority: Priority):
+        async with scheduler.slot("model", priority=priority):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async with scheduler.slot("model"):
+        # Queue requests while the only slot is taken
+        tasks = [
+            asyncio.create_task(request("background", Priority.BACKGROUND)),
+            asyncio.create_task(request("interactive", Priority.INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+
+    await asyncio.gather(*tasks)
+    assert order == ["interactive", "background"]
+
+
+@pytest.mark.asyncio
+async def test_priority_override():
+    scheduler = Scheduler(Limits(concurrency=1))
+    order = []
+
+    async def request(name: str, priority: Priority | None = None):
+        if priority is None:
+            async with scheduler.slot("model"):
+                order.append(name)
+            return
+        with scheduler.priority(priority):
+            async with scheduler.slot("model"):
+                order.append(name)
+
+    async with scheduler.slot("model"):
+        tasks = [
+            asyncio.create_task(request("batch", Priority.BACKGROUND)),
+            asyncio.create_task(request("interactive")),
+        ]
+        await asyncio.sleep(0)
+
+    await asyncio.gather(*tasks)
+    assert order == ["interactive", "batch"]
+
+
+@pytest.mark.asyncio
+async def test_limits_per_api_key():
+    scheduler = Scheduler(Limits(concurrency=1))
+    async with scheduler.slot("model", api_key="key1"):
+        # Different key has its own limit, so this does not block.
+        async with asyncio.timeout(1):
+            async with scheduler.slot("model", api_key="key2"):
+                pass
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_leak_slot():
+    scheduler = Scheduler(Limits(concurrency=1))
+
+    async def request():
+        async with scheduler.slot("model"):
+            pass
+
+    async with scheduler.slot("model"):
+        task = asyncio.create_task(request())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    async with asyncio.timeout(1):
+        await request()
+    assert scheduler.stats()[0]["active"] == 0
+
+
+def test_token_bucket():
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.delay(60) == 0
+    bucket.consume(60)
+    assert bucket.delay(1) == pytest.approx(1, abs=0.1)
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"retry-after": "2"}, 2),
+        ({"retry-after-ms": "1500", "retry-after": "2"}, 1.5),
+        ({"retry-after": "3600"}, 60),
+        ({"retry-after": "-1"}, 0),
+        ({"retry-after": "soon"}, None),
+        ({}, None),
+        (None, None),
+    ],
+)
+def test_retry_after(headers, expected):
+    assert retry_after(headers) == expected
+
+
+def test_retry_after_date():
+    delay = retry_after({"retry-after": formatdate(time.time() + 10, usegmt=True)})
+    assert delay == pytest.approx(10, abs=1.5)
+
+
+@pytest.mark.asyncio
+async def test_backoff_pauses_other_requests():
+    scheduler = Scheduler(Limits(concurrency=2))
+    started = []
+
+    async def request():
+        async with scheduler.slot("model"):
+            started.append(time.monotonic())
+
+    async with scheduler.slot("model") as slot:
+        backoff_started = time.monotonic()
+        await asyncio.gather(slot.backoff(0, retry_after=0.1), request())
+
+    assert started[0] - backoff_started >= 0.09
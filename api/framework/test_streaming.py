@@ -1,5 +1,12 @@
-from litellm.types.utils import Delta, Message
+import asyncio
 
+import pytest
+from litellm.types.utils import Delta, Message, ModelResponseStream, StreamingChoices
+
+from akson import Chat
+
+from .cassette import ReplayStream
+from .llm_assistant import LLMAssistant
 from .streaming import Event, MessageBuilder, StrValue, Values
 
 
@@ -139,4 +146,101 @@ def test_message_builder_streaming_tool_call():
     message = builder.getvalue()
     assert message.tool_calls is not None
     assert len(message.tool_calls) == 1
-    assert message.tool_calls[0].function.arguments == '{"arg1": "value1"}'
\ No newline at end of file
+    assert message.tool_calls[0].function.arguments == '{"arg1": "value1"}'
+
+
+def test_message_builder_multiple_tool_calls():
+    builder = MessageBuilder()
+    events = builder.write(
+        Delta(
+            role="assistant",
+            tool_calls=[
+                {"index": 0, "id": "call_0", "type": "function", "function": {"name": "first", "arguments": ""}},
+                {"index": 1, "id": "call_1", "type": "function", "function": {"name": "second", "arguments": ""}},
+            ],
+        )
+    )
+    assert events == [
+        Event("tool_call.id", "call_0", 0),
+        Event("tool_call.name", "first", 0),
+        Event("tool_call.id", "call_1", 1),
+        Event("tool_call.name", "second", 1),
+    ]
+
+    builder.write(Delta(tool_calls=[{"index": 1, "function": {"arguments": '{"b": '}}]))
+    builder.write(Delta(tool_calls=[{"index": 0, "function": {"arguments": '{"a": 1}'}}]))
+    events = builder.write(Delta(tool_calls=[{"index": 1, "function": {"arguments": "2}"}}]))
+    assert events == [Event("tool_call.arguments", "2}", 1)]
+
+    message = builder.getvalue()
+    assert message.tool_calls is not None
+    assert [tool_call.id for tool_call in message.tool_calls] == ["call_0", "call_1"]
+    assert message.tool_calls[0].function.arguments == '{"a": 1}'
+    assert message.tool_calls[1].function.arguments == '{"b": 2}'
+
+
+@pytest.mark.asyncio
+async def test_parallel_tool_calls_are_sent_as_one_message():
+    deltas = [
+        Delta(role="assistant", content="Searching"),
+        Delta(tool_calls=[{"index": 0, "id": "call_0", "type": "function", "function": {"name": "first"}}]),
+        Delta(tool_calls=[{"index": 0, "function": {"arguments": "{}"}}]),
+        Delta(tool_calls=[{"index": 1, "id": "call_1", "type": "function", "function": {"name": "second"}}]),
+        Delta(tool_calls=[{"index": 1, "function": {"arguments": "{}"}}]),
+    ]
+    chunks = [ModelResponseStream(choices=[StreamingChoices(delta=delta)]) for delta in deltas]
+    chunks.append(ModelResponseStream(choices=[StreamingChoices(delta=Delta(), finish_reason="tool_calls")]))
+    stream = ReplayStream([{"time": 0, "chunk": chunk.model_dump(mode="json")} for chunk in chunks], speed=0)
+    assistant = LLMAssistant("Searcher", model="gpt-4.1")
+    chat = Chat()
+
+    message, _, _ = await assistant._stream_reply(stream, chat, 0)
+    assert message.tool_calls is not None and len(message.tool_calls) == 2
+
+    # Each tool call is stored in its own message, but they are sent to the LLM in one.
+    assert [(m.content, m.tool_call and m.tool_call.name) for m in chat.state.messages] == [
+        ("Searching", "first"),
+        ("", "second"),
+    ]
+    messages = assistant._get_messages(chat)
+    assert len(messages) == 2
+    assert messages[1].content == "Searching"
+    assert messages[1].tool_calls is not None
+    assert [tool_call.function.name for tool_call in messages[1].tool_calls] == ["first", "second"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_parallel_tool_calls_are_not_saved():
+    deltas = [
+        Delta(role="assistant", content="Searching"),
+        Delta(tool_calls=[{"index": 0, "id": "call_0", "type": "function", "function": {"name": "first"}}]),
+        Delta(tool_calls=[{"index": 1, "id": "call_1", "type": "function", "function": {"name": "second"}}]),
+        Delta(tool_calls=[{"index": 1, "function": {"arguments": "{}"}}]),
+    ]
+    records = [
+        {"time": 0, "chunk": ModelResponseStream(choices=[StreamingChoices(delta=delta)]).model_dump(mode="json")}
+        for delta in deltas
+    ]
+    # The stream hangs before the finish reason.
+    records[-1]["time"] = 3600
+    events = []
+
+    async def publisher(message: dict):
+        events.append(message)
+
+    assistant = LLMAssistant("Searcher", model="gpt-4.1")
+    chat = Chat(publisher=publisher)
+    task = asyncio.create_task(assistant._stream_reply(ReplayStream(records, speed=1), chat, 0))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # The partial content is kept, the incomplete tool calls are dropped.
+    assert [(m.content, m.tool_call) for m in chat.state.messages] == [("Searching", None)]
+    assert chat.new_messages == chat.state.messages
+    # Clients see both replies end
+    begun = [event["id"] for event in events if event["type"] == "begin_message"]
+    assert len(begun) == 2
+    assert [event["id"] for event in events if event["type"] == "end_message"] == begun
+    assert len(assistant._get_messages(chat)) == 2
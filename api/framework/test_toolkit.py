@@ -1,8 +1,25 @@
+import asyncio
+import json
+import time
+
 import pytest
 from litellm import ChatCompletionMessageToolCall
 from litellm.types.utils import Function
+from openai.types.chat import ChatCompletionToolParam
+
+from akson import Assistant, Chat
 
-from .toolkit import FunctionToolkit
+from .llm_assistant import LLMAssistant
+from .toolkit import (
+    AssistantToolkit,
+    DuplicateToolError,
+    FunctionToolkit,
+    MultiToolkit,
+    TaskResponse,
+    TaskStatus,
+    ToolContext,
+    Toolkit,
+)
 
 
 async def _test_function(f, args: str):
@@ -163,3 +180,194 @@ async def test_function_calling_with_coroutines():
 
     result = await _test_function(async_with_args, '{"a": 5, "b": 3}')
     assert result == "8"
+
+
+def _call(name: str, arguments: str = "{}", id: str = "1"):
+    return ChatCompletionMessageToolCall(id=id, function=Function(name=name, arguments=arguments))
+
+
+@pytest.mark.asyncio
+async def test_multi_toolkit_routes_calls_by_name():
+    def first():
+        return "first"
+
+    def second():
+        return "second"
+
+    toolkit = MultiToolkit([FunctionToolkit([first]), FunctionToolkit([second])])
+    assert [tool["function"]["name"] for tool in await toolkit.get_tools()] == ["first", "second"]
+
+    calls = [_call("second", id="1"), _call("missing", id="2"), _call("first", id="3")]
+    messages = await toolkit.handle_tool_calls(calls, ToolContext(caller="test"))
+    assert [message["tool_call_id"] for message in messages] == ["1", "2", "3"]
+    assert [message.content for message in messages] == ["second", "Unknown tool: missing", "first"]
+
+
+@pytest.mark.asyncio
+async def test_multi_toolkit_duplicate_tools():
+    def search():
+        pass
+
+    toolkit = MultiToolkit([FunctionToolkit([search]), FunctionToolkit([search])])
+    with pytest.raises(DuplicateToolError):
+        await toolkit.get_tools()
+
+
+@pytest.mark.asyncio
+async def test_multi_toolkit_is_updated_when_tools_change():
+    def first():
+        return "first"
+
+    def second():
+        return "second"
+
+    child = FunctionToolkit([first])
+    toolkit = MultiToolkit([child])
+    assert len(await toolkit.get_tools()) == 1
+
+    added = FunctionToolkit([second])
+    child.functions.update(added.functions)
+    child.models.update(added.models)
+    child.tools = child.tools + added.tools
+    child._tools_changed()
+
+    assert [tool["function"]["name"] for tool in await toolkit.get_tools()] == ["first", "second"]
+    messages = await toolkit.handle_tool_calls([_call("second")], ToolContext(caller="test"))
+    assert messages[0].content == "second"
+
+
+class _Worker(Assistant):
+    name = "Worker"
+
+    async def run(self, chat: Chat) -> None:
+        await asyncio.sleep(0.2)
+        reply = await chat.reply("assistant", name=self.name)
+        await reply.add_chunk(f"Done: {chat.state.messages[-1].content}")
+        await reply.end()
+
+
+@pytest.mark.asyncio
+async def test_delegated_tasks_run_concurrently(tmp_path, monkeypatch):
+    import deps
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(deps.registry._assistants, "worker", _Worker())
+    events = []
+
+    async def publisher(message: dict):
+        events.append(message)
+
+    toolkit = AssistantToolkit(["Worker"])
+    calls = [
+        _call(AssistantToolkit.TOOL_NAME, json.dumps({"assistant": "worker", "task": f"task {i}"}), id=str(i))
+        for i in range(3)
+    ]
+    started = time.perf_counter()
+    messages = await toolkit.handle_tool_calls(calls, ToolContext(caller="Boss", chat=Chat(publisher=publisher)))
+    assert time.perf_counter() - started < 0.5
+
+    responses = [TaskResponse.model_validate_json(message.content or "") for message in messages]
+    assert [response.analysis.result for response in responses] == ["Done: task 0", "Done: task 1", "Done: task 2"]
+    assert {event["type"] for event in events} == {"task_event"}
+    assert {event["tool_call_id"] for event in events} == {"0", "1", "2"}
+    assert {event["event"]["type"] for event in events} == {"begin_message", "add_chunk", "end_message"}
+
+
+@pytest.mark.asyncio
+async def test_delegated_task_with_invalid_arguments(tmp_path, monkeypatch):
+    import deps
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(deps.registry._assistants, "worker", _Worker())
+    toolkit = AssistantToolkit(["Worker"])
+    calls = [
+        _call(AssistantToolkit.TOOL_NAME, json.dumps({"assistant": "worker", "task": "task 0"}), id="0"),
+        _call(AssistantToolkit.TOOL_NAME, json.dumps({"assistant": "unknown", "task": "task 1"}), id="1"),
+        _call(AssistantToolkit.TOOL_NAME, "{", id="2"),
+    ]
+    messages = await toolkit.handle_tool_calls(calls, ToolContext(caller="Boss"))
+
+    assert [message["tool_call_id"] for message in messages] == ["0", "1", "2"]
+    responses = [TaskResponse.model_validate_json(message.content or "") for message in messages]
+    assert responses[0].analysis.result == "Done: task 0"
+    for response in responses[1:]:
+        assert response.analysis.status == TaskStatus.FAILED
+        assert (response.analysis.result or "").startswith("Invalid arguments")
+
+
+@pytest.mark.asyncio
+async def test_delegated_task_that_cannot_start(tmp_path, monkeypatch):
+    import deps
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(deps.registry._assistants, "worker", _Worker())
+    # Ghost is offered to the model, but not registered
+    toolkit = AssistantToolkit(["Worker", "Ghost"])
+    calls = [
+        _call(AssistantToolkit.TOOL_NAME, json.dumps({"assistant": "worker", "task": "task 0"}), id="0"),
+        _call(AssistantToolkit.TOOL_NAME, json.dumps({"assistant": "worker", "task": "task 1", "id": "bogus"}), id="1"),
+        _call(AssistantToolkit.TOOL_NAME, json.dumps({"assistant": "ghost", "task": "task 2"}), id="2"),
+    ]
+    messages = await toolkit.handle_tool_calls(calls, ToolContext(caller="Boss"))
+
+    responses = [TaskResponse.model_validate_json(message.content or "") for message in messages]
+    assert responses[0].analysis.status == TaskStatus.COMPLETED
+    assert responses[0].analysis.result == "Done: task 0"
+    assert [response.analysis.status for response in responses[1:]] == [TaskStatus.FAILED, TaskStatus.FAILED]
+    assert responses[1].id == "bogus"
+    assert "Unknown task ID: bogus" in (responses[1].analysis.result or "")
+    assert "Unknown assistant: ghost" in (responses[2].analysis.result or "")
+
+
+def _now() -> float:
+    """Current time"""
+    return time.time()
+
+
+@pytest.mark.parametrize(
+    "toolkit, parallel",
+    [
+        (None, False),
+        (FunctionToolkit([_now]), False),
+        (AssistantToolkit(["Worker"]), True),
+        (MultiToolkit([FunctionToolkit([_now]), AssistantToolkit(["Worker"])]), True),
+    ],
+)
+def test_orchestrators_call_tools_in_parallel(toolkit, parallel):
+    assert LLMAssistant("Boss", model="gpt-4.1", toolkit=toolkit).parallel_tool_calls == parallel
+    # Can be turned off
+    assert not LLMAssistant("Boss", model="gpt-4.1", toolkit=toolkit, parallel_tool_calls=False).parallel_tool_calls
+
+
+class _Broken(Toolkit):
+    async def get_tools(self) -> list[ChatCompletionToolParam]:
+        return [{"type": "function", "function": {"name": "broken"}}]
+
+    async def handle_tool_calls(self, tool_calls: list[ChatCompletionMessageToolCall], context: ToolContext) -> list:
+        await asyncio.sleep(0.01)
+        raise RuntimeError("broken")
+
+
+class _Hanging(Toolkit):
+    def __init__(self):
+        self.cancelled = False
+
+    async def get_tools(self) -> list[ChatCompletionToolParam]:
+        return [{"type": "function", "function": {"name": "hanging"}}]
+
+    async def handle_tool_calls(self, tool_calls: list[ChatCompletionMessageToolCall], context: ToolContext) -> list:
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return []
+
+
+@pytest.mark.asyncio
+async def test_multi_toolkit_cancels_calls_when_a_toolkit_fails():
+    hanging = _Hanging()
+    toolkit = MultiToolkit([hanging, _Broken()])
+    with pytest.raises(RuntimeError, match="broken"):
+        await toolkit.handle_tool_calls([_call("hanging", id="1"), _call("broken", id="2")], ToolContext(caller="test"))
+    assert hanging.cancelled
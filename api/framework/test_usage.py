@@ -0,0 +1,57 @@
+import litellm
+from litellm.types.utils import Message as LitellmMessage
+from litellm.types.utils import PromptTokensDetailsWrapper
+
+from . import llm_assistant
+from .llm_assistant import LLMAssistant
+
+
+def _messages() -> list[LitellmMessage]:
+    return [LitellmMessage(role="user", content="What is three plus one?")]  # type: ignore
+
+
+def test_reported_usage():
+    assistant = LLMAssistant(name="Test", model="gpt-4.1")
+    reported = litellm.Usage(prompt_tokens=12, completion_tokens=3, total_tokens=15)
+    usage = assistant._get_usage(reported, _messages(), None, LitellmMessage(content="Four"))
+    assert (usage.prompt_tokens, usage.completion_tokens, usage.estimated) == (12, 3, False)
+
+
+def test_prompt_cache_requests():
+    assistant = LLMAssistant(name="Test", model="gpt-4.1")
+    hits = llm_assistant.prompt_cache_requests.labels("gpt-4.1", "hit").value
+    misses = llm_assistant.prompt_cache_requests.labels("gpt-4.1", "miss").value
+    for cached_tokens in (0, 8):
+        reported = litellm.Usage(
+            prompt_tokens=12,
+            completion_tokens=3,
+            total_tokens=15,
+            prompt_tokens_details=PromptTokensDetailsWrapper(cached_tokens=cached_tokens),
+        )
+        usage = assistant._get_usage(reported, _messages(), None, LitellmMessage(content="Four"))
+        assert usage.cached_tokens == cached_tokens
+    assert llm_assistant.prompt_cache_requests.labels("gpt-4.1", "hit").value - hits == 1
+    assert llm_assistant.prompt_cache_requests.labels("gpt-4.1", "miss").value - misses == 1
+
+    # Not counted if the usage is not reported
+    assistant._get_usage(None, _messages(), None, LitellmMessage(content="Four"))
+    assert llm_assistant.prompt_cache_requests.labels("gpt-4.1", "miss").value - misses == 1
+
+
+def test_usage_counted_locally_if_not_reported():
+    assistant = LLMAssistant(name="Test", model="gpt-4.1")
+    usage = assistant._get_usage(None, _messages(), None, LitellmMessage(content="Four"))
+    assert usage.estimated
+    assert usage.prompt_tokens > 0
+    assert usage.completion_tokens == 1
+
+
+def test_usage_estimated_if_tokens_cannot_be_counted(monkeypatch):
+    def token_counter(**kwargs):
+        raise ValueError("Unknown model")
+
+    monkeypatch.setattr(llm_assistant, "token_counter", token_counter)
+    assistant = LLMAssistant(name="Test", model="unknown-model")
+    usage = assistant._get_usage(None, _messages(), None, LitellmMessage(content="Three plus one is four."))
+    assert usage.estimated
+    assert (usage.prompt_tokens, usage.completion_tokens) == (5, 5)
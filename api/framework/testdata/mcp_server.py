@@ -0,0 +1,42 @@
+"""MCP server used by the tests of MCP session pools."""
+
+import asyncio
+import os
+
+from fastmcp import Context, FastMCP
+
+mcp = FastMCP("test")
+
+
+@mcp.tool()
+async def pid() -> int:
+    """Return the process id of the server."""
+    return os.getpid()
+
+
+@mcp.tool()
+async def sleep(seconds: float) -> int:
+    """Sleep and return the process id of the server."""
+    await asyncio.sleep(seconds)
+    return os.getpid()
+
+
+@mcp.tool()
+async def crash() -> None:
+    """Exit the server without answering."""
+    os._exit(1)
+
+
+@mcp.tool()
+async def add_tool(name: str, ctx: Context) -> None:
+    """Add a tool that returns its name and notify the client."""
+
+    async def tool() -> str:
+        return name
+
+    mcp.add_tool(tool, name=name)
+    await ctx.session.send_tool_list_changed()
+
+
+if __name__ == "__main__":
+    mcp.run()
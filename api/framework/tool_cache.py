@@ -0,0 +1,74 @@
+"""
+Cache of tool schemas of MCP servers.
+
+Discovering the tools of a server means starting it, which for Docker based servers means pulling and starting
+a container. Tools are saved to the cache when they are discovered, so after a restart they are served from
+the cache and the server is started only when one of its tools is called. The cached tools are refreshed
+after the first call and when the server sends a tools/list_changed notification.
+
+Entries are keyed by the command of the server, which includes the image tag or package version.
+The version reported by the server is saved with the tools.
+
+Configured with environment variables:
+    MCP_TOOL_CACHE_DIR: Directory of the cache (default: mcp_tools). Empty disables the cache.
+"""
+
+import json
+import os
+from typing import Optional
+
+import metrics
+from logger import logger
+
+from .files import short_hash, write_json
+
+lookups = metrics.Counter("mcp_tool_cache_lookups_total", "Lookups of tools of MCP servers in the cache.", ("result",))
+
+
+class ToolCache:
+    def __init__(self, directory: str = "mcp_tools"):
+        self.directory = directory
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv("MCP_TOOL_CACHE_DIR", "mcp_tools"))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def _path(self, server: str) -> str:
+        return os.path.join(self.directory, f"{short_hash(server)}.json")
+
+    def load(self, server: str) -> Optional[dict]:
+        """Return the cached entry with "version" and "tools", or None if the server is not cached."""
+        if not self.enabled:
+            return None
+        entry = self._read(server)
+        lookups.labels("hit" if entry else "miss").inc()
+        return entry
+
+    def _read(self, server: str) -> Optional[dict]:
+        try:
+            with open(self._path(server)) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring invalid tool cache of MCP server %s: %r", server, e)
+            return None
+        if entry.get("server") != server:
+            return None
+        return entry
+
+    def save(self, server: str, version: Optional[str], tools: list):
+        if not self.enabled:
+            return
+        try:
+            write_json(self._path(server), {"server": server, "version": version, "tools": tools})
+        except OSError as e:
+            logger.warning("Cannot write tool cache of MCP server %s: %r", server, e)
+
+
+# Shared by all toolkits in the process
+tool_cache = ToolCache.from_env()
@@ -1,28 +1,52 @@
 import asyncio
+import copy
+import functools
+import itertools
 import json
 import os
+import shlex
+import time
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import StrEnum
 from inspect import Parameter, getdoc, signature
-from typing import Callable, get_type_hints
+from typing import Awaitable, Callable, Optional, TypeVar, get_type_hints
 
 import docstring_parser
+import mcp.types
 from fastmcp import Client as FastMCPClient
+from fastmcp.client.transports import StdioTransport
 from litellm import ChatCompletionMessageToolCall
 from litellm import Message as LiteLLMMessage
 from openai import pydantic_function_tool
 from openai.types.chat import ChatCompletionToolParam
 from openai.types.shared_params import FunctionDefinition
-from pydantic import BaseModel, Field, create_model
+from pydantic import BaseModel, Field, ValidationError, create_model
 
-from akson import Chat, ChatState, Message
+import metrics
+from akson import Assistant, Chat, ChatState, Message
 from logger import logger
 
+from .cassette import cassettes
+from .mcp_pool import MCPSessionPool
+from .tool_cache import tool_cache
+
+T = TypeVar("T")
+
+tool_call_duration = metrics.Histogram("tool_call_seconds", "Duration of tool calls.", ("tool",))
+
+# Default size of the session pool of each MCP server
+MCP_MIN_SESSIONS = int(os.getenv("MCP_MIN_SESSIONS", "1"))
+MCP_MAX_SESSIONS = int(os.getenv("MCP_MAX_SESSIONS", "4"))
+# Sessions above the minimum are stopped after being idle this many seconds
+MCP_IDLE_TIMEOUT = float(os.getenv("MCP_IDLE_TIMEOUT", "300"))
+
 
 @dataclass
 class ToolContext:
     caller: str
+    chat: Optional[Chat] = None
+    """Chat of the caller. Toolkits can publish progress to its clients and add the tokens they use."""
 
 
 class Toolkit(ABC):
@@ -36,26 +60,94 @@ class Toolkit(ABC):
         self, tool_calls: list[ChatCompletionMessageToolCall], context: ToolContext
     ) -> list[LiteLLMMessage]: ...
 
+    def on_tools_changed(self, callback: Callable[[], None]):
+        """Call callback when the list of tools returned by get_tools changes."""
+        self._tools_changed_callbacks = [*getattr(self, "_tools_changed_callbacks", []), callback]
+
+    def _tools_changed(self):
+        for callback in getattr(self, "_tools_changed_callbacks", []):
+            callback()
+
+
+class DuplicateToolError(Exception):
+    def __init__(self, name: str, first: Toolkit, second: Toolkit):
+        super().__init__(f"Tool {name} is provided by both {first!r} and {second!r}")
+
 
 class MultiToolkit(Toolkit):
-    """Combines multiple toolkits into one."""
+    """
+    Combines multiple toolkits into one.
+    Tool calls are routed to the toolkit that provides the tool. The merged list of tools and the routes are
+    built on first use and rebuilt when the tools of a toolkit change.
+    """
 
     def __init__(self, toolkits: list[Toolkit]) -> None:
         self.toolkits = toolkits
+        self._tools: Optional[list[ChatCompletionToolParam]] = None
+        # Tool name -> toolkit
+        self._routes: dict[str, Toolkit] = {}
+        # Incremented when the tools of a toolkit change, so an index built meanwhile is not kept.
+        self._generation = 0
+        for toolkit in toolkits:
+            toolkit.on_tools_changed(self._invalidate)
+
+    def _invalidate(self):
+        self._tools = None
+        self._generation += 1
+        self._tools_changed()
+
+    async def _build_index(self) -> tuple[list[ChatCompletionToolParam], dict[str, Toolkit]]:
+        while self._tools is None:
+            generation = self._generation
+            # Toolkits may start servers to get their tools, so they are asked concurrently.
+            tool_lists = await asyncio.gather(*(toolkit.get_tools() for toolkit in self.toolkits))
+            tools: list[ChatCompletionToolParam] = []
+            routes: dict[str, Toolkit] = {}
+            for toolkit, toolkit_tools in zip(self.toolkits, tool_lists):
+                for tool in toolkit_tools:
+                    name = tool["function"]["name"]
+                    if name in routes:
+                        raise DuplicateToolError(name, routes[name], toolkit)
+                    routes[name] = toolkit
+                tools.extend(toolkit_tools)
+            if generation == self._generation:
+                self._tools, self._routes = tools, routes
+        return self._tools, self._routes
 
     async def get_tools(self) -> list[ChatCompletionToolParam]:
-        tools = []
-        for toolkit in self.toolkits:
-            tools.extend(await toolkit.get_tools())
+        tools, _ = await self._build_index()
         return tools
 
     async def handle_tool_calls(
         self, tool_calls: list[ChatCompletionMessageToolCall], context: ToolContext
     ) -> list[LiteLLMMessage]:
-        messages = []
-        for toolkit in self.toolkits:
-            messages.extend(await toolkit.handle_tool_calls(tool_calls, context))
-        return messages
+        """Returns a message for each tool call, in the order of the calls."""
+        _, routes = await self._build_index()
+        # Calls of each toolkit, with their positions
+        batches: dict[Toolkit, list[tuple[int, ChatCompletionMessageToolCall]]] = {}
+        messages: list[Optional[LiteLLMMessage]] = [None] * len(tool_calls)
+        for index, tool_call in enumerate(tool_calls):
+            toolkit = routes.get(tool_call.function.name or "")
+            if toolkit:
+                batches.setdefault(toolkit, []).append((index, tool_call))
+            else:
+                logger.warning("Unknown tool: %s", tool_call.function.name)
+                messages[index] = LiteLLMMessage(
+                    role="tool",  # type: ignore
+                    tool_call_id=tool_call.id,
+                    content=f"Unknown tool: {tool_call.function.name}",
+                )
+        # Toolkits run their calls concurrently with each other.
+        results = await _gather(
+            *(
+                toolkit.handle_tool_calls([tool_call for _, tool_call in batch], context)
+                for toolkit, batch in batches.items()
+            )
+        )
+        for batch, batch_messages in zip(batches.values(), results):
+            for (index, _), message in zip(batch, batch_messages, strict=True):
+                messages[index] = message
+        return messages  # type: ignore
 
 
 class FunctionToolkit(Toolkit):
@@ -92,10 +184,11 @@ class FunctionToolkit(Toolkit):
                 if kwargs[param.name] is None and param.default is not Parameter.empty:
                     kwargs[param.name] = param.default
 
-            if asyncio.iscoroutinefunction(func):
-                result = await func(**kwargs)
-            else:
-                result = func(**kwargs)
+            with metrics.timed(tool_call_duration.labels(function.name), "tools"):
+                if asyncio.iscoroutinefunction(func):
+                    result = await func(**kwargs)
+                else:
+                    result = func(**kwargs)
 
             logger.info("%s call result: %s", function.name, result)
             messages.append(
@@ -138,39 +231,186 @@ def _function_to_pydantic_model(func):
 
 
 class MCPToolkit(Toolkit):
-
-    def __init__(self, client: FastMCPClient):
-        self.client = client
+    """
+    Tools of an MCP server. Calls are distributed over a pool of sessions, each running its own server.
+    Pool size defaults to MCP_MIN_SESSIONS and MCP_MAX_SESSIONS environment variables.
+
+    Tools are cached on disk (see tool_cache). When they are cached, the server is not started with the app,
+    but when one of its tools is called.
+    """
+
+    def __init__(
+        self,
+        client: FastMCPClient | Callable[[], FastMCPClient],
+        *,
+        key: Optional[str] = None,
+        name: Optional[str] = None,
+        min_sessions: Optional[int] = None,
+        max_sessions: Optional[int] = None,
+    ):
+        """
+        Args:
+            client: A client, or a function that creates a client for each session of the pool.
+                A single client cannot be pooled, so there is at most one session.
+            key: Identifies the server in cassettes and the tool cache. Defaults to the command of a client
+                started with a command. Required for other clients, because their transports may include secrets,
+                e.g. tokens in URLs.
+            name: Name of the server in logs and metrics. Defaults to key.
+        """
+        if min_sessions is None:
+            min_sessions = MCP_MIN_SESSIONS
+        if max_sessions is None:
+            max_sessions = MCP_MAX_SESSIONS
+        if isinstance(client, FastMCPClient):
+            single_client = client
+            if not key and isinstance(client.transport, StdioTransport):
+                # Environment variables are left out, as in from_config.
+                key = shlex.join([client.transport.command, *client.transport.args])
+                name = name or os.path.basename(client.transport.command)
+            assert key, "key is required if client is not started with a command"
+            factory = lambda: single_client
+            min_sessions, max_sessions = min(min_sessions, 1), 1
+        else:
+            assert key, "key is required if client is a function"
+            factory = client
+            min_sessions = min(min_sessions, max_sessions)
+        self.key = key
+        self.factory = factory
+        self._cached = tool_cache.load(key)
+        self.pool = MCPSessionPool(
+            self._new_client,
+            name=name or key,
+            min_size=min_sessions,
+            max_size=max_sessions,
+            idle_timeout=MCP_IDLE_TIMEOUT,
+            lazy=self._cached is not None,
+        )
         self._initialized = False
         self._lock = asyncio.Lock()
         self._tools: list[ChatCompletionToolParam] = []
+        self._tool_names: set[str] = set()
+        # Tools served from the cache are refreshed after the first call.
+        self._stale = False
+        self._refresh_task: Optional[asyncio.Task] = None
 
     @classmethod
-    def from_config(cls, command: str, args: list[str] = [], env: dict[str, str] = {}):
-        return cls(FastMCPClient({"mcpServers": {"": {"command": command, "args": args, "env": env}}}))
+    def from_config(cls, command: str, args: list[str] = [], env: dict[str, str] = {}, **pool_kwargs):
+        return cls(
+            lambda: _stdio_client([command, *args], env),
+            key=shlex.join([command, *args]),
+            name=os.path.basename(command),
+            **pool_kwargs,
+        )
 
     @classmethod
-    def from_node_package(cls, package: str, **kargs):
-        cmd = node_package(package, **kargs)
-        env = dict(kargs.get("env", []))
-        return cls(FastMCPClient({"mcpServers": {"": {"command": cmd[0], "args": cmd[1:], "env": env}}}))
+    def from_node_package(
+        cls, package: str, *, min_sessions: Optional[int] = None, max_sessions: Optional[int] = None, **kargs
+    ):
+        # Containers of the sessions need unique names.
+        numbers = itertools.count(1)
+        return cls(
+            lambda: _stdio_client(
+                node_package(package, name=f"{package}-{next(numbers)}", **kargs), dict(kargs.get("env", []))
+            ),
+            key=shlex.join(node_package(package, **_without_env_values(kargs))),
+            name=package,
+            min_sessions=min_sessions,
+            max_sessions=max_sessions,
+        )
 
     @classmethod
-    def from_docker_image(cls, image: str, **kargs):
-        cmd = docker_command(image, **kargs)
-        env = dict(kargs.get("env", []))
-        return cls(FastMCPClient({"mcpServers": {"": {"command": cmd[0], "args": cmd[1:], "env": env}}}))
+    def from_docker_image(
+        cls, image: str, *, min_sessions: Optional[int] = None, max_sessions: Optional[int] = None, **kargs
+    ):
+        numbers = itertools.count(1)
+
+        def factory():
+            kwargs = dict(kargs)
+            if kwargs.get("name"):
+                # Containers of the sessions need unique names.
+                kwargs["name"] = f"{kwargs['name']}-{next(numbers)}"
+            return _stdio_client(docker_command(image, **kwargs), dict(kargs.get("env", [])))
+
+        return cls(
+            factory,
+            key=shlex.join(docker_command(image, **_without_env_values(kargs))),
+            name=image,
+            min_sessions=min_sessions,
+            max_sessions=max_sessions,
+        )
 
     async def _initialize(self):
         async with self._lock:
             if not self._initialized:
-                await self.client._connect()
-                await self._get_tools()
+                if cassettes.replaying:
+                    self._set_tools(cassettes.replay_tools(self._server_key()))
+                elif self._cached is not None:
+                    logger.info(f"Using {len(self._cached['tools'])} cached tools of MCP server {self.pool.name}")
+                    self._set_tools(self._cached["tools"])
+                    self._stale = True
+                else:
+                    async with self.pool.session() as client:
+                        await self._update_tools(client)
+                if cassettes.recording:
+                    cassettes.record_tools(self._server_key(), self._tools)
                 self._initialized = True
 
-    async def _get_tools(self):
-        tools = await self.client.list_tools()
+    def __repr__(self) -> str:
+        return f"MCPToolkit({self.pool.name!r})"
+
+    def _server_key(self) -> str:
+        """Identifies the server in cassettes."""
+        return self.key
+
+    def _new_client(self) -> FastMCPClient:
+        client = self.factory()
+        if client._session_kwargs.get("message_handler") is None:
+            client._session_kwargs["message_handler"] = functools.partial(self._handle_message, client)
+        return client
+
+    async def _handle_message(self, client: FastMCPClient, message):
+        if isinstance(message, mcp.types.ServerNotification) and isinstance(
+            message.root, mcp.types.ToolListChangedNotification
+        ):
+            logger.info(f"Tools of MCP server {self.pool.name} changed")
+            self._refresh(client)
+
+    def _refresh(self, client: FastMCPClient):
+        """Update the tools from the server of the client in the background."""
+        if self._refresh_task and not self._refresh_task.done():
+            return
+
+        async def refresh():
+            try:
+                await self._update_tools(client)
+            except Exception as e:
+                logger.warning(f"Cannot refresh tools of MCP server {self.pool.name}: {e!r}")
+                self._stale = True
+
+        self._stale = False
+        self._refresh_task = asyncio.create_task(refresh())
+
+    async def _update_tools(self, client: FastMCPClient):
+        """Get the tools from the server and save them to the cache."""
+        tools = await self._get_tools(client)
+        version = client.initialize_result.serverInfo.version
+        changed = tools != self._tools
+        if changed and self._initialized:
+            logger.info(f"Tools of MCP server {self.pool.name} are updated")
+        self._set_tools(tools)
+        self._cached = {"version": version, "tools": tools}
+        tool_cache.save(self.key, version, tools)
+        if changed and self._initialized:
+            self._tools_changed()
+
+    def _set_tools(self, tools: list[ChatCompletionToolParam]):
+        self._tools = tools
+        self._tool_names = {tool["function"]["name"] for tool in tools}
+
+    async def _get_tools(self, client: FastMCPClient) -> list[ChatCompletionToolParam]:
+        tools = await client.list_tools()
         logger.info(f"Got {len(tools)} tools.")
+        params = []
         for tool in tools:
             schema = dict(tool.inputSchema)
             schema["required"] = list(schema["properties"].keys())
@@ -184,8 +424,9 @@ class MCPToolkit(Toolkit):
                     strict=True,
                 ),
             )
-            self._tools.append(param)
+            params.append(param)
             logger.info(f"Added tool from MCP server: {tool.name}")
+        return params
 
     async def get_tools(self) -> list[ChatCompletionToolParam]:
         await self._initialize()
@@ -197,15 +438,29 @@ class MCPToolkit(Toolkit):
         await self._initialize()
         output = []
         for tool_call in tool_calls:
-            if (tool_call.function.name or "") not in (tool["function"]["name"] for tool in self._tools):
+            if tool_call.function.name not in self._tool_names:
                 continue
             logger.info(f"Executing tool call: {tool_call}")
             arguments = json.loads(tool_call.function.arguments)
             assert isinstance(arguments, dict)
             assert isinstance(tool_call.function.name, str)
-            result = await self.client.call_tool(tool_call.function.name, arguments=arguments)
-            logger.debug(f"Result: {result}")
-            result_str = "\n\n".join(content.text for content in result if content.type == "text")
+            with metrics.timed(tool_call_duration.labels(tool_call.function.name), "tools") as timer:
+                if cassettes.replaying:
+                    result_str = await cassettes.replay_tool_result(
+                        self._server_key(), tool_call.function.name, arguments
+                    )
+                else:
+                    async with self.pool.session() as client:
+                        result = await client.call_tool(tool_call.function.name, arguments=arguments)
+                        if self._stale:
+                            self._refresh(client)
+                    logger.debug(f"Result: {result}")
+                    result_str = "\n\n".join(content.text for content in result if content.type == "text")
+            if cassettes.recording:
+                duration = time.perf_counter() - timer.started
+                cassettes.record_tool_result(
+                    self._server_key(), tool_call.function.name, arguments, result_str, duration
+                )
             output.append(
                 LiteLLMMessage(
                     role="tool",  # type: ignore
@@ -233,11 +488,21 @@ class TaskResponse(BaseModel):
 
 
 class AssistantToolkit(Toolkit):
+    """
+    Delegates tasks to other assistants. Tasks of the same response run concurrently.
+
+    Messages of the assistants are published to the clients of the calling chat as task_event events,
+    which wrap the events of the task's chat.
+
+    LLM assistants answer the task with a TaskAnalysis themselves. Other assistants' last message is the result,
+    unless analyzer_model is set, in which case the conversation is analyzed by that model after the task.
+    """
 
     TOOL_NAME = "delegate_task"
 
-    def __init__(self, assistants: list[str]):
+    def __init__(self, assistants: list[str], analyzer_model: Optional[str] = None):
         self.assitants = assistants
+        self.analyzer_model = analyzer_model
 
         assistant_enum = StrEnum("Assistant", self.assitants)
 
@@ -266,41 +531,69 @@ class AssistantToolkit(Toolkit):
     async def handle_tool_calls(
         self, tool_calls: list[ChatCompletionMessageToolCall], context: ToolContext
     ) -> list[LiteLLMMessage]:
-        ret = []
-        for tool_call in tool_calls:
-            if tool_call.function.name != self.TOOL_NAME:
-                continue
-            logger.info(f"Executing tool call: {tool_call}")
+        tool_calls = [tool_call for tool_call in tool_calls if tool_call.function.name == self.TOOL_NAME]
+        return list(await _gather(*(self._handle_tool_call(tool_call, context) for tool_call in tool_calls)))
+
+    async def _handle_tool_call(self, tool_call: ChatCompletionMessageToolCall, context: ToolContext) -> LiteLLMMessage:
+        logger.info(f"Executing tool call: {tool_call}")
+        try:
             instance = self._model.model_validate_json(tool_call.function.arguments)
-            task_response = await self._complete_task(instance, context.caller)
-            logger.debug(f"Task response: {task_response}")
-            ret.append(
-                LiteLLMMessage(
-                    role="tool",  # type: ignore
-                    content=task_response.model_dump_json(),
-                    tool_call_id=tool_call.id,
-                )
-            )
-        return ret
+        except ValidationError as e:
+            # Other tasks of the response continue. The caller can fix the arguments and call again.
+            logger.warning("Invalid arguments of task: %s", e)
+            analysis = TaskAnalysis(status=TaskStatus.FAILED, result=f"Invalid arguments: {e}")
+            task_response = TaskResponse(id="", analysis=analysis)
+        else:
+            with metrics.timed(tool_call_duration.labels(self.TOOL_NAME), "tools"):
+                task_response = await self._complete_task(instance, context, tool_call.id)
+        logger.debug(f"Task response: {task_response}")
+        return LiteLLMMessage(
+            role="tool",  # type: ignore
+            content=task_response.model_dump_json(),
+            tool_call_id=tool_call.id,
+        )
 
-    async def _complete_task(self, tool_call, assistant_name: str) -> TaskResponse:
+    async def _complete_task(self, tool_call, context: ToolContext, tool_call_id: Optional[str]) -> TaskResponse:
         from deps import registry
-        from framework import LLMAssistant
 
-        if tool_call.id:
-            chat = Chat(state=ChatState.load_from_disk(tool_call.id))
-        else:
-            chat = Chat()
-
-        # Run the assistant on the task's chat session
-        assistant = registry.get_assistant(tool_call.assistant)
-        chat.state.assistant = assistant.name
-        chat.state.messages.append(Message(role="user", name=assistant_name, content=tool_call.task))
-        await assistant.run(chat)
+        task_id = tool_call.id or ""
+        try:
+            assistant = registry.get_assistant(tool_call.assistant)
+            try:
+                state = ChatState.load_from_disk(tool_call.id) if tool_call.id else ChatState()
+            except FileNotFoundError:
+                raise Exception(f"Unknown task ID: {tool_call.id}. Pass null to start a new task.") from None
+            task_id = state.id
+            chat = _task_chat(state, context.chat, tool_call_id=tool_call_id, assistant=assistant.name)
+
+            # Run the assistant on the task's chat session
+            chat.state.assistant = assistant.name
+            chat.state.messages.append(Message(role="user", name=context.caller, content=tool_call.task))
+            try:
+                await _answering_task(assistant).run(chat)
+            finally:
+                # Keep the task's chat session if the parent run is cancelled.
+                chat.state.save_to_disk()
+                if context.chat:
+                    context.chat.add_usage(chat.usage)
+
+            if self.analyzer_model:
+                analysis = await self._analyze(chat, context)
+            else:
+                analysis = _task_answer(chat)
+        except Exception as e:
+            # Other tasks of the response continue. The caller decides what to do with the failed one.
+            logger.exception("Task %s of %s failed", task_id, tool_call.assistant)
+            return TaskResponse(id=task_id, analysis=TaskAnalysis(status=TaskStatus.FAILED, result=str(e)))
+        return TaskResponse(id=task_id, analysis=analysis)
+
+    async def _analyze(self, chat: Chat, context: ToolContext) -> TaskAnalysis:
+        from framework import LLMAssistant
 
+        assert self.analyzer_model
         task_analyzer = LLMAssistant(
             name="TaskAnalyzer",
-            model="gpt-4.1",
+            model=self.analyzer_model,
             system_prompt="""
             Analyze the conversation and extract the task details and output.
             You must extract all details asked from the conversation because the user cannot see this conversation.
@@ -312,11 +605,73 @@ class AssistantToolkit(Toolkit):
         temp = Chat()
         temp.state.messages = chat.state.messages.copy()
         await task_analyzer.run(temp)
+        if context.chat:
+            context.chat.add_usage(temp.usage)
+        return TaskAnalysis.model_validate_json(temp.state.messages[-1].content)
+
+
+def _task_chat(state: ChatState, parent: Optional[Chat], **fields) -> Chat:
+    """Return a chat for the task. Its messages are published to the clients of the parent chat as task events."""
+    if not parent:
+        return Chat(state=state)
+
+    def wrap(message: dict) -> dict:
+        return {"type": "task_event", "task_id": state.id, **fields, "event": message}
+
+    publisher = batch_publisher = None
+    if parent_publisher := parent.publisher:
 
-        analysis = TaskAnalysis.model_validate_json(temp.state.messages[-1].content)
-        chat.state.save_to_disk()
+        async def publish(message: dict):
+            await parent_publisher(wrap(message))
 
-        return TaskResponse(id=chat.state.id, analysis=analysis)
+        publisher = publish
+
+    if parent_batch_publisher := parent.batch_publisher:
+
+        async def publish_many(messages: list[dict]):
+            await parent_batch_publisher([wrap(message) for message in messages])
+
+        batch_publisher = publish_many
+
+    return Chat(state=state, publisher=publisher, batch_publisher=batch_publisher)
+
+
+async def _gather(*aws: Awaitable[T]) -> list[T]:
+    """Like asyncio.gather, but cancels the others when one fails, so they do not keep running after the turn."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def _answering_task(assistant: Assistant) -> Assistant:
+    """
+    Return a copy of an LLM assistant that gives its final answer as a TaskAnalysis,
+    so the result does not need to be extracted from the conversation with another completion.
+    """
+    from framework import LLMAssistant
+
+    if isinstance(assistant, LLMAssistant) and assistant.output_type is None:
+        assistant = copy.copy(assistant)
+        assistant.output_type = TaskAnalysis
+    return assistant
+
+
+def _task_answer(chat: Chat) -> TaskAnalysis:
+    """Return the answer of the assistant to the task."""
+    replies = [message for message in chat.new_messages if message.role == "assistant" and message.content]
+    if not replies:
+        return TaskAnalysis(status=TaskStatus.FAILED, result="The assistant did not answer.")
+    content = replies[-1].content
+    try:
+        return TaskAnalysis.model_validate_json(content)
+    except ValueError:
+        # Answer of an assistant without structured output
+        return TaskAnalysis(status=TaskStatus.COMPLETED, result=content)
 
 
 def clean_string(text):
@@ -355,4 +710,14 @@ def node_package(package: str, **kwargs):
     NPM_CACHE_DIR = os.environ["NPM_CACHE_DIR"]
     kwargs["args"] = ["exec", package] + kwargs.get("args", [])
     kwargs["mounts"] = kwargs.get("mounts", []) + [(NPM_CACHE_DIR, "/root/.npm")]
-    return docker_command("node:24", name=package, entrypoint="/usr/local/bin/npm", **kwargs)
+    kwargs.setdefault("name", package)
+    return docker_command("node:24", entrypoint="/usr/local/bin/npm", **kwargs)
+
+
+def _without_env_values(kwargs: dict) -> dict:
+    """Arguments of docker_command without values of environment variables, which may be secrets."""
+    return {**kwargs, "env": [(name, "") for name, _ in kwargs.get("env", [])]}
+
+
+def _stdio_client(cmd: list[str], env: dict[str, str]) -> FastMCPClient:
+    return FastMCPClient({"mcpServers": {"": {"command": cmd[0], "args": cmd[1:], "env": env}}})
@@ -15,3 +15,11 @@ def generate_chat_id() -> str:
 
 def generate_message_id() -> str:
     return generate(alphabet=alphanumeric_chars, size=8)
+
+
+def generate_run_id() -> str:
+    return generate(alphabet=alphanumeric_chars, size=12)
+
+
+def generate_batch_id() -> str:
+    return generate(alphabet=alphanumeric_chars, size=12)
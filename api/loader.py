@@ -2,27 +2,140 @@
 This module contains the dynamic object loader mechanism for loading assistants.
 """
 
+import ast
 from importlib import import_module
 from pathlib import Path
-from typing import Iterator
+from typing import Collection, Iterator, Optional
 
 from logger import logger
 
 
-def load_objects[T](ObjectType: type[T], dirname: str, level: int = 0) -> Iterator[T]:
-    logger.info("Loading %s objects from directory: %s", ObjectType.__name__, dirname)
+def _module_paths(dirname: str, level: int) -> Iterator[tuple[Path, str]]:
+    """Yield the file and module path of the Python files in the directory and level directories below."""
     for file_path in Path(dirname).iterdir():
         if file_path.name == "__pycache__":
             continue
         if file_path.is_dir() and level > 0:
-            yield from load_objects(ObjectType, str(file_path), level - 1)
+            yield from _module_paths(str(file_path), level - 1)
             continue
         if not file_path.suffix == ".py":
             continue
-        module_path = ".".join(file_path.with_suffix("").parts)
-        logger.info("Importing module: %s", module_path)
-        module = import_module(module_path)
-        for key, value in vars(module).items():
-            if isinstance(value, ObjectType):
-                logger.debug("Loaded object: %s", key)
-                yield value
+        yield file_path, ".".join(file_path.with_suffix("").parts)
+
+
+def load_module_objects[T](ObjectType: type[T], module_path: str) -> Iterator[T]:
+    logger.info("Importing module: %s", module_path)
+    module = import_module(module_path)
+    for key, value in vars(module).items():
+        if isinstance(value, ObjectType):
+            logger.debug("Loaded object: %s", key)
+            yield value
+
+
+def load_objects[T](ObjectType: type[T], dirname: str, level: int = 0) -> Iterator[T]:
+    logger.info("Loading %s objects from directory: %s", ObjectType.__name__, dirname)
+    for _, module_path in _module_paths(dirname, level):
+        yield from load_module_objects(ObjectType, module_path)
+
+
+def scan_names(
+    dirname: str, level: int = 0, classes: Collection[str] = (), ignore: Collection[str] = ()
+) -> dict[str, Optional[list[str]]]:
+    """
+    Find the names of objects in the modules of the directory without importing the modules.
+
+    Objects are found in module level assignments like `x = LLMAssistant(name="Name", ...)`,
+    where the class is one of classes and the name is a string literal. Calls of the classes in ignore are skipped.
+    Returns the names by module path. Names are None if a module has a module level value that the scan cannot
+    resolve, e.g. a call of another class, a conditional expression or an assignment in an if block,
+    because it may be an object of the type, so the module must be imported to find them.
+    """
+    logger.info("Scanning directory: %s", dirname)
+    modules: dict[str, Optional[list[str]]] = {}
+    for file_path, module_path in _module_paths(dirname, level):
+        try:
+            tree = ast.parse(file_path.read_text(), str(file_path))
+        except SyntaxError:
+            # Reported when the module is imported
+            modules[module_path] = None
+            continue
+        names: Optional[list[str]] = []
+        for node in tree.body:
+            if isinstance(node, (ast.Assign, ast.AnnAssign)):
+                if node.value is None:
+                    # Annotation without a value
+                    continue
+                name = _scan_value(node.value, classes, ignore)
+            elif _binds_names(node):
+                name = None
+            else:
+                continue
+            if name is None:
+                names = None
+                break
+            if name:
+                names.append(name)
+        modules[module_path] = names
+    return modules
+
+
+# Values that cannot be objects of a class
+_LITERALS = (
+    ast.Constant,
+    ast.JoinedStr,
+    ast.List,
+    ast.Tuple,
+    ast.Set,
+    ast.Dict,
+    ast.ListComp,
+    ast.SetComp,
+    ast.DictComp,
+    ast.GeneratorExp,
+    ast.Lambda,
+)
+
+
+def _scan_value(value: ast.expr, classes: Collection[str], ignore: Collection[str]) -> Optional[str]:
+    """
+    Return the name of the object created by the value, an empty string if the value is not an object of classes,
+    or None if the value cannot be resolved without running the module.
+    """
+    if isinstance(value, _LITERALS):
+        return ""
+    if isinstance(value, ast.Call):
+        class_name = _class_name(value.func)
+        if class_name in ignore:
+            return ""
+        if class_name in classes:
+            return _name_argument(value)
+    return None
+
+
+def _binds_names(node: ast.AST) -> bool:
+    """Return True if the statement assigns module level names other than functions, classes and imports."""
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+        return False
+    if isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign, ast.NamedExpr, ast.For, ast.AsyncFor)):
+        return True
+    if isinstance(node, (ast.With, ast.AsyncWith)) and any(item.optional_vars for item in node.items):
+        return True
+    return any(_binds_names(child) for child in ast.iter_child_nodes(node))
+
+
+def _class_name(func: ast.expr) -> Optional[str]:
+    """Return the class of calls like `Class(...)`, `module.Class(...)` and `Class.from_config(...)`."""
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Attribute):
+        if isinstance(func.value, ast.Name) and func.value.id[:1].isupper():
+            return func.value.id
+        return func.attr
+    return None
+
+
+def _name_argument(call: ast.Call) -> Optional[str]:
+    """Return the name argument of the call if it is a string literal."""
+    values = [keyword.value for keyword in call.keywords if keyword.arg == "name"] or call.args[:1]
+    if values and isinstance(values[0], ast.Constant) and isinstance(values[0].value, str):
+        return values[0].value
+    return None
@@ -1,34 +1,68 @@
 """This module contains the FastAPI app."""
 
+import asyncio
 import json
 import os
 import traceback
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import Optional
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
 import rich
-from fastapi import BackgroundTasks, Body, Depends, FastAPI, Request
+from fastapi import BackgroundTasks, Body, Depends, FastAPI, Query, Request, Response
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from sse_starlette.event import ServerSentEvent
 from sse_starlette.sse import EventSourceResponse
 from starlette.requests import ClientDisconnect
 
+import admin
+import batches
 import deps
+import metrics
 import models
 import openai_compat
 import tasks
-from akson import Assistant, Chat, ChatState, Message
+from akson import Assistant, Candidates, Chat, ChatState, Message, Usage
+from framework import mcp_pool
+from framework.cassette import cassettes
+from framework.scheduler import scheduler
 from logger import logger
-from pubsub import PubSub
+from pubsub import Batch, PubSub
 from registry import UnknownAssistant
 from runner import Runner
+from runs import RunCancelled, RunManager, RunQueue, RunState, RunStatus
 
-app = FastAPI(title="Akson API", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await deps.run_queue.start(execute_run)
+    prewarm: Optional[asyncio.Task] = None
+    if not cassettes.replaying:
+        # Start MCP servers before the first chat needs them, without delaying the startup.
+        # With LAZY_STARTUP, servers of assistants that are not imported yet are started on first use.
+        prewarm = asyncio.create_task(mcp_pool.start_all())
+    yield
+    await deps.run_queue.stop()
+    if prewarm:
+        prewarm.cancel()
+        await mcp_pool.close_all()
+
+
+app = FastAPI(title="Akson API", version="0.1.0", lifespan=lifespan)
+
+# Maximum number of candidates generated by a retry
+MAX_CANDIDATES = 5
+
+# Name of the replies that report errors
+ERROR_REPLY_NAME = "Error"
+
+app.add_middleware(metrics.RequestMetricsMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -39,6 +73,8 @@ app.add_middleware(
 )
 
 openai_compat.setup_routes(app)
+batches.setup_routes(app)
+admin.setup_routes(app)
 
 
 @app.exception_handler(RequestValidationError)
@@ -61,10 +97,29 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Return in-process metrics in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats")
+async def get_stats():
+    """
+    Return in-process metrics and the state of the LLM request scheduler.
+    Latency histograms cover the run path: queueing, time to first token, tool calls, publishing and persistence.
+    """
+    return {
+        "metrics": metrics.snapshot(),
+        "scheduler": scheduler.stats(),
+        "mcp_pools": [pool.stats() for pool in mcp_pool.pools],
+    }
+
+
 @app.get("/assistants", response_model=list[models.Assistant])
 async def get_assistants():
     """Return a list of available assistants."""
-    return [models.Assistant(name=assistant.name) for assistant in deps.registry.assistants]
+    return [models.Assistant(name=name) for name in deps.registry.names]
 
 
 @app.get("/chats", response_model=list[models.ChatSummary])
@@ -108,15 +163,75 @@ async def set_assistant(assistant: str = Body(...), state: ChatState = Depends(d
     state.save_to_disk()
 
 
-@app.post("/chats/{chat_id}/messages", response_model=list[Message])
+@app.post("/chats/{chat_id}/messages", response_model=list[Message], responses={202: {"model": RunState}})
 async def send_message(
     message: models.SendMessageRequest,
+    request: Request,
+    response: Response,
     background_tasks: BackgroundTasks,
     assistant: Assistant = Depends(deps.get_assistant),
     chat: Chat = Depends(deps.get_chat),
 ):
-    """Handle a message from the client."""
+    """
+    Handle a message from the client.
+    If the client does not wait, the run is queued and returned with status code 202.
+    Otherwise, the run waits until the run of the chat in progress, if any, is finished.
+
+    Messages are idempotent by ID. If the message was submitted before, the assistant is not run again.
+    The earlier result is returned instead, after waiting for it if the run is still in progress.
+    If the earlier run failed or was cancelled before the assistant replied, the message is run again.
+    """
+    if not message.content.startswith("/"):
+        # The chat state is loaded again before running, so the changes made by the check are not saved.
+        duplicate = await _find_duplicate(chat, message)
+        if duplicate is not None:
+            logger.info("Message %s was already submitted", message.id)
+            return duplicate
+        if not message.wait:
+            user_message = Message(id=message.id, role="user", content=message.content)
+            run = deps.run_queue.submit(RunState(chat_id=chat.state.id, assistant=assistant.name, message=user_message))
+            return JSONResponse(status_code=202, content=run.model_dump(mode="json"))
+
+    if message.content.split()[:1] == ["/stop"]:
+        # Must not wait for the runs it stops
+        return await _send_message(message, request, response, background_tasks, assistant, chat)
+
+    if message.content.startswith("/"):
+        async with deps.run_queue.exclusive(chat.state.id):
+            # Queued runs of the chat may have changed it since it was loaded.
+            chat.state = deps.get_chat_state(chat.state.id)
+            return await _send_message(message, request, response, background_tasks, assistant, chat)
+
+    # Added before waiting for the chat, so retries of the message wait for this request.
+    submission = deps.submissions.add(chat.state.id, message.id)
+    result = None
+    try:
+        async with deps.run_queue.exclusive(chat.state.id):
+            chat.state = deps.get_chat_state(chat.state.id)
+            # Answered while waiting for the chat
+            result = _find_replies(chat.state, message.id)
+            if result is None:
+                result = await _send_message(message, request, response, background_tasks, assistant, chat)
+            return result
+    finally:
+        if result is not None and _answered(result):
+            submission.set_result(result)
+        else:
+            # Retries run the message again
+            deps.submissions.discard(chat.state.id, message.id, submission)
+
+
+async def _send_message(
+    message: models.SendMessageRequest,
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    assistant: Assistant,
+    chat: Chat,
+):
     try:
+        # Unselected candidates of the last retry are pruned when the chat continues.
+        chat.state.candidates = None
         if message.content.startswith("/"):
             return await handle_command(chat, message.content)
         user_message = Message(
@@ -124,9 +239,22 @@ async def send_message(
             role="user",
             content=message.content,
         )
-        assistant_messages = await Runner(assistant, chat).run(user_message)
+        cancel_on_disconnect = message.cancel_on_disconnect
+        if cancel_on_disconnect is None:
+            cancel_on_disconnect = deps.CANCEL_ON_DISCONNECT
+        runner = Runner(assistant, chat)
+        assistant_messages = await deps.runs.run(
+            chat,
+            runner.run(user_message),
+            request=request if cancel_on_disconnect else None,
+        )
+        if message.timings:
+            response.headers["Server-Timing"] = metrics.server_timing(runner.timings)
         background_tasks.add_task(tasks.update_title, chat)
         return assistant_messages
+    except RunCancelled:
+        logger.info("Run cancelled")
+        return chat.new_messages
     except ClientDisconnect:
         logger.info("Client disconnected")
         return []
@@ -137,6 +265,79 @@ async def send_message(
         chat.state.save_to_disk()
 
 
+async def _find_duplicate(chat: Chat, message: models.SendMessageRequest) -> list[Message] | JSONResponse | None:
+    """Return the result of an earlier submission of the message, or None if it is new or its run failed."""
+    pending = deps.submissions.get(chat.state.id, message.id)
+    if pending:
+        # Shielded, so the first request is not affected if this one is cancelled.
+        replies = await asyncio.shield(pending)
+        if replies is not None:
+            return replies
+
+    run = deps.run_queue.find(chat.state.id, message.id)
+    if run and run.status not in (RunStatus.FAILED, RunStatus.CANCELLED):
+        return JSONResponse(status_code=202, content=run.model_dump(mode="json"))
+
+    return _find_replies(chat.state, message.id)
+
+
+def _find_replies(state: ChatState, message_id: str) -> Optional[list[Message]]:
+    """
+    Return the replies following the message in the history, if the assistant answered it.
+    If the message is in the history without an answer, it is removed with its replies, so it can be run again.
+    """
+    for i, existing in enumerate(state.messages):
+        if existing.id == message_id:
+            replies = []
+            for reply in state.messages[i + 1 :]:
+                if reply.role == "user":
+                    break
+                replies.append(reply)
+            if _answered(replies):
+                return replies
+            logger.info("Message %s was not answered, running it again", message_id)
+            del state.messages[i : i + 1 + len(replies)]
+            return None
+    return None
+
+
+def _answered(messages: list[Message]) -> bool:
+    """True if the messages contain a reply of the assistant and no error."""
+    replied = False
+    for message in messages:
+        if message.role == "assistant":
+            if message.name == ERROR_REPLY_NAME:
+                return False
+            replied = True
+    return replied
+
+
+async def execute_run(run: RunState) -> list[Message]:
+    """Execute a queued run. Called by the workers of the run queue."""
+    chat = deps.get_chat(run.chat_id)
+    replies = _find_replies(chat.state, run.message.id)
+    if replies is not None:
+        return replies
+    # Unselected candidates of the last retry are pruned when the chat continues.
+    chat.state.candidates = None
+    try:
+        assistant = deps.registry.get_assistant(run.assistant)
+        assistant_messages = await deps.runs.run(chat, Runner(assistant, chat).run(run.message))
+    except RunCancelled:
+        raise
+    except Exception as e:
+        await _handle_exception(chat, e)
+        raise
+    finally:
+        chat.state.save_to_disk()
+
+    try:
+        await tasks.update_title(chat)
+    except Exception as e:
+        logger.error(f"Error updating title: {e}")
+    return assistant_messages
+
+
 async def _handle_exception(chat: Chat, e: Exception):
     logger.error(f"Error handling message: {e}")
     traceback.print_exc()
@@ -151,9 +352,10 @@ async def _handle_exception(chat: Chat, e: Exception):
     content = f"`{e.__class__.__name__} at {filename}:{lineno} in {func}`:\n{text}"
 
     # TODO add category "error"
-    reply = await chat.reply("assistant", name="Error")
-    await reply.add_chunk(content)
-    await reply.end()
+    async with chat.batch():
+        reply = await chat.reply("assistant", name=ERROR_REPLY_NAME)
+        await reply.add_chunk(content)
+        await reply.end()
 
 
 async def handle_command(chat: Chat, content: str):
@@ -171,10 +373,125 @@ async def handle_command(chat: Chat, content: str):
             chat.state.assistant = assistant.name
             await chat._queue_message({"type": "update_assistant", "assistant": chat.state.assistant})
             return [Message(role="assistant", content=f"Assistant set to {assistant.name}")]
+        case "/stop":
+            cancelled = deps.run_queue.cancel(chat.state.id)
+            cancelled += await deps.runs.cancel(chat.state.id)
+            if cancelled:
+                # Cancelled runs have saved their partial replies. Reload, so we do not overwrite them.
+                chat.state = ChatState.load_from_disk(chat.state.id)
+            return [Message(role="assistant", content=f"Stopped {cancelled} run(s)")]
+        case "/all":
+            if not args:
+                raise Exception("Usage: /all <message>")
+            # Slice the content instead of joining the arguments, which would lose the newlines of the message.
+            message = content.split(maxsplit=1)[1]
+            return await deps.runs.run(chat, fan_out(chat, deps.registry.assistants, message))
+        case "/ask":
+            if len(args) < 2:
+                raise Exception("Usage: /ask <assistant,assistant,...> <message>")
+            assistants = [deps.registry.get_assistant(name) for name in args[0].split(",") if name]
+            message = content.split(maxsplit=2)[2]
+            return await deps.runs.run(chat, fan_out(chat, assistants, message))
         case _:
             raise Exception("Unknown command")
 
 
+async def fan_out(chat: Chat, assistants: list[Assistant], content: str) -> list[Message]:
+    """
+    Run the assistants concurrently on the same history. Replies are streamed to clients as they are generated.
+    Replies are added to the chat in the order of assistants when all runs finish, or when they are cancelled.
+    """
+    user_message = Message(role="user", content=content)
+    chat.state.messages.append(user_message)
+
+    # Each assistant works on its own copy of the history, so it does not see the replies of the others.
+    chats = [_branch(chat) for _ in assistants]
+    try:
+        await asyncio.gather(*(_run_branch(assistant, branch) for assistant, branch in zip(assistants, chats)))
+    finally:
+        for branch in chats:
+            chat.new_messages.extend(branch.new_messages)
+            chat.state.messages.extend(branch.new_messages)
+            chat.add_usage(branch.usage)
+    return chat.new_messages
+
+
+async def generate_candidates(chat: Chat, assistant: Assistant, count: int) -> list[list[Message]]:
+    """
+    Run the assistant count times concurrently on the same history. Events of each run have a "candidate" field.
+    The first candidate is added to the history and all of them are saved in the chat state for selection.
+    """
+    chats = [_branch(chat, candidate=index) for index in range(count)]
+    try:
+        await asyncio.gather(*(_run_branch(assistant, branch) for branch in chats))
+    finally:
+        replies = [branch.new_messages for branch in chats]
+        for branch in chats:
+            chat.add_usage(branch.usage)
+        chat.state.candidates = Candidates(start=len(chat.state.messages), replies=replies)
+        chat.new_messages.extend(replies[0])
+        chat.state.messages.extend(replies[0])
+    return replies
+
+
+def _branch(chat: Chat, **fields) -> Chat:
+    """
+    Return a chat on a copy of the history, for running assistants concurrently.
+    Messages are published to the clients of the chat, with the fields added to each message.
+    """
+    publisher = chat.publisher
+    batch_publisher = chat.batch_publisher
+    if fields:
+        if chat_publisher := chat.publisher:
+
+            async def publish(message: dict):
+                await chat_publisher({**message, **fields})
+
+            publisher = publish
+
+        if chat_batch_publisher := chat.batch_publisher:
+
+            async def publish_many(messages: list[dict]):
+                await chat_batch_publisher([{**message, **fields} for message in messages])
+
+            batch_publisher = publish_many
+
+    return Chat(
+        state=chat.state.model_copy(update={"messages": list(chat.state.messages), "usage": Usage()}),
+        publisher=publisher,
+        batch_publisher=batch_publisher,
+    )
+
+
+async def _run_branch(assistant: Assistant, chat: Chat):
+    try:
+        await Runner(assistant, chat).run()
+    except Exception as e:
+        # Other branches continue
+        await _handle_exception(chat, e)
+
+
+@app.post("/chats/{chat_id}/cancel")
+async def cancel_runs(
+    chat_id: str,
+    runs: RunManager = Depends(deps.get_runs),
+    run_queue: RunQueue = Depends(deps.get_run_queue),
+):
+    """Cancel the assistant runs in progress or queued on a chat session."""
+    cancelled = run_queue.cancel(chat_id)
+    cancelled += await runs.cancel(chat_id)
+    return {"cancelled": cancelled}
+
+
+@app.get("/runs/{run_id}", response_model=RunState)
+async def get_run(run_id: str, run_queue: RunQueue = Depends(deps.get_run_queue)):
+    """Return the status of a queued run."""
+    run = run_queue.get(run_id)
+    if not run:
+        return JSONResponse(status_code=404, content={"detail": "Run not found"})
+    return run
+
+
 @app.put("/chats/{chat_id}/messages/{message_id}")
 async def edit_message(
     message_id: str,
@@ -202,9 +519,26 @@ async def delete_message(
     state.save_to_disk()
 
 
-@app.post("/chats/{chat_id}/messages/{message_id}/retry", response_model=list[Message])
-async def retry_message(message_id: str, chat: Chat = Depends(deps.get_chat)):
-    """Retry from a message by removing it and all subsequent messages, then rerun the assistant."""
+@app.post("/chats/{chat_id}/messages/{message_id}/retry", response_model=list[Message] | list[list[Message]])
+async def retry_message(
+    message_id: str,
+    candidates: int = Query(default=1, ge=1, le=MAX_CANDIDATES),
+    chat: Chat = Depends(deps.get_chat),
+):
+    """
+    Retry from a message by removing it and all subsequent messages, then rerun the assistant.
+
+    If candidates is more than 1, the assistant is run that many times concurrently and the candidates are returned.
+    The first candidate is kept until another one is selected with the select endpoint.
+    """
+    async with deps.run_queue.exclusive(chat.state.id):
+        # Queued runs of the chat may have changed it since it was loaded.
+        chat.state = deps.get_chat_state(chat.state.id)
+        return await _retry_message(chat, message_id, candidates)
+
+
+async def _retry_message(chat: Chat, message_id: str, candidates: int):
+    chat.state.candidates = None
     try:
         try:
             message_index = [msg.id for msg in chat.state.messages].index(message_id)
@@ -216,8 +550,13 @@ async def retry_message(message_id: str, chat: Chat = Depends(deps.get_chat)):
         assert retry_message.name
         assistant = deps.registry.get_assistant(retry_message.name)
         chat.state.messages = chat.state.messages[:message_index]
-        assistant_messages = await Runner(assistant, chat).run()
+        if candidates > 1:
+            return await deps.runs.run(chat, generate_candidates(chat, assistant, candidates))
+        assistant_messages = await deps.runs.run(chat, Runner(assistant, chat).run())
         return assistant_messages
+    except RunCancelled:
+        logger.info("Run cancelled")
+        return chat.new_messages
     except ClientDisconnect:
         logger.info("Client disconnected")
         return []
@@ -228,6 +567,28 @@ async def retry_message(message_id: str, chat: Chat = Depends(deps.get_chat)):
         chat.state.save_to_disk()
 
 
+@app.post("/chats/{chat_id}/candidates/{index}/select", response_model=list[Message])
+async def select_candidate(index: int, state: ChatState = Depends(deps.get_chat_state)):
+    """Keep the candidate of the last retry at index in the history and prune the others. Returns its messages."""
+    async with deps.run_queue.exclusive(state.id):
+        # Queued runs of the chat may have changed it since it was loaded.
+        state = deps.get_chat_state(state.id)
+        candidates = state.candidates
+        if not candidates or not 0 <= index < len(candidates.replies):
+            return JSONResponse(status_code=404, content={"detail": "Candidate not found"})
+        current = [message.id for message in state.messages[candidates.start :]]
+        if current != [message.id for message in candidates.replies[0]]:
+            # History was changed after the retry
+            state.candidates = None
+            state.save_to_disk()
+            return JSONResponse(status_code=409, content={"detail": "Candidates are no longer valid"})
+        selected = candidates.replies[index]
+        state.messages = state.messages[: candidates.start] + selected
+        state.candidates = None
+        state.save_to_disk()
+        return selected
+
+
 @app.post("/chats/{chat_id}/messages/{message_id}/fork")
 async def fork_chat(message_id: str, state: ChatState = Depends(deps.get_chat_state)):
     """Fork a chat by creating a new chat with messages up to and including the specified message."""
@@ -262,6 +623,10 @@ async def get_events(chat_id: str, pubsub: PubSub = Depends(deps.get_pubsub)):
         async with pubsub.subscribe(chat_id) as queue:
             while True:
                 message = await queue.get()
-                yield ServerSentEvent(json.dumps(message))
+                if isinstance(message, Batch):
+                    # Send all events of the batch in a single write.
+                    yield b"".join(ServerSentEvent(json.dumps(item)).encode() for item in message)
+                else:
+                    yield ServerSentEvent(json.dumps(message))
 
     return EventSourceResponse(generate_events())
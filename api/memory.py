@@ -0,0 +1,188 @@
+"""
+This module contains memory diagnostics of the API server.
+
+Sizes of live objects are approximated by walking their references,
+so objects shared between chats (e.g. cached strings) are counted in each of them.
+Allocation snapshots are taken with tracemalloc, which must be started first and slows down the process while active.
+"""
+
+import asyncio
+import gc
+import os
+import resource
+import sys
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Literal, Optional
+
+from pydantic import BaseModel
+
+from akson import Chat
+from logger import logger
+
+# Number of tracemalloc snapshots kept in memory
+MAX_SNAPSHOTS = 5
+
+
+def deep_sizeof(obj, seen: Optional[set[int]] = None) -> int:
+    """Approximate number of bytes used by the object and the objects it references."""
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, BaseModel):
+            stack.append(obj.__dict__)
+        elif hasattr(obj, "__dict__"):
+            stack.append(vars(obj))
+    return size
+
+
+def _rss() -> dict:
+    """Current and peak resident set size of the process in bytes."""
+    result = {"peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    try:
+        with open("/proc/self/statm") as f:
+            result["rss"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        pass
+    return result
+
+
+def report(pubsub, runs, mcp_pools: Iterable = ()) -> dict:
+    """
+    Report approximate memory used by live chats, PubSub topics and runs in progress,
+    and the sessions of MCP servers. Servers run in their own processes, so only the number of sessions is reported.
+
+    Args:
+        pubsub: PubSub instance of the app
+        runs: RunManager instance of the app
+        mcp_pools: MCPSessionPool instances of the app
+    """
+    # Chats are not registered anywhere, so find them through the garbage collector.
+    chats = [obj for obj in gc.get_objects() if isinstance(obj, Chat)]
+    chat_sizes = sorted(
+        (
+            {
+                "id": chat.state.id,
+                "messages": len(chat.state.messages),
+                "new_messages": len(chat.new_messages),
+                "bytes": deep_sizeof([chat.state, chat.new_messages]),
+            }
+            for chat in chats
+        ),
+        key=lambda item: item["bytes"],
+        reverse=True,
+    )
+
+    topics = []
+    for topic, queues in pubsub.queues().items():
+        topics.append(
+            {
+                "topic": topic,
+                "subscribers": len(queues),
+                "queued_messages": sum(queue.qsize() for queue in queues),
+                "bytes": deep_sizeof([list(queue._queue) for queue in queues]),  # type: ignore
+            }
+        )
+    topics.sort(key=lambda item: item["bytes"], reverse=True)
+
+    in_progress = [{"chat_id": chat.state.id, "bytes": deep_sizeof(chat)} for chat in runs.in_progress()]
+
+    return {
+        **_rss(),
+        "tracemalloc": tracemalloc.is_tracing(),
+        "gc_objects": len(gc.get_objects()),
+        "chats": chat_sizes,
+        "topics": topics,
+        "runs": in_progress,
+        "mcp_sessions": [pool.stats() for pool in mcp_pools],
+        "tasks": len(asyncio.all_tasks()),
+    }
+
+
+class Snapshots:
+    """Keeps the latest tracemalloc snapshots, so they can be compared to find leaks."""
+
+    def __init__(self, max_snapshots: int = MAX_SNAPSHOTS):
+        self.max_snapshots = max_snapshots
+        self._snapshots: OrderedDict[int, tuple[datetime, tracemalloc.Snapshot]] = OrderedDict()
+        self._next_id = 1
+
+    def start(self, frames: int = 1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            logger.info("Started tracemalloc with %d frame(s)", frames)
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logger.info("Stopped tracemalloc")
+        self._snapshots.clear()
+
+    def take(self) -> int:
+        """Take a snapshot. Returns its ID. Raises RuntimeError if tracemalloc is not started."""
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            )
+        )
+        snapshot_id = self._next_id
+        self._next_id += 1
+        self._snapshots[snapshot_id] = (datetime.now(), snapshot)
+        while len(self._snapshots) > self.max_snapshots:
+            self._snapshots.popitem(last=False)
+        return snapshot_id
+
+    def list_snapshots(self) -> list[dict]:
+        return [{"id": id, "taken_at": taken_at} for id, (taken_at, _) in self._snapshots.items()]
+
+    def top(self, snapshot_id: int, key_type: Literal["lineno", "filename", "traceback"] = "lineno", limit: int = 20):
+        """Return the locations allocating the most memory. Raises KeyError if the snapshot is unknown."""
+        _, snapshot = self._snapshots[snapshot_id]
+        return [
+            {"location": _format_traceback(stat.traceback), "bytes": stat.size, "count": stat.count}
+            for stat in snapshot.statistics(key_type)[:limit]
+        ]
+
+    def diff(
+        self,
+        old_id: int,
+        new_id: int,
+        key_type: Literal["lineno", "filename", "traceback"] = "lineno",
+        limit: int = 20,
+    ) -> list[dict]:
+        """Return the locations whose allocations grew the most between snapshots. Raises KeyError if unknown."""
+        _, old = self._snapshots[old_id]
+        _, new = self._snapshots[new_id]
+        return [
+            {
+                "location": _format_traceback(stat.traceback),
+                "bytes": stat.size,
+                "bytes_diff": stat.size_diff,
+                "count": stat.count,
+                "count_diff": stat.count_diff,
+            }
+            for stat in new.compare_to(old, key_type)[:limit]
+        ]
+
+
+def _format_traceback(traceback: tracemalloc.Traceback) -> str:
+    return " <- ".join(f"{frame.filename}:{frame.lineno}" for frame in traceback)
+
+
+snapshots = Snapshots()
@@ -0,0 +1,324 @@
+"""
+This module contains the in-process metrics of the API server.
+Metrics are aggregated in memory and exposed by the FastAPI app as JSON and in Prometheus text format.
+
+Metric values are plain Python numbers updated from the event loop thread, so no locking is needed.
+Values are cached per label values, so updating a metric on the hot path does not allocate.
+"""
+
+import bisect
+import time
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from typing import Callable, Generic, Optional, Protocol, TypeVar
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Value(Protocol):
+    """Values of a metric for one set of label values."""
+
+    def snapshot(self) -> dict: ...
+
+
+class ScalarValue(Value, Protocol):
+    value: float
+
+
+V = TypeVar("V", bound=Value)
+S = TypeVar("S", bound=ScalarValue)
+
+
+class Metric(ABC, Generic[V]):
+    """Base class for metrics. Values are grouped by label values."""
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._children: dict[tuple[str, ...], V] = {}
+        registry.append(self)
+
+    def labels(self, *values: str) -> V:
+        """Return the value for the given label values. Children are cached, so this is cheap to call."""
+        try:
+            return self._children[values]
+        except KeyError:
+            assert len(values) == len(self.labelnames), f"{self.name} expects labels {self.labelnames}"
+            child = self._children[values] = self._new_child()
+            return child
+
+    @abstractmethod
+    def _new_child(self) -> V: ...
+
+    def items(self) -> list[tuple[dict[str, str], V]]:
+        return [(dict(zip(self.labelnames, values)), child) for values, child in sorted(self._children.items())]
+
+    def snapshot(self) -> list[dict]:
+        return [{"labels": labels, **child.snapshot()} for labels, child in self.items()]
+
+    @abstractmethod
+    def render(self) -> list[str]:
+        """Return the lines of the metric in Prometheus text format."""
+
+
+class ScalarMetric(Metric[S]):
+    """Metric with a single number for each set of label values."""
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_format_labels(labels)} {child.value}" for labels, child in self.items()]
+
+
+class CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def snapshot(self) -> dict:
+        return {"value": self.value}
+
+
+class Counter(ScalarMetric[CounterValue]):
+    """Monotonically increasing value. Name should end with _total."""
+
+    type = "counter"
+
+    def _new_child(self):
+        return CounterValue()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class GaugeValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def snapshot(self) -> dict:
+        return {"value": self.value}
+
+
+class Gauge(ScalarMetric[GaugeValue]):
+    """Value that can go up and down."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], dict[tuple[str, ...], float]]] = None
+
+    def _new_child(self):
+        return GaugeValue()
+
+    def set_function(self, function: Callable[[], dict[tuple[str, ...], float]]):
+        """
+        Compute the values when the metric is read instead of updating them.
+        The function returns values keyed by label values.
+        """
+        self._function = function
+
+    def items(self) -> list[tuple[dict[str, str], GaugeValue]]:
+        if self._function:
+            self._children.clear()
+            for values, value in self._function().items():
+                self.labels(*values).set(value)
+        return super().items()
+
+
+class HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # Last item is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate the quantile from buckets. Returns the upper bound of the bucket containing the quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": _format_bound(self.quantile(0.5)),
+            "p90": _format_bound(self.quantile(0.9)),
+            "p99": _format_bound(self.quantile(0.99)),
+        }
+
+
+class Histogram(Metric[HistogramValue]):
+    """Histogram with fixed buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.buckets = buckets
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> list[str]:
+        lines = []
+        for labels, child in self.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), child.counts):
+                cumulative += count
+                bucket_labels = {**labels, "le": str(_format_bound(bound))}
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {child.sum}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {child.count}")
+        return lines
+
+
+def _format_bound(value: Optional[float]) -> float | str | None:
+    # Infinity is not valid JSON
+    if value == float("inf"):
+        return "+Inf"
+    return value
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class timed:
+    """Context manager that observes the elapsed time and adds it to the timings of the current run."""
+
+    __slots__ = ("histogram", "phase", "started")
+
+    def __init__(self, histogram: HistogramValue, phase: Optional[str] = None):
+        self.histogram = histogram
+        self.phase = phase
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        self.histogram.observe(elapsed)
+        if self.phase:
+            add_timing(self.phase, elapsed)
+
+
+# Breakdown of the time spent in the current run by phase. Set by Runner.
+# Tasks created during the run share the same dict.
+run_timings: ContextVar[Optional[dict[str, float]]] = ContextVar("run_timings", default=None)
+
+
+def add_timing(phase: str, seconds: float):
+    timings = run_timings.get()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+def server_timing(timings: dict[str, float]) -> str:
+    """Format timings as the value of Server-Timing header."""
+    return ", ".join(f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in timings.items())
+
+
+# All metrics created in the process
+registry: list[Metric] = []
+
+
+def snapshot() -> dict[str, list[dict]]:
+    """Return the current values of all metrics as a JSON serializable dict."""
+    return {metric.name: metric.snapshot() for metric in registry}
+
+
+def render() -> str:
+    """Return the current values of all metrics in Prometheus text format."""
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Duration of HTTP requests by route.", ("method", "route", "status")
+)
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware that records the duration of HTTP requests by route.
+    For streaming responses, the duration covers the whole stream.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Route is set by the router. Paths without a route are grouped to keep the number of labels bounded.
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            http_request_duration.labels(scope["method"], path, status).observe(time.perf_counter() - started)
@@ -20,8 +20,15 @@ class ChatSummary(BaseModel):
 
 class SendMessageRequest(BaseModel):
     id: str = Field(default_factory=generate_message_id)
+    """Submitting a message with the same ID again returns the earlier result instead of running the assistant."""
     content: str
     assistant: Optional[str] = None
+    cancel_on_disconnect: Optional[bool] = None
+    """Cancel the run if the client disconnects. Defaults to CANCEL_ON_DISCONNECT environment variable."""
+    wait: bool = True
+    """If false, the run is queued and the response is returned immediately. Output is sent over chat events."""
+    timings: bool = False
+    """If true, breakdown of the time spent in the run is returned in Server-Timing header."""
 
 
 class EditMessageRequest(BaseModel):
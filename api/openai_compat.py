@@ -1,7 +1,8 @@
+import asyncio
 import json
 import random
 import time
-from typing import Iterable, Literal
+from typing import AsyncGenerator, Iterable, Literal
 
 from fastapi import FastAPI
 from pydantic import BaseModel, Field
@@ -9,7 +10,9 @@ from sse_starlette import EventSourceResponse
 
 from akson import Chat
 from akson import Message as AksonMessage
+from akson import Usage as AksonUsage
 from deps import registry
+from logger import logger
 from runner import Runner
 
 
@@ -18,10 +21,15 @@ class Message(BaseModel):
     content: str
 
 
+class StreamOptions(BaseModel):
+    include_usage: bool = False
+
+
 class ChatCompletionRequest(BaseModel):
     model: str
     messages: list[Message]
     stream: bool | None = False
+    stream_options: StreamOptions | None = None
     temperature: float = Field(default=1.0, ge=0.0, le=2.0)
 
 
@@ -31,10 +39,15 @@ class Choice(BaseModel):
     finish_reason: str
 
 
+class PromptTokensDetails(BaseModel):
+    cached_tokens: int = 0
+
+
 class Usage(BaseModel):
     prompt_tokens: int
     completion_tokens: int
     total_tokens: int
+    prompt_tokens_details: PromptTokensDetails | None = None
 
 
 class ChatCompletionResponse(BaseModel):
@@ -46,68 +59,172 @@ class ChatCompletionResponse(BaseModel):
     usage: Usage
 
 
-def chat_streaming_chunk(response: ChatCompletionResponse, content: str, *, finish_reason: str | None = None):
+def chat_streaming_chunk(
+    response: ChatCompletionResponse,
+    delta: dict,
+    *,
+    finish_reason: str | None = None,
+):
     return {
         "id": response.id,
-        "object": "chat.completions.chunk",
+        "object": "chat.completion.chunk",
         "created": response.created,
         "model": response.model,
         "choices": [
             {
                 "index": 0,
                 "finish_reason": finish_reason,
-                "delta": {"role": "assistant", "content": content},
+                "delta": delta,
             }
         ],
     }
 
 
 async def chat_completions(request: ChatCompletionRequest):
+    if request.stream:
+        assistant = registry.get_assistant(request.model)
+        return EventSourceResponse(_stream(request, _new_response(request.model), assistant))
+    return await create_completion(request)
+
+
+async def create_completion(request: ChatCompletionRequest) -> ChatCompletionResponse:
+    """Run the assistant named by the model on the messages and return its final answer. Used by batches too."""
     assistant = registry.get_assistant(request.model)
+    response = _new_response(request.model)
 
     chat = Chat()
     chat.state.messages = list(_convert_messages(request.messages))
 
     runner = Runner(assistant, chat)
     new_messages = await runner.run()
-    content = new_messages[-1].content
+    content = _join_content(new_messages)
 
-    completion_tokens = len(content.split())
-    prompt_tokens = sum(len(msg.content.split()) for msg in request.messages)
+    response.choices = [Choice(index=0, message=Message(role="assistant", content=content), finish_reason="stop")]
+    response.usage = _convert_usage(chat.usage)
+    return response
 
-    response = ChatCompletionResponse(
-        id=f"chatcmpl-{random.randint(1000000, 9999999)}",
-        object="chat.completion",
-        created=int(time.time()),
-        model=request.model,
-        choices=[Choice(index=0, message=Message(role="assistant", content=content), finish_reason="stop")],
-        usage=Usage(
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-            total_tokens=prompt_tokens + completion_tokens,
-        ),
-    )
 
-    if not request.stream:
-        return response
+async def _stream(request: ChatCompletionRequest, response: ChatCompletionResponse, assistant) -> AsyncGenerator:
+    """
+    Run the assistant and forward the messages published by the chat as completion chunks while they are generated.
+    The run is cancelled if the client disconnects.
+
+    Tool calls are executed by the assistant on the server. They are forwarded as tool_calls deltas to show the
+    progress of the run, and the stream still ends with finish_reason "stop", so clients must not execute them.
+    Content of the assistant messages is joined like the non-streaming response.
+    """
+    queue: asyncio.Queue[dict | None] = asyncio.Queue()
+
+    chat = Chat(publisher=queue.put)
+    chat.state.messages = list(_convert_messages(request.messages))
+
+    async def run():
+        try:
+            await Runner(assistant, chat).run()
+        finally:
+            await queue.put(None)
 
-    async def generator():
-        yield {"data": json.dumps(chat_streaming_chunk(response, ""))}
+    task = asyncio.create_task(run())
+    converter = _ChunkConverter()
+    try:
+        yield {"data": json.dumps(chat_streaming_chunk(response, {"role": "assistant", "content": ""}))}
 
-        # Fake streaming of whole content
-        for word in content.split():
-            yield {"data": json.dumps(chat_streaming_chunk(response, word + " "))}
+        while (message := await queue.get()) is not None:
+            delta = converter.convert(message)
+            if delta:
+                yield {"data": json.dumps(chat_streaming_chunk(response, delta))}
 
-        yield {"data": json.dumps(chat_streaming_chunk(response, "", finish_reason="stop"))}
+        # Raises the exception of the run, which ends the stream without [DONE]
+        await task
+
+        yield {"data": json.dumps(chat_streaming_chunk(response, {}, finish_reason="stop"))}
+        if request.stream_options and request.stream_options.include_usage:
+            chunk = chat_streaming_chunk(response, {})
+            chunk["choices"] = []
+            chunk["usage"] = _convert_usage(chat.usage).model_dump()
+            yield {"data": json.dumps(chunk)}
         yield "[DONE]"
+    finally:
+        if not task.done():
+            logger.info("Client disconnected, cancelling run")
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
 
-    return EventSourceResponse(generator())
+class _ChunkConverter:
+    """Converts messages published by Chat into deltas of completion chunks."""
+
+    def __init__(self):
+        # Assistant messages of the run. Replies of tools are run by the assistant and not sent to the client.
+        self._assistant_messages: set[str] = set()
+        # Index of the tool call in the response by message id
+        self._tool_calls: dict[str, int] = {}
+        # Message id of the last content chunk. Content of separate messages is separated by a blank line.
+        self._last_content: str | None = None
+
+    def convert(self, message: dict) -> dict | None:
+        match message["type"]:
+            case "begin_message":
+                if message["role"] == "assistant":
+                    self._assistant_messages.add(message["id"])
+            case "add_chunk" if message["id"] in self._assistant_messages:
+                return self._convert_chunk(message["id"], message["field"], message["chunk"])
+        return None
+
+    def _convert_chunk(self, id: str, field: str, chunk: str) -> dict | None:
+        if field == "content":
+            if self._last_content not in (None, id):
+                chunk = "\n\n" + chunk
+            self._last_content = id
+            return {"content": chunk}
+
+        if field == "tool_call.id":
+            index = self._tool_calls[id] = len(self._tool_calls)
+            return {"tool_calls": [{"index": index, "id": chunk, "type": "function", "function": {}}]}
+
+        index = self._tool_calls.get(id)
+        if index is None:
+            return None
+        if field == "tool_call.name":
+            return {"tool_calls": [{"index": index, "function": {"name": chunk}}]}
+        if field == "tool_call.arguments":
+            return {"tool_calls": [{"index": index, "function": {"arguments": chunk}}]}
+        return None
+
+
+def _join_content(messages: list[AksonMessage]) -> str:
+    """Content of the assistant messages of the run, separated by a blank line as in the streaming response."""
+    return "\n\n".join(message.content for message in messages if message.role == "assistant" and message.content)
+
+
+def _new_response(model: str) -> ChatCompletionResponse:
+    return ChatCompletionResponse(
+        id=f"chatcmpl-{random.randint(1000000, 9999999)}",
+        object="chat.completion",
+        created=int(time.time()),
+        model=model,
+        choices=[],
+        usage=Usage(prompt_tokens=0, completion_tokens=0, total_tokens=0),
+    )
+
+
+def _convert_usage(usage: AksonUsage) -> Usage:
+    """Tokens used by all completions of the run, including tool call turns."""
+    return Usage(
+        prompt_tokens=usage.prompt_tokens,
+        completion_tokens=usage.completion_tokens,
+        total_tokens=usage.total_tokens,
+        prompt_tokens_details=PromptTokensDetails(cached_tokens=usage.cached_tokens),
+    )
 
 
 def models():
     return {
         "object": "list",
-        "data": [{"id": assistant.name, "object": "model", "owned_by": "akson"} for assistant in registry.assistants],
+        "data": [{"id": name, "object": "model", "owned_by": "akson"} for name in registry.names],
     }
 
 
@@ -118,6 +235,7 @@ def setup_routes(app: FastAPI):
         methods=["POST"],
         response_model=ChatCompletionResponse,
         summary="OpenAI compatible chat completions endpoint",
+        description="Tool calls are executed by the assistant. Streamed tool_calls deltas are informational only.",
     )
     app.add_api_route(
         "/v1/models",
@@ -5,15 +5,52 @@ Topic corresponds to a chat ID.
 
 import asyncio
 import contextlib
+import time
 import uuid
 from functools import partial
 from typing import Any, AsyncIterator, Callable, Coroutine, Dict
 
+import metrics
+
+publish_duration = metrics.Histogram(
+    "pubsub_publish_seconds",
+    "Time spent delivering a message to all subscribers of a topic.",
+    buckets=metrics.FAST_BUCKETS,
+)
+messages_published = metrics.Counter("pubsub_messages_published_total", "Messages delivered to subscribers.")
+messages_dropped = metrics.Counter(
+    "pubsub_messages_dropped_total", "Messages not delivered because the queue of a subscriber did not accept them."
+)
+topics = metrics.Gauge("pubsub_topics", "Number of topics with at least one subscriber.")
+subscribers = metrics.Gauge(
+    "pubsub_subscribers", "Number of subscribers, e.g. open SSE connections, by topic.", ("topic",)
+)
+
+
+class Batch(list):
+    """Ordered group of messages delivered to each subscriber as a single item."""
+
 
 class PubSub:
-    def __init__(self):
-        self._subscribers: Dict[str, Dict[str, Callable[[Any], Coroutine]]] = {}
+    def __init__(self, max_queue_size: int = 0):
+        """
+        Args:
+            max_queue_size: Maximum number of items waiting in the queue of a subscriber. Items published to a full
+                queue are dropped for that subscriber, so a slow client cannot hold an unlimited backlog in memory.
+                0 means unbounded.
+        """
+        self.max_queue_size = max_queue_size
+        # Queues of the subscribers by topic, keyed by subscription ID
+        self._queues: Dict[str, Dict[str, asyncio.Queue]] = {}
         self._subscription_lock = asyncio.Lock()
+        self._published = messages_published.labels()
+        self._dropped = messages_dropped.labels()
+        self._duration = publish_duration.labels()
+
+    def register_metrics(self):
+        """Report the number of topics and subscribers of this instance in metrics."""
+        topics.set_function(lambda: {(): len(self._queues)})
+        subscribers.set_function(lambda: {(topic,): len(queues) for topic, queues in self._queues.items()})
 
     def get_publisher(self, topic: str) -> Callable[[Any], Coroutine]:
         return partial(self.publish, topic)
@@ -29,22 +66,47 @@ class PubSub:
         Returns:
             Number of subscribers that received the message
         """
-        if topic not in self._subscribers:
-            return 0
+        return self._deliver(topic, message, 1)
 
-        subscriber_count = 0
-        pending_tasks = []
+    async def publish_many(self, topic: str, messages: list) -> int:
+        """
+        Publish an ordered group of messages to a topic in a single round.
+        Subscribers receive them as a single Batch item, so they can be handled together.
 
-        # Create tasks for all subscriber callbacks
-        for callback in self._subscribers[topic].values():
-            pending_tasks.append(asyncio.create_task(callback(message)))
-            subscriber_count += 1
+        Args:
+            topic: The topic to publish to
+            messages: The messages to publish
+
+        Returns:
+            Number of subscribers that received the messages
+        """
+        if not messages:
+            return 0
+        return self._deliver(topic, Batch(messages), len(messages))
 
-        # Await all notifications to complete if there are any
-        if pending_tasks:
-            await asyncio.gather(*pending_tasks, return_exceptions=True)
+    def _deliver(self, topic: str, item: Any, count: int) -> int:
+        queues = self._queues.get(topic)
+        if not queues:
+            return 0
 
-        return subscriber_count
+        # The message is put in each queue without waiting and without creating a task per subscriber.
+        # Subscribers whose queue is full miss the message.
+        started = time.perf_counter()
+        for queue in queues.values():
+            try:
+                queue.put_nowait(item)
+            except asyncio.QueueFull:
+                self._dropped.inc(count)
+            else:
+                self._published.inc(count)
+        elapsed = time.perf_counter() - started
+        self._duration.observe(elapsed)
+        metrics.add_timing("publish", elapsed)
+        return len(queues)
+
+    def queues(self) -> Dict[str, list[asyncio.Queue]]:
+        """Return the queues of the subscribers by topic."""
+        return {topic: list(queues.values()) for topic, queues in self._queues.items()}
 
     @contextlib.asynccontextmanager
     async def subscribe(self, topic: str) -> AsyncIterator[asyncio.Queue]:
@@ -55,7 +117,7 @@ class PubSub:
             topic: The topic to subscribe to
 
         Returns:
-            An asyncio Queue that will receive messages
+            An asyncio Queue that will receive messages. Messages published with publish_many are received as a Batch.
 
         Example:
             async with pubsub.subscribe("my-topic") as queue:
@@ -63,7 +125,7 @@ class PubSub:
                     message = await queue.get()
                     # process message
         """
-        queue = asyncio.Queue()
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
         subscription_id = await self._subscribe(topic, queue)
 
         try:
@@ -75,16 +137,10 @@ class PubSub:
         """
         Internal method to handle subscription logic.
         """
-
-        async def callback(message: Any) -> None:
-            await queue.put(message)
-
         subscription_id = str(uuid.uuid4())
 
         async with self._subscription_lock:
-            if topic not in self._subscribers:
-                self._subscribers[topic] = {}
-            self._subscribers[topic][subscription_id] = callback
+            self._queues.setdefault(topic, {})[subscription_id] = queue
 
         return subscription_id
 
@@ -100,17 +156,15 @@ class PubSub:
             True if successfully unsubscribed, False otherwise
         """
         async with self._subscription_lock:
-            if topic not in self._subscribers:
-                return False
-
-            if subscription_id not in self._subscribers[topic]:
+            queues = self._queues.get(topic)
+            if not queues or subscription_id not in queues:
                 return False
 
-            del self._subscribers[topic][subscription_id]
+            del queues[subscription_id]
 
             # Clean up empty topics
-            if not self._subscribers[topic]:
-                del self._subscribers[topic]
+            if not queues:
+                del self._queues[topic]
 
             return True
 
@@ -1,12 +1,23 @@
 """
 This module contains the centralized registry for assistants.
 Each assistant loaded from the `assistants` directory is registered here.
+
+In lazy mode, the modules of the `assistants` directory are scanned instead of imported.
+Each module is imported when one of its assistants is first used, so the app starts without importing
+the assistants and their dependencies. Modules whose assistants cannot be found by the scan are imported at start.
 """
 
 from collections import OrderedDict
+from typing import Optional
 
 from akson import Assistant
-from loader import load_objects
+from loader import load_module_objects, load_objects, scan_names
+from logger import logger
+
+# Classes of assistants that are found by the scan
+ASSISTANT_CLASSES = ("LLMAssistant", "Router")
+# Classes that are not assistants, so creating them does not prevent the scan
+OTHER_CLASSES = ("FunctionToolkit", "MCPToolkit", "MultiToolkit", "AssistantToolkit")
 
 
 class UnknownAssistant(Exception):
@@ -16,9 +27,15 @@ class UnknownAssistant(Exception):
 
 class Registry:
 
-    def __init__(self):
+    def __init__(self, lazy: bool = False):
         # Keys are lowercase assistant names
-        self._assistants: dict[str, Assistant] = self._load_assistants()
+        self._assistants: dict[str, Assistant] = {}
+        # Names and modules of assistants that are not imported yet, keyed by lowercase assistant name
+        self._pending: dict[str, tuple[str, str]] = {}
+        if lazy:
+            self._scan_assistants()
+        else:
+            self._assistants = self._load_assistants()
 
     def _load_assistants(self):
         assistants = {}
@@ -30,16 +47,67 @@ class Registry:
                 assistants[key] = assistant
         return OrderedDict(sorted(assistants.items()))
 
+    def _scan_assistants(self):
+        modules = scan_names("assistants", level=1, classes=ASSISTANT_CLASSES, ignore=OTHER_CLASSES)
+        for module_path, names in modules.items():
+            if names is None:
+                self._import(module_path)
+                continue
+            for name in names:
+                key = name.lower()
+                if key in self._assistants or key in self._pending:
+                    raise Exception(f"Duplicate assistant found for {name}")
+                self._pending[key] = (name, module_path)
+
+    def _import(self, module_path: str):
+        """Register the assistants of the module."""
+        expected = {key for key, (_, path) in self._pending.items() if path == module_path}
+        for key in expected:
+            del self._pending[key]
+        for assistant in load_module_objects(Assistant, module_path):
+            key = assistant.name.lower()
+            if key in self._assistants:
+                raise Exception(f"Duplicate assistant found for {assistant.name}")
+            self._assistants[key] = assistant
+            expected.discard(key)
+        if expected:
+            logger.warning("Assistants not found in module %s: %s", module_path, ", ".join(sorted(expected)))
+
+    def register(self, assistant: Assistant):
+        """Add an assistant that is not defined in the assistants directory."""
+        key = assistant.name.lower()
+        if key in self._assistants or key in self._pending:
+            raise Exception(f"Duplicate assistant found for {assistant.name}")
+        self._assistants[key] = assistant
+
     def get_assistant(self, name: str) -> Assistant:
         name = name.lower()
-        try:
-            return self._assistants[name]
-        except KeyError:
-            matches = [assistant for assistant in self.assistants if assistant.name.lower().startswith(name)]
-            if len(matches) == 1:
-                return matches[0]
-            raise UnknownAssistant(name)
+        assistant = self._find(name)
+        if assistant:
+            return assistant
+        matches = [key for key in self._keys() if key.startswith(name)]
+        if len(matches) == 1:
+            return self._find(matches[0])  # type: ignore
+        raise UnknownAssistant(name)
+
+    def _find(self, key: str) -> Optional[Assistant]:
+        if key in self._pending:
+            self._import(self._pending[key][1])
+        return self._assistants.get(key)
+
+    def _keys(self) -> list[str]:
+        return sorted([*self._assistants, *self._pending])
+
+    @property
+    def names(self) -> list[str]:
+        """Names of the assistants. Does not import assistants in lazy mode."""
+        names = {key: assistant.name for key, assistant in self._assistants.items()}
+        names.update({key: name for key, (name, _) in self._pending.items()})
+        return [names[key] for key in sorted(names)]
 
     @property
     def assistants(self) -> list[Assistant]:
-        return list(self._assistants.values())
+        """All assistants. Imports the assistants that are not imported yet in lazy mode."""
+        for module_path in sorted({module_path for _, module_path in self._pending.values()}):
+            self._import(module_path)
+        return [self._assistants[key] for key in sorted(self._assistants)]
@@ -0,0 +1,162 @@
+"""
+This module contains on-demand CPU profiling of the API server.
+
+Profiles are captured either by sampling the stack of the event loop thread or with cProfile.
+Sampled profiles are written in collapsed stack format, which can be rendered by flamegraph.pl, speedscope or inferno.
+cProfile output can be opened with snakeviz or converted with flameprof.
+
+Since all requests share the event loop thread, a profile of a request or a run also contains
+other work done by the event loop at the same time.
+Only one capture can be active at a time. Nothing is profiled unless a capture is requested.
+"""
+
+import contextlib
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Iterator, Literal, Optional
+
+from logger import logger
+
+PROFILES_DIR = os.getenv("PROFILES_DIR", "profiles")
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+Mode = Literal["sample", "cprofile"]
+
+
+class Sampler:
+    """Samples the stack of a thread periodically from a background thread."""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="akson-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame:
+                self.stacks[_collapse(frame)] += 1
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _collapse(frame) -> str:
+    """Format the stack as a single line, root first, frames separated by semicolons."""
+    names = []
+    while frame:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})".replace(";", ":"))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Capture:
+    """A single profile, written to PROFILES_DIR when stopped."""
+
+    def __init__(self, name: str, mode: Mode):
+        self.mode = mode
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        extension = "folded" if mode == "sample" else "prof"
+        self.path = os.path.join(PROFILES_DIR, f"{timestamp}-{_clean(name)}.{extension}")
+        self._sampler: Optional[Sampler] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._started = 0.0
+
+    def start(self):
+        self._started = time.perf_counter()
+        if self.mode == "sample":
+            self._sampler = Sampler(threading.get_ident())
+            self._sampler.start()
+        else:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self) -> str:
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        if self._sampler:
+            self._sampler.stop()
+            self._sampler.write(self.path)
+        if self._profile:
+            self._profile.disable()
+            self._profile.dump_stats(self.path)
+        logger.info("Profile written to %s (%.1f seconds)", self.path, time.perf_counter() - self._started)
+        return self.path
+
+
+def _clean(name: str) -> str:
+    return "".join(char if char.isalnum() or char in "_-" else "_" for char in name)
+
+
+class Profiler:
+    """Starts captures requested by admin endpoints."""
+
+    def __init__(self):
+        self.active: Optional[Capture] = None
+        # Number of upcoming runs to profile, keyed by lowercase assistant name
+        self.armed: dict[str, tuple[int, Mode]] = {}
+
+    @contextlib.contextmanager
+    def capture(self, name: str, mode: Mode = "sample") -> Iterator[Optional[Capture]]:
+        """Profile the block. Yields None if another capture is already active."""
+        if self.active:
+            logger.warning("Profiler is busy, not profiling %s", name)
+            yield None
+            return
+        capture = self.active = Capture(name, mode)
+        try:
+            capture.start()
+            yield capture
+        finally:
+            self.active = None
+            capture.stop()
+
+    def arm(self, assistant: str, runs: int, mode: Mode = "sample"):
+        """Profile the next runs of the assistant."""
+        self.armed[assistant.lower()] = (runs, mode)
+
+    def profile_run(self, assistant: str):
+        """Return a context manager for profiling the run if it has been requested."""
+        if not self.armed:
+            return contextlib.nullcontext()
+        key = assistant.lower()
+        armed = self.armed.get(key)
+        if not armed:
+            return contextlib.nullcontext()
+        return self._capture_run(key, f"run-{assistant}", armed[1])
+
+    @contextlib.contextmanager
+    def _capture_run(self, key: str, name: str, mode: Mode) -> Iterator[Optional[Capture]]:
+        with self.capture(name, mode) as capture:
+            # Runs that are not profiled because the profiler is busy do not count.
+            if capture and (armed := self.armed.get(key)):
+                runs, mode = armed
+                if runs > 1:
+                    self.armed[key] = (runs - 1, mode)
+                else:
+                    del self.armed[key]
+            yield capture
+
+    def list_profiles(self) -> list[str]:
+        if not os.path.isdir(PROFILES_DIR):
+            return []
+        return sorted(os.listdir(PROFILES_DIR))
+
+
+profiler = Profiler()
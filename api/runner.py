@@ -2,9 +2,32 @@
 This module contains the Runner class, which is responsible for running an assistant on a chat.
 """
 
-from langfuse.decorators import langfuse_context, observe
+import functools
+import time
 
+import metrics
 from akson import Assistant, Chat, Message
+from logger import logger
+from run_profiler import profiler
+
+run_duration = metrics.Histogram("run_duration_seconds", "Duration of assistant runs.", ("assistant",))
+runs_in_progress = metrics.Gauge("runs_in_progress", "Number of assistant runs in progress.", ("assistant",))
+
+
+def _observed(func):
+    """Trace the function with Langfuse. Langfuse is slow to import, so it is imported by the first call."""
+    traced = None
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        nonlocal traced
+        if traced is None:
+            from langfuse.decorators import observe
+
+            traced = observe()(func)
+        return await traced(*args, **kwargs)
+
+    return wrapper
 
 
 class Runner:
@@ -13,9 +36,13 @@ class Runner:
         if not chat:
             chat = Chat()
         self.chat = chat
+        self.timings: dict[str, float] = {}
+        """Breakdown of the time spent in the run by phase, in seconds."""
 
-    @observe()
+    @_observed
     async def run(self, user_message: Message | str | None = None) -> list[Message]:
+        from langfuse.decorators import langfuse_context
+
         langfuse_context.update_current_trace(
             name=self.assistant.name,
             session_id=self.chat.state.id,
@@ -26,5 +53,19 @@ class Runner:
         if user_message:
             self.chat.state.messages.append(user_message)
 
-        await self.assistant.run(self.chat)
+        token = metrics.run_timings.set(self.timings)
+        in_progress = runs_in_progress.labels(self.assistant.name)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            with profiler.profile_run(self.assistant.name):
+                await self.assistant.run(self.chat)
+        finally:
+            in_progress.dec()
+            elapsed = time.perf_counter() - started
+            self.timings["total"] = elapsed
+            run_duration.labels(self.assistant.name).observe(elapsed)
+            metrics.run_timings.reset(token)
+            logger.debug("Run timings: %s", self.timings)
+            logger.debug("Run usage: %s", self.chat.usage)
         return self.chat.new_messages
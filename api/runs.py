@@ -0,0 +1,435 @@
+"""
+This module keeps track of assistant runs in progress.
+Runs are executed in their own tasks, so they can be cancelled by the user or when the client disconnects.
+Runs can also be queued to be executed in the background by a pool of workers.
+"""
+
+import asyncio
+import contextlib
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from enum import StrEnum
+from typing import Any, AsyncIterator, Callable, Coroutine, Optional
+
+from pydantic import BaseModel, Field
+from starlette.requests import Request
+
+from akson import Chat, Message
+from id_generator import generate_run_id
+from logger import logger
+
+
+class RunCancelled(Exception):
+    """Raised when a run is cancelled by the user or the client disconnects."""
+
+
+class RunManager:
+
+    def __init__(self, disconnect_poll_interval: float = 1.0):
+        # Keys are chat IDs
+        self._tasks: dict[str, set[asyncio.Task]] = {}
+        # Chats of the runs in progress
+        self._chats: dict[asyncio.Task, Chat] = {}
+        self.disconnect_poll_interval = disconnect_poll_interval
+
+    async def run[T](self, chat: Chat, coro: Coroutine[Any, Any, T], *, request: Optional[Request] = None) -> T:
+        """
+        Run the coroutine as a cancellable run of the chat.
+        The chat is saved when the run finishes, including when it is cancelled.
+
+        Args:
+            chat: The chat the run belongs to
+            coro: The coroutine to run, usually Runner.run
+            request: If given, the run is cancelled when the client of this request disconnects.
+
+        Raises:
+            RunCancelled: If the run is cancelled.
+        """
+
+        async def run_and_save():
+            try:
+                return await coro
+            finally:
+                chat.state.save_to_disk()
+
+        chat_id = chat.state.id
+        task = asyncio.create_task(run_and_save())
+        self._tasks.setdefault(chat_id, set()).add(task)
+        self._chats[task] = chat
+        watcher = asyncio.create_task(self._cancel_on_disconnect(request, task)) if request else None
+        try:
+            return await task
+        except asyncio.CancelledError:
+            current_task = asyncio.current_task()
+            if current_task and current_task.cancelling():
+                # We are cancelled, not the run.
+                raise
+            raise RunCancelled()
+        finally:
+            if watcher:
+                watcher.cancel()
+            del self._chats[task]
+            tasks = self._tasks[chat_id]
+            tasks.discard(task)
+            if not tasks:
+                del self._tasks[chat_id]
+
+    async def cancel(self, chat_id: str) -> int:
+        """
+        Cancel all runs of the chat and wait until they are finished.
+        Returns the number of cancelled runs.
+        """
+        tasks = list(self._tasks.get(chat_id, []))
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            logger.info("Cancelling %d run(s) of chat %s", len(tasks), chat_id)
+            await asyncio.wait(tasks)
+        return len(tasks)
+
+    def is_running(self, chat_id: str) -> bool:
+        return chat_id in self._tasks
+
+    def in_progress(self) -> list[Chat]:
+        """Return the chats of the runs in progress."""
+        return list(self._chats.values())
+
+    async def _cancel_on_disconnect(self, request: Request, task: asyncio.Task):
+        while not task.done():
+            if await request.is_disconnected():
+                logger.info("Client disconnected, cancelling run")
+                task.cancel()
+                return
+            await asyncio.sleep(self.disconnect_poll_interval)
+
+
+class Submissions:
+    """
+    Recent messages submitted by clients, keyed by chat ID and message ID.
+    A retried request waits for the result of the first one instead of running the assistant again.
+
+    Entries expire after ttl seconds and the oldest entries are evicted above max_size, so the table stays small.
+    Retries of older messages are detected from the chat history instead.
+    """
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 600):
+        self.max_size = max_size
+        self.ttl = ttl
+        # Values are (submission time, future of the messages generated by the assistant)
+        self._entries: OrderedDict[tuple[str, str], tuple[float, asyncio.Future[Optional[list[Message]]]]] = (
+            OrderedDict()
+        )
+
+    def get(self, chat_id: str, message_id: str) -> Optional[asyncio.Future[Optional[list[Message]]]]:
+        """
+        Return the result of an earlier submission of the message, if it is recent.
+        The result is None if the run of the submission failed, so the message must be run again.
+        """
+        self._prune()
+        entry = self._entries.get((chat_id, message_id))
+        return entry[1] if entry else None
+
+    def add(self, chat_id: str, message_id: str) -> asyncio.Future[Optional[list[Message]]]:
+        """
+        Record a submission. Set the result of the returned future when the run finishes successfully.
+        Call discard if it fails.
+        """
+        future = asyncio.get_running_loop().create_future()
+        key = (chat_id, message_id)
+        self._entries[key] = (time.monotonic(), future)
+        self._entries.move_to_end(key)
+        self._prune()
+        return future
+
+    def discard(self, chat_id: str, message_id: str, future: asyncio.Future[Optional[list[Message]]]):
+        """Forget a submission whose run failed. Requests waiting for it get None."""
+        key = (chat_id, message_id)
+        entry = self._entries.get(key)
+        if entry and entry[1] is future:
+            del self._entries[key]
+        if not future.done():
+            future.set_result(None)
+
+    def _prune(self):
+        deadline = time.monotonic() - self.ttl
+        while self._entries:
+            submitted_at, future = next(iter(self._entries.values()))
+            if len(self._entries) <= self.max_size and (submitted_at > deadline or not future.done()):
+                return
+            self._entries.popitem(last=False)
+
+
+class RunStatus(StrEnum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class RunState(BaseModel):
+    """Run that is queued to be executed in the background. Saved to a file, so it survives restarts."""
+
+    id: str = Field(default_factory=generate_run_id)
+    chat_id: str
+    assistant: str
+    message: Message
+    status: RunStatus = RunStatus.QUEUED
+    created_at: datetime = Field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+    messages: list[Message] = []
+    """Messages generated by the assistant"""
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (RunStatus.COMPLETED, RunStatus.FAILED, RunStatus.CANCELLED)
+
+    @classmethod
+    def load_from_disk(cls, run_id: str):
+        with open(cls.file_path(run_id), "r") as f:
+            return cls.model_validate_json(f.read())
+
+    def save_to_disk(self):
+        os.makedirs("runs", exist_ok=True)
+        with open(self.file_path(self.id), "w") as f:
+            f.write(self.model_dump_json(indent=2))
+
+    def delete_from_disk(self):
+        try:
+            os.remove(self.file_path(self.id))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def file_path(id: str):
+        return os.path.join("runs", f"{id}.json")
+
+
+class _ChatRuns:
+    """Queued runs of a chat. Runs of a chat, queued or not, are executed one at a time."""
+
+    __slots__ = ("queued", "busy", "scheduled", "waiters")
+
+    def __init__(self):
+        self.queued: deque[RunState] = deque()
+        # A run of the chat is in progress
+        self.busy = False
+        # The chat is in the ready queue of the workers
+        self.scheduled = False
+        # Synchronous runs waiting for the chat. They go before queued runs.
+        self.waiters: deque[asyncio.Future[None]] = deque()
+
+
+class RunQueue:
+    """
+    Executes queued runs with a pool of workers. Runs of the same chat are executed in order.
+
+    Workers take the next run of a chat only when no other run of the chat is in progress,
+    so the runs queued for a busy chat do not hold workers that could execute runs of other chats.
+    Runs that are not queued take the chat with exclusive(), so they do not overwrite the state saved by queued runs.
+    """
+
+    def __init__(self, workers: int = 4, *, resume: bool = True, retention: timedelta = timedelta(days=1)):
+        """
+        Args:
+            workers: Number of runs executed concurrently
+            resume: If true, runs queued before a restart are executed. Otherwise, they are marked as failed.
+            retention: Finished runs are kept this long for status queries.
+        """
+        self.workers = workers
+        self.resume = resume
+        self.retention = retention
+        # IDs of chats that have queued runs and no run in progress
+        self._ready: asyncio.Queue[str] = asyncio.Queue()
+        self._chats: dict[str, _ChatRuns] = {}
+        self._runs: dict[str, RunState] = {}
+        # Run IDs keyed by chat ID and message ID, for detecting retried submissions
+        self._message_runs: dict[tuple[str, str], str] = {}
+        self._worker_tasks: list[asyncio.Task] = []
+        self._execute: Optional[Callable[[RunState], Coroutine[Any, Any, list[Message]]]] = None
+
+    async def start(self, execute: Callable[[RunState], Coroutine[Any, Any, list[Message]]]):
+        """
+        Start the workers. Runs left from the previous process are resumed or failed.
+
+        Args:
+            execute: Executes the run and returns the messages generated by the assistant.
+        """
+        self._execute = execute
+        self._recover()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info("Started %d run workers", self.workers)
+
+    async def stop(self):
+        """Stop the workers. Runs in progress are left as running and failed on next start."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def submit(self, run: RunState) -> RunState:
+        """Queue a run. Returns immediately."""
+        self._prune()
+        run.save_to_disk()
+        self._add(run)
+        self._enqueue(run)
+        logger.info("Queued run %s for chat %s", run.id, run.chat_id)
+        return run
+
+    def get(self, run_id: str) -> Optional[RunState]:
+        run = self._runs.get(run_id)
+        if run:
+            return run
+        try:
+            return RunState.load_from_disk(run_id)
+        except FileNotFoundError:
+            return None
+
+    def find(self, chat_id: str, message_id: str) -> Optional[RunState]:
+        """Return the run submitted for the message, if it is still kept."""
+        run_id = self._message_runs.get((chat_id, message_id))
+        return self._runs.get(run_id) if run_id else None
+
+    def _add(self, run: RunState):
+        self._runs[run.id] = run
+        self._message_runs[(run.chat_id, run.message.id)] = run.id
+
+    def cancel(self, chat_id: str) -> int:
+        """Cancel the queued runs of the chat. Returns the number of cancelled runs."""
+        cancelled = 0
+        for run in self._runs.values():
+            if run.chat_id == chat_id and run.status == RunStatus.QUEUED:
+                self._finish(run, RunStatus.CANCELLED)
+                cancelled += 1
+        return cancelled
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self, chat_id: str) -> AsyncIterator[None]:
+        """
+        Wait until no run of the chat is in progress and keep queued runs of the chat from starting in the block.
+        Load the chat state in the block, because the state loaded before may be changed by a queued run.
+        """
+        chat = self._chats.setdefault(chat_id, _ChatRuns())
+        if chat.busy:
+            waiter = asyncio.get_running_loop().create_future()
+            chat.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if not waiter.cancelled():
+                    # The chat was handed to us after we were cancelled.
+                    self._release(chat_id)
+                raise
+        else:
+            chat.busy = True
+        try:
+            yield
+        finally:
+            self._release(chat_id)
+
+    def _enqueue(self, run: RunState):
+        self._chats.setdefault(run.chat_id, _ChatRuns()).queued.append(run)
+        self._schedule(run.chat_id)
+
+    def _schedule(self, chat_id: str):
+        """Put the chat in the ready queue if it has queued runs and is free."""
+        chat = self._chats.get(chat_id)
+        if not chat or chat.busy or chat.scheduled or chat.waiters:
+            return
+        if not chat.queued:
+            del self._chats[chat_id]
+            return
+        chat.scheduled = True
+        self._ready.put_nowait(chat_id)
+
+    def _release(self, chat_id: str):
+        """Hand the chat to the next synchronous run, or schedule its next queued run."""
+        chat = self._chats[chat_id]
+        while chat.waiters:
+            waiter = chat.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        chat.busy = False
+        self._schedule(chat_id)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            chat = self._chats[chat_id]
+            chat.scheduled = False
+            if chat.busy:
+                # Taken by a synchronous run after it was scheduled. Scheduled again when released.
+                continue
+            chat.busy = True
+            try:
+                run = chat.queued.popleft()
+                # Skipped if cancelled while queued
+                if run.status == RunStatus.QUEUED:
+                    await self._run(run)
+            finally:
+                self._release(chat_id)
+
+    async def _run(self, run: RunState):
+        assert self._execute
+        run.status = RunStatus.RUNNING
+        run.started_at = datetime.now()
+        run.save_to_disk()
+        try:
+            run.messages = await self._execute(run)
+        except RunCancelled:
+            self._finish(run, RunStatus.CANCELLED)
+        except Exception as e:
+            self._finish(run, RunStatus.FAILED, error=str(e))
+        else:
+            self._finish(run, RunStatus.COMPLETED)
+
+    def _finish(self, run: RunState, status: RunStatus, *, error: Optional[str] = None):
+        run.status = status
+        run.error = error
+        run.finished_at = datetime.now()
+        run.save_to_disk()
+        logger.info("Run %s %s", run.id, status)
+
+    def _recover(self):
+        if not os.path.isdir("runs"):
+            return
+        runs = []
+        for filename in os.listdir("runs"):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                runs.append(RunState.load_from_disk(filename[:-5]))
+            except Exception as e:
+                logger.error("Error loading run %s: %s", filename, e)
+
+        for run in sorted(runs, key=lambda run: run.created_at):
+            if run.status == RunStatus.RUNNING:
+                # We cannot know how far it went. Running it again may duplicate messages.
+                self._add(run)
+                self._finish(run, RunStatus.FAILED, error="Interrupted by server restart")
+            elif run.status == RunStatus.QUEUED:
+                self._add(run)
+                if self.resume:
+                    logger.info("Resuming run %s", run.id)
+                    self._enqueue(run)
+                else:
+                    self._finish(run, RunStatus.FAILED, error="Server restarted before the run started")
+            elif not self._expired(run):
+                self._add(run)
+            else:
+                run.delete_from_disk()
+
+    def _prune(self):
+        """Forget finished runs older than retention."""
+        for run in [run for run in self._runs.values() if self._expired(run)]:
+            del self._runs[run.id]
+            self._message_runs.pop((run.chat_id, run.message.id), None)
+            run.delete_from_disk()
+
+    def _expired(self, run: RunState) -> bool:
+        return run.finished and run.finished_at is not None and datetime.now() - run.finished_at > self.retention
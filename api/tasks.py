@@ -3,13 +3,15 @@
 from pydantic import BaseModel
 
 from akson import Assistant, Chat, ChatState
-from framework import LLMAssistant
+from framework.scheduler import Priority
 
 
 async def update_title(chat: Chat):
     if chat.state.title:
         return
 
+    from framework import LLMAssistant
+
     class TitleResponse(BaseModel):
         title: str
 
@@ -18,6 +20,7 @@ async def update_title(chat: Chat):
         model="gpt-4.1-nano",
         system_prompt="Analyze the conversation and output a title for the conversation.",
         output_type=TitleResponse,
+        priority=Priority.BACKGROUND,
     )
 
     temp = Chat()
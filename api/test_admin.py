@@ -0,0 +1,123 @@
+import os
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi import FastAPI
+
+import admin
+from run_profiler import profiler
+
+TOKEN = "secret"
+HEADERS = {"Authorization": f"Bearer {TOKEN}"}
+
+
+@pytest_asyncio.fixture
+async def client(data_dir, monkeypatch):
+    """Client of an app with only the admin routes."""
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", TOKEN)
+    app = FastAPI()
+    admin.setup_routes(app)
+
+    @app.get("/hello")
+    async def hello():
+        return "Hello"
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+@pytest.mark.asyncio
+async def test_token_is_required(client):
+    assert (await client.get("/admin/profiles")).status_code == 401
+    response = await client.get("/admin/profiles", headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_profile_process(client):
+    response = await client.post("/admin/profile", params={"seconds": 0.05, "mode": "cprofile"}, headers=HEADERS)
+    assert response.status_code == 200
+    profile = response.json()["profile"]
+    assert profile.endswith("-process.prof")
+
+    assert (await client.get("/admin/profiles", headers=HEADERS)).json() == [profile]
+    response = await client.get(f"/admin/profiles/{profile}", headers=HEADERS)
+    assert response.status_code == 200
+    with open(os.path.join("profiles", profile), "rb") as f:
+        assert response.content == f.read()
+    assert (await client.get("/admin/profiles/missing.prof", headers=HEADERS)).status_code == 404
+
+
+@pytest.mark.parametrize("seconds", [0, -1, admin.MAX_PROFILE_SECONDS + 1])
+@pytest.mark.asyncio
+async def test_profile_process_seconds_are_limited(client, seconds):
+    response = await client.post("/admin/profile", params={"seconds": seconds}, headers=HEADERS)
+    assert response.status_code == 422
+    assert profiler.active is None
+
+
+@pytest.mark.asyncio
+async def test_profile_process_while_busy(client):
+    with profiler.capture("other"):
+        response = await client.post("/admin/profile", params={"seconds": 0.01}, headers=HEADERS)
+    assert response.status_code == 409
+
+
+@pytest.mark.asyncio
+async def test_profile_request(client):
+    response = await client.get("/hello", headers={admin.PROFILE_HEADER: TOKEN, admin.PROFILE_MODE_HEADER: "cprofile"})
+    assert response.json() == "Hello"
+    profile = response.headers[admin.PROFILE_HEADER]
+    assert profile.endswith("-request-_hello.prof")
+    assert profiler.list_profiles() == [profile]
+
+    # Not profiled without the right token
+    response = await client.get("/hello", headers={admin.PROFILE_HEADER: "wrong"})
+    assert admin.PROFILE_HEADER not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_profile_assistant(client):
+    response = await client.post("/admin/profile/assistants/Echo", params={"runs": 2}, headers=HEADERS)
+    assert response.json() == {"assistant": "Echo", "runs": 2, "mode": "sample"}
+    assert profiler.armed.pop("echo") == (2, "sample")
+
+
+@pytest.mark.asyncio
+async def test_memory_report(client):
+    response = await client.get("/admin/memory", headers=HEADERS)
+    assert response.status_code == 200
+    keys = {"rss", "peak_rss", "tracemalloc", "gc_objects", "chats", "topics", "runs", "mcp_sessions", "tasks"}
+    assert keys <= set(response.json())
+
+
+@pytest_asyncio.fixture
+async def tracing(client):
+    yield
+    await client.post("/admin/memory/tracemalloc/stop", headers=HEADERS)
+
+
+@pytest.mark.asyncio
+async def test_memory_snapshots(client, tracing):
+    response = await client.post("/admin/memory/snapshots", headers=HEADERS)
+    assert response.status_code == 409
+
+    response = await client.post("/admin/memory/tracemalloc/start", headers=HEADERS)
+    assert response.json() == {"tracing": True}
+    old = (await client.post("/admin/memory/snapshots", params={"limit": 3}, headers=HEADERS)).json()
+    assert len(old["top"]) == 3
+    leak = [bytearray(1000) for _ in range(100)]
+    new = (await client.post("/admin/memory/snapshots", headers=HEADERS)).json()
+
+    listed = (await client.get("/admin/memory/snapshots", headers=HEADERS)).json()
+    assert [item["id"] for item in listed][-2:] == [old["id"], new["id"]]
+    response = await client.get(f"/admin/memory/snapshots/{old['id']}/diff/{new['id']}", headers=HEADERS)
+    assert response.json()[0]["bytes_diff"] >= 100 * 1000
+    del leak
+    response = await client.get(f"/admin/memory/snapshots/0/diff/{new['id']}", headers=HEADERS)
+    assert response.status_code == 404
+
+    response = await client.post("/admin/memory/tracemalloc/stop", headers=HEADERS)
+    assert response.json() == {"tracing": False}
+    assert (await client.get("/admin/memory/snapshots", headers=HEADERS)).json() == []
@@ -0,0 +1,113 @@
+import pytest
+
+from akson import Chat, ChatState, Usage
+
+
+def _chat(events: list[dict]) -> Chat:
+    async def publish(message: dict):
+        events.append(message)
+
+    return Chat(publisher=publish)
+
+
+@pytest.mark.asyncio
+async def test_reply_buffers_chunks():
+    events = []
+    chat = _chat(events)
+    reply = await chat.reply("assistant", name="Test")
+    await reply.add_chunk("Hello")
+    await reply.add_chunk(", world")
+
+    # Chunks are published as they are added, but the message is built at the end.
+    assert [event["chunk"] for event in events if event["type"] == "add_chunk"] == ["Hello", ", world"]
+    assert reply.message.content == ""
+    assert chat.state.messages == []
+
+    await reply.end()
+    assert reply.message.content == "Hello, world"
+    assert chat.state.messages == [reply.message]
+    assert chat.new_messages == [reply.message]
+    assert events[-1] == {"type": "end_message", "id": reply.message.id}
+
+
+@pytest.mark.asyncio
+async def test_reply_snapshot():
+    chat = Chat()
+    reply = await chat.reply("assistant", name="Test")
+    await reply.add_chunk("Let me ")
+    await reply.add_chunk("call_1", field="tool_call.id")
+    await reply.add_chunk("search", field="tool_call.name")
+    await reply.add_chunk('{"query": ', field="tool_call.arguments")
+
+    snapshot = reply.snapshot()
+    assert snapshot.content == "Let me "
+    assert snapshot.tool_call and snapshot.tool_call.arguments == '{"query": '
+
+    # Chunks after a snapshot are added to the chunks before it.
+    await reply.add_chunk("check")
+    await reply.add_chunk('"news"}', field="tool_call.arguments")
+    assert reply.snapshot().content == "Let me check"
+    # Snapshots are copies
+    assert snapshot.content == "Let me "
+
+    await reply.end()
+    assert reply.message.content == "Let me check"
+    assert reply.message.tool_call
+    assert reply.message.tool_call.id == "call_1"
+    assert reply.message.tool_call.name == "search"
+    assert reply.message.tool_call.arguments == '{"query": "news"}'
+
+
+@pytest.mark.asyncio
+async def test_reply_discard_tool_call():
+    chat = Chat()
+    reply = await chat.reply("assistant", name="Test")
+    await reply.add_chunk("Searching")
+    await reply.add_chunk("call_1", field="tool_call.id")
+    await reply.add_chunk("search", field="tool_call.name")
+    reply.snapshot()
+    await reply.add_chunk('{"que', field="tool_call.arguments")
+
+    reply.discard_tool_call()
+    await reply.end()
+    assert reply.message.content == "Searching"
+    assert reply.message.tool_call is None
+
+
+@pytest.mark.asyncio
+async def test_tool_reply():
+    chat = Chat()
+    reply = await chat.reply("tool", name="Test")
+    await reply.add_chunk("call_1", field="tool_call_id")
+    await reply.add_chunk("Result")
+    await reply.end()
+    assert reply.message.tool_call_id == "call_1"
+    assert reply.message.content == "Result"
+    assert reply.message.tool_call is None
+
+
+def test_usage_add():
+    usage = Usage(prompt_tokens=10, completion_tokens=5, cached_tokens=2)
+    usage.add(Usage(prompt_tokens=3, completion_tokens=1))
+    assert (usage.prompt_tokens, usage.completion_tokens, usage.cached_tokens) == (13, 6, 2)
+    assert usage.total_tokens == 19
+    assert not usage.estimated
+
+    usage.add(Usage(prompt_tokens=1, estimated=True))
+    usage.add(Usage(prompt_tokens=1))
+    # Stays estimated once part of the tokens were estimated
+    assert usage.estimated
+    assert usage.total_tokens == 21
+
+
+def test_chat_add_usage():
+    state = ChatState(usage=Usage(prompt_tokens=100, completion_tokens=50))
+    chat = Chat(state=state)
+    chat.add_usage(Usage(prompt_tokens=10, completion_tokens=5))
+    chat.add_usage(Usage(prompt_tokens=20, completion_tokens=5, cached_tokens=8))
+
+    # Usage of the run
+    assert (chat.usage.prompt_tokens, chat.usage.completion_tokens, chat.usage.cached_tokens) == (30, 10, 8)
+    # Total of the chat, saved with the state
+    assert (state.usage.prompt_tokens, state.usage.completion_tokens, state.usage.cached_tokens) == (130, 60, 8)
+    assert ChatState.model_validate_json(state.model_dump_json()).usage == state.usage
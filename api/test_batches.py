@@ -0,0 +1,165 @@
+import asyncio
+import json
+
+import pytest
+
+import batches
+from batches import Batch, Batches, BatchRequest, BatchStatus, parse_requests
+from openai_compat import (
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+    Choice,
+    Message,
+    _new_response,
+)
+
+
+def _line(custom_id: str, content: str = "Hi", **fields) -> str:
+    body = {"model": "Echo", "messages": [{"role": "user", "content": content}]}
+    return json.dumps({"custom_id": custom_id, "body": body, **fields})
+
+
+def _requests(*contents: str) -> list[BatchRequest]:
+    return parse_requests("\n".join(_line(f"request-{i}", content) for i, content in enumerate(contents)).encode())
+
+
+class Completions:
+    """Replaces create_completion. Requests wait until they are released by the test, "fail" raises an error."""
+
+    def __init__(self):
+        self.started: list[str] = []
+        self._release: dict[str, asyncio.Event] = {}
+
+    def release(self, content: str):
+        self._release.setdefault(content, asyncio.Event()).set()
+
+    async def __call__(self, request: ChatCompletionRequest) -> ChatCompletionResponse:
+        content = request.messages[-1].content
+        self.started.append(content)
+        await self._release.setdefault(content, asyncio.Event()).wait()
+        if content == "fail":
+            raise ValueError("Provider is down")
+        response = _new_response(request.model)
+        response.choices = [
+            Choice(index=0, message=Message(role="assistant", content=f"Reply to {content}"), finish_reason="stop")
+        ]
+        return response
+
+
+@pytest.fixture
+def completions(data_dir, monkeypatch):
+    completions = Completions()
+    monkeypatch.setattr(batches, "create_completion", completions)
+    return completions
+
+
+async def _wait_for(condition, timeout: float = 1):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.001)
+
+
+def test_parse_requests():
+    content = f"{_line('a')}\n\n{_line('b', 'Hello')}\n".encode()
+    requests = parse_requests(content)
+    assert [request.custom_id for request in requests] == ["a", "b"]
+    assert requests[1].body.messages[0].content == "Hello"
+
+
+@pytest.mark.parametrize(
+    "content, error",
+    [
+        (f"{_line('a')}\n{_line('a')}", "Line 2: Duplicate custom_id a"),
+        (_line("a", url="/v1/embeddings"), "Line 1: Unsupported url /v1/embeddings"),
+        (f"{_line('a')}\nnot json", "Line 2: "),
+        ('{"custom_id": "a"}', "Line 1: "),
+        ("", "Batch is empty"),
+        ("\n  \n", "Batch is empty"),
+    ],
+)
+def test_parse_invalid_requests(content, error):
+    with pytest.raises(ValueError) as e:
+        parse_requests(content.encode())
+    assert str(e.value).startswith(error)
+
+
+def test_parse_too_many_requests(monkeypatch):
+    monkeypatch.setattr(batches, "BATCH_MAX_REQUESTS", 1)
+    with pytest.raises(ValueError, match="more than 1 requests"):
+        parse_requests(f"{_line('a')}\n{_line('b')}".encode())
+
+
+@pytest.mark.asyncio
+async def test_results_are_streamed_while_running(completions):
+    runner = Batches(workers=2)
+    batch = runner.submit(_requests("first", "fail", "third"))
+    results = runner.results(batch.id)
+    await _wait_for(lambda: completions.started == ["first", "fail"])
+
+    completions.release("fail")
+    assert json.loads(await anext(results))["error"] == {"code": "ValueError", "message": "Provider is down"}
+    completions.release("first")
+    completions.release("third")
+    lines = b"".join([chunk async for chunk in results]).splitlines()
+
+    assert sorted(json.loads(line)["custom_id"] for line in lines) == ["request-0", "request-2"]
+    body = json.loads(lines[-1])["response"]["body"]
+    assert body["choices"][0]["message"]["content"] == "Reply to third"
+    assert (batch.status, batch.completed, batch.failed) == (BatchStatus.COMPLETED, 2, 1)
+    assert Batch.load_from_disk(batch.id).status == BatchStatus.COMPLETED
+
+    # Results of a finished batch are read from the file
+    assert len(b"".join([chunk async for chunk in runner.results(batch.id)]).splitlines()) == 3
+
+
+@pytest.mark.asyncio
+async def test_workers_are_shared_by_batches(completions):
+    runner = Batches(workers=1)
+    first = runner.submit(_requests("a1", "a2"))
+    second = runner.submit(_requests("b1"))
+    await _wait_for(lambda: completions.started == ["a1"])
+    await asyncio.sleep(0.01)
+    assert completions.started == ["a1"]
+
+    for content in ("a1", "a2", "b1"):
+        completions.release(content)
+    await _wait_for(lambda: first.finished and second.finished)
+    assert sorted(completions.started) == ["a1", "a2", "b1"]
+
+
+@pytest.mark.asyncio
+async def test_cancel(completions):
+    runner = Batches(workers=1)
+    batch = runner.submit(_requests("first", "second"))
+    results = runner.results(batch.id)
+    completions.release("first")
+    assert json.loads(await anext(results))["custom_id"] == "request-0"
+    await _wait_for(lambda: completions.started == ["first", "second"])
+
+    assert runner.cancel(batch.id)
+    # The readers of the results end with the batch
+    assert [chunk async for chunk in results] == []
+    assert (batch.status, batch.completed) == (BatchStatus.CANCELLED, 1)
+    assert batch.finished_at
+    saved = runner.get(batch.id)
+    assert saved and saved.status == BatchStatus.CANCELLED
+    assert not runner.cancel(batch.id)
+
+
+@pytest.mark.asyncio
+async def test_status_after_restart(completions):
+    interrupted = Batch(total=2, completed=1)
+    interrupted.save_to_disk()
+    finished = Batch(total=1, completed=1, status=BatchStatus.COMPLETED)
+    finished.save_to_disk()
+
+    runner = Batches()
+    batch = runner.get(interrupted.id)
+    assert batch and batch.status == BatchStatus.FAILED
+    assert batch.error == "Interrupted by server restart"
+    assert batch.completed == 1
+    assert Batch.load_from_disk(interrupted.id).status == BatchStatus.FAILED
+    batch = runner.get(finished.id)
+    assert batch and batch.status == BatchStatus.COMPLETED
+    assert runner.get("unknown") is None
+    assert not runner.cancel(interrupted.id)
@@ -0,0 +1,95 @@
+import ast
+
+import pytest
+
+from loader import _class_name, _name_argument, scan_names
+
+CLASSES = ("LLMAssistant", "Router")
+IGNORE = ("MCPToolkit",)
+
+
+def _scan(data_dir, source: str):
+    (data_dir / "assistants").mkdir(exist_ok=True)
+    (data_dir / "assistants" / "module.py").write_text(source)
+    return scan_names("assistants", classes=CLASSES, ignore=IGNORE)["assistants.module"]
+
+
+def _call(source: str) -> ast.Call:
+    value = ast.parse(source, mode="eval").body
+    assert isinstance(value, ast.Call)
+    return value
+
+
+@pytest.mark.parametrize(
+    "source, name",
+    [
+        ("LLMAssistant()", "LLMAssistant"),
+        ("framework.LLMAssistant()", "LLMAssistant"),
+        ("MCPToolkit.from_config('server')", "MCPToolkit"),
+        ("create().build()", "build"),
+        ("factories[0]()", None),
+    ],
+)
+def test_class_name(source, name):
+    assert _class_name(_call(source).func) == name
+
+
+@pytest.mark.parametrize(
+    "source, name",
+    [
+        ("LLMAssistant(name='Keyword')", "Keyword"),
+        ("LLMAssistant('Positional', model='gpt-4.1')", "Positional"),
+        ("LLMAssistant(NAME)", None),
+        ("LLMAssistant(name=f'{prefix}Bot')", None),
+        ("LLMAssistant(model='gpt-4.1')", None),
+    ],
+)
+def test_name_argument(source, name):
+    assert _name_argument(_call(source)) == name
+
+
+def test_scan_names(data_dir):
+    source = """
+import os
+
+from framework import LLMAssistant, MCPToolkit, Router
+
+PROMPT = "You are helpful."
+MODELS = {"fast": "gpt-4.1-nano"}
+timeout: float
+tools = MCPToolkit.from_config("server")
+first = LLMAssistant(name="First", system_prompt=PROMPT)
+second: LLMAssistant = Router("Second")
+
+
+def helper():
+    value = LLMAssistant(name="Hidden")
+    return value
+
+
+if __debug__:
+    print("loaded")
+"""
+    assert _scan(data_dir, source) == ["First", "Second"]
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "x = A() if flag else B()",
+        "x = flag and LLMAssistant(name='Name')",
+        "x = other_assistant",
+        "x = module.assistant",
+        "x = Custom(name='Name')",
+        "x = LLMAssistant(name=NAME)",
+        "if flag:\n    x = LLMAssistant(name='Name')",
+        "try:\n    x = LLMAssistant(name='Name')\nexcept ImportError:\n    pass",
+        "for x in assistants:\n    pass",
+        "with open('f') as f:\n    pass",
+        "x += y",
+        "print(x := LLMAssistant(name='Name'))",
+        "def broken(:",
+    ],
+)
+def test_scan_cannot_resolve(data_dir, source):
+    assert _scan(data_dir, source) is None
@@ -0,0 +1,414 @@
+import asyncio
+
+import httpx
+import pytest
+import pytest_asyncio
+
+import deps
+import main
+import tasks
+from akson import Assistant, Chat, ChatState, Message
+from registry import Registry
+from runs import RunCancelled, RunManager, RunQueue, RunState, Submissions
+
+
+class Slow(Assistant):
+    """Replies with a partial message and waits until cancelled."""
+
+    def __init__(self):
+        super().__init__()
+        self.started = asyncio.Event()
+
+    async def run(self, chat: Chat) -> None:
+        reply = await chat.reply("assistant", name=self.name)
+        await reply.add_chunk("partial")
+        await reply.end()
+        self.started.set()
+        await asyncio.sleep(3600)
+
+
+class Echo(Assistant):
+    """Repeats the last user message when the gate is open. Fails the given number of runs."""
+
+    def __init__(self):
+        super().__init__()
+        self.started = asyncio.Event()
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+        self.runs = 0
+        self.failures = 0
+
+    async def run(self, chat: Chat) -> None:
+        self.runs += 1
+        self.started.set()
+        await self.gate.wait()
+        if self.failures:
+            self.failures -= 1
+            raise Exception("Provider is down")
+        reply = await chat.reply("assistant", name=self.name)
+        await reply.add_chunk(f"Reply to {chat.state.messages[-1].content}")
+        await reply.end()
+
+
+async def _skip_title(_):
+    pass
+
+
+@pytest.fixture
+def app_deps(data_dir, monkeypatch):
+    """Replace the shared dependencies of the app with fresh ones in a temporary directory."""
+    (data_dir / "assistants").mkdir()
+    (data_dir / "chats").mkdir()
+    registry = Registry()
+    monkeypatch.setattr(deps, "registry", registry)
+    monkeypatch.setattr(deps, "runs", RunManager())
+    monkeypatch.setattr(deps, "run_queue", RunQueue(resume=False))
+    monkeypatch.setattr(deps, "submissions", Submissions())
+    # Titles are generated by a real model
+    monkeypatch.setattr(tasks, "update_title", _skip_title)
+    return registry
+
+
+@pytest_asyncio.fixture
+async def client(app_deps):
+    """Client of the app. The run queue is not started, because the lifespan of the app is not run."""
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+    await deps.run_queue.stop()
+
+
+def _contents(messages) -> list[str]:
+    return [message.content if isinstance(message, Message) else message["content"] for message in messages]
+
+
+@pytest.mark.asyncio
+async def test_stop_command(app_deps):
+    slow = Slow()
+    app_deps.register(slow)
+    chat = deps.get_chat("chat")
+    task = asyncio.create_task(deps.runs.run(chat, slow.run(chat)))
+    await slow.started.wait()
+    deps.run_queue.submit(RunState(chat_id="chat", assistant="Slow", message=Message(role="user", content="Next")))
+
+    command_chat = deps.get_chat("chat")
+    messages = await main.handle_command(command_chat, "/stop")
+
+    assert messages[0].content == "Stopped 2 run(s)"
+    with pytest.raises(RunCancelled):
+        await task
+    # The partial reply saved by the cancelled run is not overwritten by the stale state of the command.
+    assert [message.content for message in command_chat.state.messages] == ["partial"]
+    assert [run.status for run in deps.run_queue._runs.values()] == ["cancelled"]
+    assert ChatState.load_from_disk("chat").messages[0].content == "partial"
+
+
+@pytest.mark.asyncio
+async def test_synchronous_run_waits_for_queued_run(app_deps, client):
+    echo = Echo()
+    app_deps.register(echo)
+    await deps.run_queue.start(main.execute_run)
+    echo.gate.clear()
+    response = await client.post("/chats/chat/messages", json={"content": "queued", "assistant": "Echo", "wait": False})
+    assert response.status_code == 202
+    await echo.started.wait()
+
+    synchronous = asyncio.create_task(
+        client.post("/chats/chat/messages", json={"content": "sync", "assistant": "Echo"})
+    )
+    await asyncio.sleep(0.05)
+    assert not synchronous.done()
+
+    echo.gate.set()
+    response = await synchronous
+    assert _contents(response.json()) == ["Reply to sync"]
+    # Messages of the queued run are not overwritten by the synchronous run.
+    assert _contents(ChatState.load_from_disk("chat").messages) == [
+        "queued",
+        "Reply to queued",
+        "sync",
+        "Reply to sync",
+    ]
+    run = deps.run_queue.find("chat", ChatState.load_from_disk("chat").messages[0].id)
+    assert run and run.status == "completed"
+
+
+@pytest.mark.asyncio
+async def test_duplicate_of_pending_message(app_deps, client):
+    echo = Echo()
+    app_deps.register(echo)
+    echo.gate.clear()
+    message = {"id": "msg1", "content": "Hello", "assistant": "Echo"}
+    first = asyncio.create_task(client.post("/chats/chat/messages", json=message))
+    await echo.started.wait()
+    second = asyncio.create_task(client.post("/chats/chat/messages", json=message))
+    await asyncio.sleep(0.01)
+
+    echo.gate.set()
+    responses = await asyncio.gather(first, second)
+    assert responses[0].json() == responses[1].json()
+    assert _contents(responses[1].json()) == ["Reply to Hello"]
+    assert echo.runs == 1
+
+
+@pytest.mark.asyncio
+async def test_duplicate_of_queued_message(app_deps, client):
+    app_deps.register(Echo())
+    message = {"id": "msg1", "content": "Hello", "assistant": "Echo", "wait": False}
+    first = await client.post("/chats/chat/messages", json=message)
+    second = await client.post("/chats/chat/messages", json=message)
+    assert first.status_code == second.status_code == 202
+    assert first.json()["id"] == second.json()["id"]
+
+    # Not a duplicate once the queued run is cancelled
+    deps.run_queue.cancel("chat")
+    third = await client.post("/chats/chat/messages", json=message)
+    assert third.status_code == 202
+    assert third.json()["id"] != first.json()["id"]
+
+
+@pytest.mark.asyncio
+async def test_duplicate_in_history(app_deps, client, monkeypatch):
+    echo = Echo()
+    app_deps.register(echo)
+    message = {"id": "msg1", "content": "Hello", "assistant": "Echo"}
+    first = await client.post("/chats/chat/messages", json=message)
+    # Submissions are forgotten after a while, the history is checked then.
+    monkeypatch.setattr(deps, "submissions", Submissions())
+    second = await client.post("/chats/chat/messages", json=message)
+    assert second.json() == first.json()
+    assert echo.runs == 1
+    assert _contents(ChatState.load_from_disk("chat").messages) == ["Hello", "Reply to Hello"]
+
+
+@pytest.mark.parametrize("forget", [False, True])
+@pytest.mark.asyncio
+async def test_failed_message_is_run_again(app_deps, client, monkeypatch, forget):
+    echo = Echo()
+    echo.failures = 1
+    app_deps.register(echo)
+    message = {"id": "msg1", "content": "Hello", "assistant": "Echo"}
+    first = await client.post("/chats/chat/messages", json=message)
+    assert first.status_code == 500
+    assert [m.name for m in ChatState.load_from_disk("chat").messages] == [None, main.ERROR_REPLY_NAME]
+    if forget:
+        monkeypatch.setattr(deps, "submissions", Submissions())
+
+    second = await client.post("/chats/chat/messages", json=message)
+    assert second.status_code == 200
+    assert _contents(second.json()) == ["Reply to Hello"]
+    assert echo.runs == 2
+    # The failed attempt is replaced
+    messages = ChatState.load_from_disk("chat").messages
+    assert [(m.id, m.content) for m in messages] == [("msg1", "Hello"), (second.json()[0]["id"], "Reply to Hello")]
+
+
+@pytest.mark.asyncio
+async def test_waiting_duplicate_of_failed_message_runs_it_again(app_deps, client):
+    echo = Echo()
+    echo.failures = 1
+    echo.gate.clear()
+    app_deps.register(echo)
+    message = {"id": "msg1", "content": "Hello", "assistant": "Echo"}
+    first = asyncio.create_task(client.post("/chats/chat/messages", json=message))
+    await echo.started.wait()
+    second = asyncio.create_task(client.post("/chats/chat/messages", json=message))
+    await asyncio.sleep(0.01)
+
+    echo.gate.set()
+    assert (await first).status_code == 500
+    response = await second
+    assert _contents(response.json()) == ["Reply to Hello"]
+    assert echo.runs == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_queued_message_is_run_again(app_deps, client):
+    echo = Echo()
+    echo.failures = 1
+    app_deps.register(echo)
+    await deps.run_queue.start(main.execute_run)
+    message = {"id": "msg1", "content": "Hello", "assistant": "Echo", "wait": False}
+    first = (await client.post("/chats/chat/messages", json=message)).json()
+    await _wait_for_run(first["id"])
+
+    second = (await client.post("/chats/chat/messages", json=message)).json()
+    assert second["id"] != first["id"]
+    run = await _wait_for_run(second["id"])
+    assert run.status == "completed"
+    assert _contents(ChatState.load_from_disk("chat").messages) == ["Hello", "Reply to Hello"]
+
+
+async def _wait_for_run(run_id: str) -> RunState:
+    async with asyncio.timeout(1):
+        while True:
+            run = deps.run_queue.get(run_id)
+            if run and run.finished:
+                return run
+            await asyncio.sleep(0.001)
+
+
+class Parrot(Echo):
+    """Another Echo, so fan out has more than one assistant."""
+
+
+def _fan_out_registry(app_deps, failures: int = 0) -> tuple[Echo, Parrot]:
+    echo, parrot = Echo(), Parrot()
+    parrot.failures = failures
+    app_deps.register(echo)
+    app_deps.register(parrot)
+    return echo, parrot
+
+
+@pytest.mark.asyncio
+async def test_all_command(app_deps):
+    _fan_out_registry(app_deps)
+    chat = deps.get_chat("chat")
+    messages = await main.handle_command(chat, "/all First line\n\n  indented line\n")
+
+    question = "First line\n\n  indented line\n"
+    # Each assistant sees the question but not the replies of the others
+    assert _contents(messages) == [f"Reply to {question}"] * 2
+    assert [message.name for message in messages] == ["Echo", "Parrot"]
+    assert _contents(chat.state.messages) == [question, f"Reply to {question}", f"Reply to {question}"]
+
+
+@pytest.mark.asyncio
+async def test_ask_command(app_deps):
+    echo, parrot = _fan_out_registry(app_deps)
+    chat = deps.get_chat("chat")
+    messages = await main.handle_command(chat, "/ask Parrot  Hello\nthere")
+
+    assert _contents(messages) == ["Reply to Hello\nthere"]
+    assert (echo.runs, parrot.runs) == (0, 1)
+
+    with pytest.raises(Exception, match="Usage"):
+        await main.handle_command(chat, "/ask Parrot")
+
+
+@pytest.mark.asyncio
+async def test_fan_out_continues_when_an_assistant_fails(app_deps):
+    echo, parrot = _fan_out_registry(app_deps, failures=1)
+    chat = deps.get_chat("chat")
+    messages = await main.fan_out(chat, [parrot, echo], "Hello")
+
+    assert [message.name for message in messages] == [main.ERROR_REPLY_NAME, "Echo"]
+    assert _contents(messages)[1] == "Reply to Hello"
+    assert chat.state.messages[1:] == messages
+
+
+@pytest.mark.asyncio
+async def test_branch_adds_fields_to_published_messages(app_deps):
+    echo = Echo()
+    events: list[dict] = []
+
+    async def publish(message: dict):
+        events.append(message)
+
+    async def publish_many(messages: list[dict]):
+        events.extend(messages)
+
+    chat = Chat(state=ChatState(id="chat"), publisher=publish, batch_publisher=publish_many)
+    chat.state.messages.append(Message(role="user", content="Hello"))
+    replies = await main.generate_candidates(chat, echo, 2)
+
+    assert [_contents(reply) for reply in replies] == [["Reply to Hello"], ["Reply to Hello"]]
+    assert {event["candidate"] for event in events} == {0, 1}
+    # The original chat has the first candidate
+    assert chat.state.messages[1:] == replies[0]
+
+
+class Numbered(Echo):
+    """Numbers its replies, so candidates of a retry are different."""
+
+    async def run(self, chat: Chat) -> None:
+        self.runs += 1
+        number = self.runs
+        self.started.set()
+        await self.gate.wait()
+        reply = await chat.reply("assistant", name=self.name)
+        await reply.add_chunk(f"Reply {number}")
+        await reply.end()
+
+
+async def _retry_with_candidates(client, count: int) -> list[list[dict]]:
+    first = await client.post("/chats/chat/messages", json={"content": "Hello", "assistant": "Numbered"})
+    response = await client.post(f"/chats/chat/messages/{first.json()[0]['id']}/retry?candidates={count}")
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.mark.asyncio
+async def test_retry_with_candidates_and_select(app_deps, client):
+    app_deps.register(Numbered())
+    candidates = await _retry_with_candidates(client, 3)
+
+    assert sorted(_contents(replies)[0] for replies in candidates) == ["Reply 2", "Reply 3", "Reply 4"]
+    state = ChatState.load_from_disk("chat")
+    # The first candidate is kept until another one is selected
+    assert _contents(state.messages) == ["Hello", _contents(candidates[0])[0]]
+    assert state.candidates and len(state.candidates.replies) == 3
+
+    response = await client.post("/chats/chat/candidates/2/select")
+    assert response.json() == candidates[2]
+    state = ChatState.load_from_disk("chat")
+    assert _contents(state.messages) == ["Hello", _contents(candidates[2])[0]]
+    assert state.candidates is None
+    assert (await client.post("/chats/chat/candidates/0/select")).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_retry_candidates_are_limited(app_deps, client):
+    app_deps.register(Numbered())
+    first = await client.post("/chats/chat/messages", json={"content": "Hello", "assistant": "Numbered"})
+    response = await client.post(f"/chats/chat/messages/{first.json()[0]['id']}/retry?candidates=100")
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_select_after_history_changed(app_deps, client):
+    app_deps.register(Numbered())
+    candidates = await _retry_with_candidates(client, 2)
+    await client.delete(f"/chats/chat/messages/{candidates[0][0]['id']}")
+
+    response = await client.post("/chats/chat/candidates/1/select")
+    assert response.status_code == 409
+    state = ChatState.load_from_disk("chat")
+    assert _contents(state.messages) == ["Hello"]
+    assert state.candidates is None
+
+
+@pytest.mark.asyncio
+async def test_candidates_are_pruned_when_chat_continues(app_deps, client):
+    app_deps.register(Numbered())
+    candidates = await _retry_with_candidates(client, 2)
+    await client.post("/chats/chat/messages", json={"content": "Next", "assistant": "Numbered"})
+
+    state = ChatState.load_from_disk("chat")
+    assert state.candidates is None
+    assert _contents(state.messages) == ["Hello", _contents(candidates[0])[0], "Next", "Reply 4"]
+    assert (await client.post("/chats/chat/candidates/1/select")).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_select_waits_for_queued_run(app_deps, client):
+    numbered = Numbered()
+    app_deps.register(numbered)
+    candidates = await _retry_with_candidates(client, 2)
+    await deps.run_queue.start(main.execute_run)
+    numbered.started.clear()
+    numbered.gate.clear()
+    message = {"content": "Next", "assistant": "Numbered", "wait": False}
+    assert (await client.post("/chats/chat/messages", json=message)).status_code == 202
+    await numbered.started.wait()
+
+    select = asyncio.create_task(client.post("/chats/chat/candidates/1/select"))
+    await asyncio.sleep(0.05)
+    assert not select.done()
+
+    numbered.gate.set()
+    # The queued run continued the chat, so the candidates were pruned
+    assert (await select).status_code == 404
+    messages = ChatState.load_from_disk("chat").messages
+    assert _contents(messages) == ["Hello", _contents(candidates[0])[0], "Next", "Reply 4"]
@@ -0,0 +1,88 @@
+import asyncio
+import sys
+import tracemalloc
+
+import pytest
+
+import memory
+from akson import Chat, ChatState, Message
+from pubsub import PubSub
+from runs import RunManager
+
+
+class _Pool:
+    def stats(self) -> dict:
+        return {"server": "search", "sessions": 2, "idle": 1, "min_size": 1, "max_size": 4, "lazy": False}
+
+
+def test_deep_sizeof():
+    text = "x" * 1000
+    assert memory.deep_sizeof(text) == sys.getsizeof(text)
+    # Shared objects are counted once
+    assert memory.deep_sizeof([text, text]) == sys.getsizeof([text, text]) + sys.getsizeof(text)
+    message = Message(role="user", content=text)
+    assert memory.deep_sizeof(message) > sys.getsizeof(text)
+
+
+@pytest.mark.asyncio
+async def test_report():
+    pubsub = PubSub()
+    runs = RunManager()
+    chat = Chat(state=ChatState(id="memory-chat", messages=[Message(role="user", content="Hello")]))
+    release = asyncio.Event()
+
+    async with pubsub.subscribe("memory-chat"):
+        await pubsub.publish("memory-chat", {"type": "a"})
+        await pubsub.publish_many("memory-chat", [{"type": "b"}, {"type": "c"}])
+        task = asyncio.create_task(runs.run(chat, release.wait()))
+        await asyncio.sleep(0)
+        report = memory.report(pubsub, runs, [_Pool()])
+        release.set()
+        await task
+
+    assert report["rss"] > 0 and report["peak_rss"] > 0
+    assert report["tasks"] >= 2
+    [chat_report] = [item for item in report["chats"] if item["id"] == "memory-chat"]
+    assert (chat_report["messages"], chat_report["new_messages"]) == (1, 0)
+    assert chat_report["bytes"] > 0
+    [topic] = report["topics"]
+    assert (topic["topic"], topic["subscribers"], topic["queued_messages"]) == ("memory-chat", 1, 2)
+    assert [run["chat_id"] for run in report["runs"]] == ["memory-chat"]
+    assert report["mcp_sessions"] == [_Pool().stats()]
+
+
+@pytest.fixture
+def snapshots():
+    snapshots = memory.Snapshots(max_snapshots=2)
+    yield snapshots
+    snapshots.stop()
+
+
+def test_snapshot_requires_tracemalloc(snapshots):
+    assert not tracemalloc.is_tracing()
+    with pytest.raises(RuntimeError):
+        snapshots.take()
+
+
+def test_snapshot_diff(snapshots):
+    snapshots.start()
+    old = snapshots.take()
+    leak = [bytearray(1000) for _ in range(100)]
+    new = snapshots.take()
+
+    [top] = snapshots.diff(old, new, limit=1)
+    assert __file__ in top["location"]
+    assert top["bytes_diff"] >= 100 * 1000
+    assert top["count_diff"] >= 100
+    assert snapshots.top(new, limit=1)[0]["bytes"] >= 100 * 1000
+    del leak
+
+    # Only the latest snapshots are kept
+    latest = snapshots.take()
+    assert [item["id"] for item in snapshots.list_snapshots()] == [new, latest]
+    with pytest.raises(KeyError):
+        snapshots.diff(old, latest)
+
+    snapshots.stop()
+    assert not tracemalloc.is_tracing()
+    assert snapshots.list_snapshots() == []
@@ -0,0 +1,96 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Metrics created by the test are not added to the registry of the process."""
+    monkeypatch.setattr(metrics, "registry", [])
+    return metrics.registry
+
+
+def test_counter_labels():
+    counter = metrics.Counter("test_requests_total", "Requests.", ("route", "status"))
+    counter.labels("/chats", "200").inc()
+    counter.labels("/chats", "200").inc(2)
+    counter.labels("/", "500").inc()
+
+    assert counter.labels("/chats", "200") is counter.labels("/chats", "200")
+    assert counter.snapshot() == [
+        {"labels": {"route": "/", "status": "500"}, "value": 1},
+        {"labels": {"route": "/chats", "status": "200"}, "value": 3},
+    ]
+    with pytest.raises(AssertionError, match="expects labels"):
+        counter.labels("/chats")
+
+
+def test_render(registry):
+    counter = metrics.Counter("test_errors_total", "Errors.", ("message",))
+    counter.labels('Say "hi"\nC:\\').inc()
+    gauge = metrics.Gauge("test_in_progress", "Requests in progress.")
+    gauge.labels().inc(3)
+    gauge.labels().dec()
+
+    assert registry == [counter, gauge]
+    assert metrics.render() == (
+        "# HELP test_errors_total Errors.\n"
+        "# TYPE test_errors_total counter\n"
+        'test_errors_total{message="Say \\"hi\\"\\nC:\\\\"} 1.0\n'
+        "# HELP test_in_progress Requests in progress.\n"
+        "# TYPE test_in_progress gauge\n"
+        "test_in_progress 2.0\n"
+    )
+    assert metrics.snapshot() == {
+        "test_errors_total": [{"labels": {"message": 'Say "hi"\nC:\\'}, "value": 1}],
+        "test_in_progress": [{"labels": {}, "value": 2}],
+    }
+
+
+def test_histogram():
+    histogram = metrics.Histogram("test_duration_seconds", "Duration.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.labels("/").observe(value)
+
+    assert histogram.render() == [
+        'test_duration_seconds_bucket{route="/",le="0.1"} 2',
+        'test_duration_seconds_bucket{route="/",le="1.0"} 3',
+        'test_duration_seconds_bucket{route="/",le="+Inf"} 4',
+        'test_duration_seconds_sum{route="/"} 2.65',
+        'test_duration_seconds_count{route="/"} 4',
+    ]
+    snapshot = histogram.labels("/").snapshot()
+    assert (snapshot["count"], snapshot["p50"], snapshot["p90"]) == (4, 0.1, "+Inf")
+    assert metrics.HistogramValue((1.0,)).snapshot()["p50"] is None
+
+
+def test_gauge_function():
+    sessions = {"a": 2, "b": 1}
+    gauge = metrics.Gauge("test_sessions", "Sessions.", ("server",))
+    gauge.set_function(lambda: {(server,): count for server, count in sessions.items()})
+
+    assert gauge.render() == ['test_sessions{server="a"} 2', 'test_sessions{server="b"} 1']
+    # Values are computed when the metric is read, and removed label values are not reported
+    del sessions["a"]
+    sessions["b"] = 5
+    assert gauge.snapshot() == [{"labels": {"server": "b"}, "value": 5}]
+
+
+def test_timings():
+    histogram = metrics.Histogram("test_phase_seconds", "Phase.")
+    timings: dict[str, float] = {}
+    token = metrics.run_timings.set(timings)
+    try:
+        with metrics.timed(histogram.labels(), "llm"):
+            pass
+        metrics.add_timing("llm", 0.5)
+        metrics.add_timing("tools", 0.25)
+    finally:
+        metrics.run_timings.reset(token)
+
+    assert histogram.labels().count == 1
+    assert timings["llm"] >= 0.5
+    assert metrics.server_timing({"tools": 0.25}) == "tools;dur=250.0"
+    # Timings are not collected outside of a run
+    metrics.add_timing("llm", 1)
+    assert metrics.run_timings.get() is None
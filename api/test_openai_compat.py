@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import pytest
+
+import openai_compat
+from akson import Assistant, Chat
+from openai_compat import ChatCompletionRequest, _ChunkConverter
+from registry import Registry
+
+
+class Weather(Assistant):
+    """Calls a tool, then answers with the result of the tool."""
+
+    async def run(self, chat: Chat) -> None:
+        reply = await chat.reply("assistant", name=self.name)
+        await reply.add_chunk("Let me check.")
+        await reply.add_chunk("call1", field="tool_call.id")
+        await reply.add_chunk("weather", field="tool_call.name")
+        await reply.add_chunk('{"city": ', field="tool_call.arguments")
+        await reply.add_chunk('"Paris"}', field="tool_call.arguments")
+        await reply.end()
+
+        result = await chat.reply("tool", name="weather")
+        await result.add_chunk("call1", field="tool_call_id")
+        await result.add_chunk("Sunny")
+        await result.end()
+
+        answer = await chat.reply("assistant", name=self.name)
+        await answer.add_chunk("It is ")
+        await answer.add_chunk("sunny.")
+        await answer.end()
+
+
+class Hanging(Assistant):
+    """Replies with a partial message and waits until cancelled."""
+
+    def __init__(self):
+        super().__init__()
+        self.cancelled = asyncio.Event()
+
+    async def run(self, chat: Chat) -> None:
+        reply = await chat.reply("assistant", name=self.name)
+        await reply.add_chunk("partial")
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+
+
+def _request(model: str, stream: bool = False) -> ChatCompletionRequest:
+    return ChatCompletionRequest.model_validate(
+        {"model": model, "messages": [{"role": "user", "content": "Weather in Paris?"}], "stream": stream}
+    )
+
+
+async def _chunks(assistant: Assistant) -> list[dict]:
+    request = _request(assistant.name, stream=True)
+    events = openai_compat._stream(request, openai_compat._new_response(request.model), assistant)
+    return [json.loads(event["data"]) async for event in events if isinstance(event, dict)]
+
+
+def test_chunk_converter():
+    converter = _ChunkConverter()
+    messages = [
+        {"type": "begin_message", "id": "a1", "role": "assistant", "name": "A"},
+        {"type": "add_chunk", "id": "a1", "field": "content", "chunk": "Hi"},
+        {"type": "add_chunk", "id": "a1", "field": "tool_call.id", "chunk": "call1"},
+        {"type": "add_chunk", "id": "a1", "field": "tool_call.name", "chunk": "search"},
+        {"type": "add_chunk", "id": "a1", "field": "tool_call.arguments", "chunk": "{}"},
+        {"type": "end_message", "id": "a1"},
+        # Tool replies are not sent to the client
+        {"type": "begin_message", "id": "t1", "role": "tool", "name": "search"},
+        {"type": "add_chunk", "id": "t1", "field": "content", "chunk": "result"},
+        {"type": "begin_message", "id": "a2", "role": "assistant", "name": "A"},
+        {"type": "add_chunk", "id": "a2", "field": "tool_call.id", "chunk": "call2"},
+        {"type": "add_chunk", "id": "a2", "field": "content", "chunk": "Done"},
+        {"type": "add_chunk", "id": "a2", "field": "content", "chunk": "."},
+    ]
+    deltas = [delta for message in messages if (delta := converter.convert(message))]
+    assert deltas == [
+        {"content": "Hi"},
+        {"tool_calls": [{"index": 0, "id": "call1", "type": "function", "function": {}}]},
+        {"tool_calls": [{"index": 0, "function": {"name": "search"}}]},
+        {"tool_calls": [{"index": 0, "function": {"arguments": "{}"}}]},
+        {"tool_calls": [{"index": 1, "id": "call2", "type": "function", "function": {}}]},
+        {"content": "\n\nDone"},
+        {"content": "."},
+    ]
+
+
+def test_chunk_converter_ignores_tool_call_fields_without_id():
+    converter = _ChunkConverter()
+    converter.convert({"type": "begin_message", "id": "a1", "role": "assistant", "name": "A"})
+    assert converter.convert({"type": "add_chunk", "id": "a1", "field": "tool_call.name", "chunk": "x"}) is None
+
+
+@pytest.mark.asyncio
+async def test_streaming_matches_completion(monkeypatch):
+    registry = Registry()
+    registry.register(Weather())
+    monkeypatch.setattr(openai_compat, "registry", registry)
+
+    response = await openai_compat.create_completion(_request("Weather"))
+    content = response.choices[0].message.content
+    assert content == "Let me check.\n\nIt is sunny."
+
+    chunks = await _chunks(registry.get_assistant("Weather"))
+    deltas = [chunk["choices"][0]["delta"] for chunk in chunks]
+    assert "".join(delta.get("content", "") for delta in deltas) == content
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_run():
+    assistant = Hanging()
+    request = _request(assistant.name, stream=True)
+    events = openai_compat._stream(request, openai_compat._new_response(request.model), assistant)
+    assert json.loads((await anext(events))["data"])["choices"][0]["delta"] == {"role": "assistant", "content": ""}
+    assert json.loads((await anext(events))["data"])["choices"][0]["delta"] == {"content": "partial"}
+
+    # Closed by the server when the client disconnects
+    await events.aclose()
+    assert assistant.cancelled.is_set()
@@ -0,0 +1,58 @@
+import pytest
+
+import metrics
+from pubsub import Batch, PubSub, messages_dropped, messages_published, subscribers
+
+
+@pytest.mark.asyncio
+async def test_publish():
+    pubsub = PubSub()
+    published = messages_published.labels().value
+    dropped = messages_dropped.labels().value
+
+    # No subscribers, nothing is delivered or dropped
+    assert await pubsub.publish("chat1", {"type": "a"}) == 0
+
+    async with pubsub.subscribe("chat1") as first, pubsub.subscribe("chat1") as second:
+        assert await pubsub.publish("chat1", {"type": "b"}) == 2
+        assert await pubsub.publish_many("chat1", [{"type": "c"}, {"type": "d"}]) == 2
+        assert await pubsub.publish("chat2", {"type": "e"}) == 0
+        for queue in (first, second):
+            assert queue.get_nowait() == {"type": "b"}
+            batch = queue.get_nowait()
+            assert isinstance(batch, Batch) and batch == [{"type": "c"}, {"type": "d"}]
+            assert queue.empty()
+
+    assert messages_published.labels().value - published == 6
+    assert messages_dropped.labels().value == dropped
+    assert await pubsub.publish("chat1", {"type": "f"}) == 0
+    assert pubsub.queues() == {}
+
+
+@pytest.mark.asyncio
+async def test_subscribers_by_topic():
+    pubsub = PubSub()
+    pubsub.register_metrics()
+    async with pubsub.subscribe("chat1"), pubsub.subscribe("chat1"), pubsub.subscribe("chat2"):
+        values = {labels["topic"]: value.value for labels, value in subscribers.items()}
+        assert values == {"chat1": 2, "chat2": 1}
+        assert 'pubsub_subscribers{topic="chat1"} 2' in metrics.render()
+    assert subscribers.items() == []
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_messages():
+    pubsub = PubSub(max_queue_size=2)
+    published = messages_published.labels().value
+    dropped = messages_dropped.labels().value
+
+    async with pubsub.subscribe("chat1") as slow, pubsub.subscribe("chat1") as fast:
+        await pubsub.publish("chat1", {"type": "a"})
+        await pubsub.publish_many("chat1", [{"type": "b"}, {"type": "c"}])
+        assert fast.get_nowait() == {"type": "a"}
+        # The batch of 2 messages takes a single slot
+        assert await pubsub.publish("chat1", {"type": "d"}) == 2
+        assert slow.qsize() == 2 and fast.qsize() == 2
+
+    assert messages_published.labels().value - published == 7
+    assert messages_dropped.labels().value - dropped == 1
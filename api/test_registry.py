@@ -0,0 +1,107 @@
+import sys
+
+import pytest
+
+from framework import LLMAssistant
+from registry import Registry, UnknownAssistant
+
+HEADER = "from framework import LLMAssistant\n\n"
+
+
+@pytest.fixture
+def assistants_dir(data_dir, monkeypatch):
+    """Directory of assistant modules. Modules imported by the test are removed from sys.modules after the test."""
+    (data_dir / "assistants").mkdir()
+    # assistants is a namespace package, so its path includes the directory of the test.
+    monkeypatch.syspath_prepend(str(data_dir))
+    modules = set(sys.modules)
+    yield data_dir / "assistants"
+    for module in set(sys.modules) - modules:
+        del sys.modules[module]
+
+
+def _write(directory, module: str, *names: str, source: str = ""):
+    assistants = "".join(f"{name.lower()} = LLMAssistant(name={name!r}, model='gpt-4.1')\n" for name in names)
+    (directory / f"{module}.py").write_text(HEADER + assistants + source)
+
+
+def test_lazy_registry_imports_on_first_use(assistants_dir):
+    _write(assistants_dir, "lazy_math", "Mathematician")
+    _write(assistants_dir, "lazy_poets", "Poet", "Novelist")
+    registry = Registry(lazy=True)
+
+    assert registry.names == ["Mathematician", "Novelist", "Poet"]
+    assert "assistants.lazy_math" not in sys.modules
+
+    assert registry.get_assistant("mathematician").name == "Mathematician"
+    assert "assistants.lazy_math" in sys.modules
+    assert "assistants.lazy_poets" not in sys.modules
+    # A unique prefix is enough
+    assert registry.get_assistant("nov").name == "Novelist"
+    # Imported with the module of the other assistant
+    assert "poet" in registry._assistants
+    assert registry.names == ["Mathematician", "Novelist", "Poet"]
+
+
+def test_lazy_registry_prefix_must_be_unique(assistants_dir):
+    _write(assistants_dir, "lazy_claudes", "Claude", "ClaudeHaiku")
+    registry = Registry(lazy=True)
+
+    with pytest.raises(UnknownAssistant):
+        registry.get_assistant("cla")
+    with pytest.raises(UnknownAssistant):
+        registry.get_assistant("missing")
+    assert "assistants.lazy_claudes" not in sys.modules
+    # An exact match wins over the longer name
+    assert registry.get_assistant("claude").name == "Claude"
+
+
+def test_lazy_registry_imports_unresolved_modules_at_start(assistants_dir):
+    _write(
+        assistants_dir,
+        "lazy_conditional",
+        source="chosen = LLMAssistant(name='Chosen', model='gpt-4.1') if True else None\n",
+    )
+    registry = Registry(lazy=True)
+
+    assert "assistants.lazy_conditional" in sys.modules
+    assert registry.names == ["Chosen"]
+
+
+def test_lazy_registry_all_assistants(assistants_dir):
+    _write(assistants_dir, "lazy_first", "First")
+    _write(assistants_dir, "lazy_second", "Second")
+    registry = Registry(lazy=True)
+
+    assert [assistant.name for assistant in registry.assistants] == ["First", "Second"]
+    assert not registry._pending
+
+
+def test_lazy_registry_duplicates(assistants_dir):
+    _write(assistants_dir, "lazy_one", "Twin")
+    _write(assistants_dir, "lazy_two", "twin")
+    with pytest.raises(Exception, match="Duplicate assistant found"):
+        Registry(lazy=True)
+
+
+def test_register_duplicate_of_pending(assistants_dir):
+    _write(assistants_dir, "lazy_pending", "Pending")
+    registry = Registry(lazy=True)
+
+    with pytest.raises(Exception, match="Duplicate assistant found"):
+        registry.register(LLMAssistant(name="pending", model="gpt-4.1"))
+    assert "assistants.lazy_pending" not in sys.modules
+
+
+def test_scanned_name_not_found_after_import(assistants_dir, caplog):
+    _write(
+        assistants_dir,
+        "lazy_renamed",
+        source="renamed = LLMAssistant('Scanned', model='gpt-4.1')\nrenamed.name = 'Real'\n",
+    )
+    registry = Registry(lazy=True)
+
+    with pytest.raises(UnknownAssistant):
+        registry.get_assistant("scanned")
+    assert "Assistants not found in module assistants.lazy_renamed: scanned" in caplog.text
+    assert registry.get_assistant("real").name == "Real"
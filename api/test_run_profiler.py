@@ -0,0 +1,45 @@
+import pstats
+import time
+
+from run_profiler import Profiler
+
+
+def test_profile_run_counts_only_captured_runs(data_dir):
+    profiler = Profiler()
+    profiler.arm("Echo", 2, "cprofile")
+
+    with profiler.capture("process") as busy:
+        assert busy
+        # Not profiled, because another capture is active
+        with profiler.profile_run("echo") as capture:
+            assert capture is None
+    assert profiler.armed == {"echo": (2, "cprofile")}
+
+    paths = []
+    for _ in range(3):
+        with profiler.profile_run("Echo") as capture:
+            if capture:
+                paths.append(capture.path)
+    assert len(paths) == 2
+    assert profiler.armed == {}
+
+    assert len(profiler.list_profiles()) == 3
+    assert [path.endswith("-run-Echo.prof") for path in paths] == [True, True]
+    # Written in the format of cProfile
+    pstats.Stats(paths[0])
+
+
+def test_sampled_capture(data_dir):
+    profiler = Profiler()
+    with profiler.capture("busy loop") as capture:
+        assert capture and capture._sampler
+        # Keeps the thread busy until it is sampled
+        deadline = time.monotonic() + 5
+        while not capture._sampler.stacks and time.monotonic() < deadline:
+            pass
+
+    assert capture.path.endswith("-busy_loop.folded")
+    with open(capture.path) as f:
+        stack, count = f.readline().rsplit(" ", 1)
+    assert "test_sampled_capture" in stack
+    assert int(count) >= 1
@@ -0,0 +1,301 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pytest
+import pytest_asyncio
+from starlette.requests import Request
+
+from akson import Chat, ChatState, Message
+from runs import RunCancelled, RunManager, RunQueue, RunState, RunStatus
+
+
+async def _partial_reply(chat: Chat, started: asyncio.Event):
+    reply = await chat.reply("assistant", name="Slow")
+    await reply.add_chunk("partial")
+    await reply.end()
+    started.set()
+    await asyncio.sleep(3600)
+
+
+@pytest.mark.asyncio
+async def test_cancel_run(data_dir):
+    runs = RunManager()
+    chat = Chat(state=ChatState(id="chat"))
+    started = asyncio.Event()
+    task = asyncio.create_task(runs.run(chat, _partial_reply(chat, started)))
+    await started.wait()
+    assert runs.is_running("chat")
+    assert runs.in_progress() == [chat]
+
+    assert await runs.cancel("chat") == 1
+    with pytest.raises(RunCancelled):
+        await task
+    assert not runs.is_running("chat")
+    assert runs.in_progress() == []
+    # Saved when the run is cancelled
+    assert [message.content for message in ChatState.load_from_disk("chat").messages] == ["partial"]
+    assert await runs.cancel("chat") == 0
+
+
+@pytest.mark.asyncio
+async def test_cancel_does_not_affect_other_chats(data_dir):
+    runs = RunManager()
+    chats = [Chat(state=ChatState(id="chat1")), Chat(state=ChatState(id="chat2"))]
+    events = [asyncio.Event(), asyncio.Event()]
+    tasks = [asyncio.create_task(runs.run(chat, _partial_reply(chat, e))) for chat, e in zip(chats, events)]
+    await asyncio.gather(*(event.wait() for event in events))
+
+    assert await runs.cancel("chat1") == 1
+    with pytest.raises(RunCancelled):
+        await tasks[0]
+    assert runs.is_running("chat2")
+    tasks[1].cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await tasks[1]
+    assert not runs.is_running("chat2")
+
+
+@pytest.mark.asyncio
+async def test_cancel_on_disconnect(data_dir):
+    runs = RunManager(disconnect_poll_interval=0.01)
+    disconnected = asyncio.Event()
+
+    async def receive() -> dict:
+        if not disconnected.is_set():
+            # Cancelled by the disconnect check
+            await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    request = Request({"type": "http"}, receive)
+    chat = Chat(state=ChatState(id="chat"))
+    started = asyncio.Event()
+    task = asyncio.create_task(runs.run(chat, _partial_reply(chat, started), request=request))
+    await started.wait()
+    await asyncio.sleep(0.05)
+    assert not task.done()
+
+    disconnected.set()
+    with pytest.raises(RunCancelled):
+        await asyncio.wait_for(task, 1)
+    assert not runs.is_running("chat")
+    assert ChatState.load_from_disk("chat").messages[0].content == "partial"
+
+
+@pytest.mark.asyncio
+async def test_run_result(data_dir):
+    runs = RunManager()
+    chat = Chat(state=ChatState(id="chat"))
+
+    async def answer():
+        return 42
+
+    assert await runs.run(chat, answer()) == 42
+    assert not runs.is_running("chat")
+
+
+def _run(chat_id: str, content: str = "Hello") -> RunState:
+    return RunState(chat_id=chat_id, assistant="Test", message=Message(role="user", content=content))
+
+
+class Executor:
+    """Executes runs when they are released by the test."""
+
+    def __init__(self):
+        self.started: list[str] = []
+        self.active: set[str] = set()
+        self.max_active_per_chat = 0
+        self._release: dict[str, asyncio.Event] = {}
+
+    def release(self, run: RunState):
+        self._release.setdefault(run.id, asyncio.Event()).set()
+
+    async def __call__(self, run: RunState) -> list[Message]:
+        self.started.append(run.message.content)
+        self.active.add(run.id)
+        self.max_active_per_chat = max(
+            self.max_active_per_chat,
+            len([r for r in self.active if r.startswith(run.chat_id)]),
+        )
+        try:
+            await self._release.setdefault(run.id, asyncio.Event()).wait()
+        finally:
+            self.active.discard(run.id)
+        return [Message(role="assistant", content=f"Reply to {run.message.content}")]
+
+
+async def _wait_for(condition, timeout: float = 1):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.001)
+
+
+@pytest_asyncio.fixture
+async def queue(data_dir):
+    queue = RunQueue(workers=2)
+    yield queue
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_busy_chat_does_not_hold_workers(queue):
+    executor = Executor()
+    await queue.start(executor)
+    busy = [queue.submit(_run("busy", f"busy{i}")) for i in range(3)]
+    await _wait_for(lambda: executor.started == ["busy0"])
+
+    # Queued runs of the busy chat do not take the other worker.
+    other = queue.submit(_run("other", "other"))
+    await _wait_for(lambda: "other" in executor.started)
+    executor.release(other)
+    await _wait_for(lambda: other.status == RunStatus.COMPLETED)
+    assert other.messages[0].content == "Reply to other"
+    assert busy[1].status == RunStatus.QUEUED
+
+    for run in busy:
+        executor.release(run)
+    await _wait_for(lambda: all(run.status == RunStatus.COMPLETED for run in busy))
+    assert executor.started == ["busy0", "other", "busy1", "busy2"]
+    assert RunState.load_from_disk(busy[2].id).status == RunStatus.COMPLETED
+
+
+@pytest.mark.asyncio
+async def test_exclusive(queue):
+    executor = Executor()
+    await queue.start(executor)
+    first = queue.submit(_run("chat", "first"))
+    await _wait_for(lambda: executor.started == ["first"])
+
+    entered = asyncio.Event()
+    release = asyncio.Event()
+
+    async def synchronous_run():
+        async with queue.exclusive("chat"):
+            entered.set()
+            await release.wait()
+
+    task = asyncio.create_task(synchronous_run())
+    second = queue.submit(_run("chat", "second"))
+    await asyncio.sleep(0.01)
+    # Waits for the queued run in progress
+    assert not entered.is_set()
+
+    executor.release(first)
+    await entered.wait()
+    # Waiting synchronous runs go before the queued runs
+    assert second.status == RunStatus.QUEUED
+    await asyncio.sleep(0.01)
+    assert executor.started == ["first"]
+
+    release.set()
+    await task
+    await _wait_for(lambda: executor.started == ["first", "second"])
+    executor.release(second)
+    await _wait_for(lambda: second.status == RunStatus.COMPLETED)
+    assert not queue._chats
+
+
+@pytest.mark.asyncio
+async def test_exclusive_cancelled_while_waiting(queue):
+    executor = Executor()
+    await queue.start(executor)
+    first = queue.submit(_run("chat", "first"))
+    await _wait_for(lambda: executor.started == ["first"])
+
+    async def synchronous_run():
+        async with queue.exclusive("chat"):
+            pass
+
+    task = asyncio.create_task(synchronous_run())
+    await asyncio.sleep(0.01)
+    task.cancel()
+    second = queue.submit(_run("chat", "second"))
+    executor.release(first)
+    await _wait_for(lambda: executor.started == ["first", "second"])
+    executor.release(second)
+    await _wait_for(lambda: second.status == RunStatus.COMPLETED)
+
+
+@pytest.mark.asyncio
+async def test_cancel_queued_runs(queue):
+    executor = Executor()
+    await queue.start(executor)
+    first = queue.submit(_run("chat", "first"))
+    second = queue.submit(_run("chat", "second"))
+    await _wait_for(lambda: executor.started == ["first"])
+
+    assert queue.cancel("chat") == 1
+    assert second.status == RunStatus.CANCELLED
+    executor.release(first)
+    await _wait_for(lambda: first.status == RunStatus.COMPLETED)
+    await asyncio.sleep(0.01)
+    assert executor.started == ["first"]
+    assert queue.find("chat", second.message.id) is second
+
+
+@pytest.mark.asyncio
+async def test_failed_run(queue):
+    async def execute(run: RunState) -> list[Message]:
+        raise ValueError("broken")
+
+    await queue.start(execute)
+    run = queue.submit(_run("chat"))
+    await _wait_for(lambda: run.finished)
+    assert run.status == RunStatus.FAILED
+    assert run.error == "broken"
+
+
+def _save(run: RunState, status: RunStatus, finished_at: Optional[datetime] = None) -> RunState:
+    run.status = status
+    run.finished_at = finished_at
+    run.save_to_disk()
+    return run
+
+
+def _status(queue: RunQueue, run_id: str) -> Optional[RunStatus]:
+    run = queue.get(run_id)
+    return run.status if run else None
+
+
+@pytest.mark.parametrize("resume", [True, False])
+@pytest.mark.asyncio
+async def test_recover(data_dir, resume):
+    interrupted = _save(_run("chat1"), RunStatus.RUNNING)
+    queued = _save(_run("chat2"), RunStatus.QUEUED)
+    recent = _save(_run("chat3"), RunStatus.COMPLETED, datetime.now())
+    expired = _save(_run("chat4"), RunStatus.COMPLETED, datetime.now() - timedelta(days=2))
+
+    executor = Executor()
+    executor.release(queued)
+    queue = RunQueue(workers=1, resume=resume)
+    await queue.start(executor)
+    try:
+        interrupted = queue.get(interrupted.id)
+        assert interrupted and interrupted.status == RunStatus.FAILED
+        assert interrupted.error == "Interrupted by server restart"
+        if resume:
+            await _wait_for(lambda: _status(queue, queued.id) == RunStatus.COMPLETED)
+        else:
+            failed = queue.get(queued.id)
+            assert failed and failed.status == RunStatus.FAILED
+            assert failed.error == "Server restarted before the run started"
+            assert executor.started == []
+        assert queue.find("chat3", recent.message.id)
+        assert queue.get(expired.id) is None
+        assert not os.path.exists(RunState.file_path(expired.id))
+    finally:
+        await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_prune(data_dir):
+    queue = RunQueue(retention=timedelta(seconds=0))
+    old = _save(_run("chat"), RunStatus.COMPLETED, datetime.now() - timedelta(seconds=1))
+    queue._add(old)
+    queued = queue.submit(_run("chat"))
+
+    assert queue.get(old.id) is None
+    assert queue.find("chat", old.message.id) is None
+    assert not os.path.exists(RunState.file_path(old.id))
+    assert queue.get(queued.id) is queued
@@ -41,6 +41,29 @@ class AksonClient:
         response.raise_for_status()
         return response.json()
 
+    async def queue_message(
+        self, chat_id: str, content: str, *, assistant: Optional[str] = None, message_id: Optional[str] = None
+    ) -> dict:
+        """Queue the message without waiting for the assistant. Returns the run. Output is sent over chat events."""
+        data = {"content": content, "wait": False}
+        if assistant:
+            data["assistant"] = assistant
+        if message_id:
+            data["id"] = message_id
+        response = await self.client.post(f"/chats/{chat_id}/messages", json=data)
+        response.raise_for_status()
+        return response.json()
+
+    async def get_run(self, run_id: str) -> dict:
+        response = await self.client.get(f"/runs/{run_id}")
+        response.raise_for_status()
+        return response.json()
+
+    async def cancel(self, chat_id: str) -> int:
+        response = await self.client.post(f"/chats/{chat_id}/cancel")
+        response.raise_for_status()
+        return response.json()["cancelled"]
+
     async def stream_events(self, chat_id: str):
         while True:
             try:
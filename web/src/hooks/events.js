@@ -11,6 +11,11 @@ export function useEvents(chatId, setMessages, setSelectedAssistant) {
       const data = JSON.parse(event.data);
       console.log(data);
 
+      // Retries with candidates stream all of them concurrently. Only the first one is added to the history.
+      if (data.candidate > 0) {
+        return;
+      }
+
       if (data.type === "begin_message") {
         setMessages((prev) => [
           ...prev,